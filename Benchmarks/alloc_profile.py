@@ -0,0 +1,139 @@
+import argparse
+import functools
+import os
+import socket
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+
+# Make the server modules importable from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+
+import server  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def drain(sock):
+    """
+    Reads and discards everything that arrives on sock, like a fast viewer.
+    """
+    buffer = bytearray(1 << 20)
+    try:
+        while sock.recv_into(buffer):
+            pass
+    except OSError:
+        pass
+
+
+def profile(source, encoder, codec, width, height, frames, warmup, top):
+    """
+    Runs the capture, encode and send steps of the server for one frame at a
+    time under tracemalloc, with a viewer draining a socket pair.
+
+    Returns:
+    - The median and maximum of the extra memory one frame needed at its
+      peak (allocator churn), the growth of the traced memory over the
+      measured frames and the biggest growing call sites.
+    """
+    capture = synthetic.capture_factory(f"{source}:{width}x{height}")(0)
+    make_encoder = {
+        "full": server.FullFrameEncoder,
+        "delta": functools.partial(server.TileEncoder, keyframe_interval=10**9),
+    }[encoder]
+    frame_encoder = make_encoder(server.CODECS[codec])
+    sender, receiver = socket.socketpair()
+    threading.Thread(target=drain, args=(receiver,), daemon=True).start()
+    buffer = np.empty((0, 0, 3), np.uint8)
+    seq = 0
+
+    # The steps ScreenBroadcaster runs for every frame, on a single thread so
+    # that each measurement covers exactly one frame
+    def send_next():
+        nonlocal buffer, seq
+        buffer = capture.grab(out=buffer)
+        payload, keyframe = frame_encoder.encode(buffer, seq == 0)
+        if payload is None:
+            return
+        seq += 1
+        frame = server.EncodedFrame(
+            payload, seq, 0, keyframe, frame_encoder.codec.codec_id
+        )
+        server.send_frame(sender, server.PROTOCOL_VERSION, frame)
+
+    try:
+        for _ in range(warmup):
+            send_next()  # Let buffers and caches reach their steady state
+
+        tracemalloc.start(10)
+        send_next()
+        before = tracemalloc.take_snapshot()
+        start_size = tracemalloc.get_traced_memory()[0]
+        churn = []
+        for _ in range(frames):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            send_next()
+            churn.append(tracemalloc.get_traced_memory()[1] - current)
+        growth = tracemalloc.get_traced_memory()[0] - start_size
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        capture.close()
+        sender.close()
+        receiver.close()
+
+    sites = [
+        stat
+        for stat in after.compare_to(before, "lineno")
+        if stat.size_diff > 0 and "tracemalloc" not in stat.traceback[0].filename
+    ][:top]
+    return float(np.median(churn)), max(churn), growth, sites
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Allocation profile of the server's capture, encode and send "
+        "loop in steady state."
+    )
+    parser.add_argument("--sources", default="scroll,noise")
+    parser.add_argument("--encoders", default="full,delta")
+    parser.add_argument("--codecs", default="jpeg,zlib")
+    parser.add_argument("--resolution", default="1920x1080")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument(
+        "--top", type=int, default=0, help="Also list the top growing call sites"
+    )
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split("x"))
+
+    print(f"{args.resolution}, {args.frames} frames after {args.warmup} warm-up frames")
+    print(
+        f"{'source':7} {'encoder':7} {'codec':5} {'churn p50 MB':>13} "
+        f"{'churn max MB':>13} {'growth KB':>10}"
+    )
+    for source in args.sources.split(","):
+        for encoder in args.encoders.split(","):
+            for codec in args.codecs.split(","):
+                churn, churn_max, growth, sites = profile(
+                    source,
+                    encoder,
+                    codec,
+                    width,
+                    height,
+                    args.frames,
+                    args.warmup,
+                    args.top,
+                )
+                print(
+                    f"{source:7} {encoder:7} {codec:5} {churn / 1e6:13.2f} "
+                    f"{churn_max / 1e6:13.2f} {growth / 1e3:10.1f}"
+                )
+                for stat in sites:
+                    print(f"    {stat}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from mss import mss
+from screeninfo import get_monitors
+
+# Make the server modules importable when running from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+
+from server import ScreenCapture, convert_bgra  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def legacy_capture(screen_number):
+    """
+    The original per-frame capture path: query the monitors and open a new mss
+    context for every single frame.
+    """
+    monitor = get_monitors()[screen_number]
+    with mss() as sct:
+        sct_img = sct.grab(
+            {
+                "top": monitor.y,
+                "left": monitor.x,
+                "width": monitor.width,
+                "height": monitor.height,
+            }
+        )
+        return cv2.cvtColor(np.array(sct_img), cv2.COLOR_BGRA2BGR)
+
+
+def synthetic_shots(source, count=4):
+    """
+    Generates raw BGRA frames, as mss returns them, from a synthetic source.
+
+    Returns:
+    - A list of (raw bytes, width, height) tuples.
+    """
+    capture = synthetic.capture_factory(source)(0)
+    shots = []
+    for _ in range(count):
+        frame = capture.grab()
+        bgra = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA)
+        shots.append((bytearray(bgra.tobytes()), frame.shape[1], frame.shape[0]))
+    return shots
+
+
+def measure_fps(grab, duration):
+    """
+    Calls grab() repeatedly for the given number of seconds.
+
+    Returns:
+    - The achieved frames per second.
+    """
+    grab()  # Warm up outside of the measured window
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        grab()
+        frames += 1
+    return frames / (time.perf_counter() - start)
+
+
+def compare_screen(screen_number, duration):
+    """
+    Measures the original per-frame capture path against ScreenCapture on a
+    real screen.
+
+    Returns:
+    - The frames per second before and after.
+    """
+    before = measure_fps(lambda: legacy_capture(screen_number), duration)
+    capture = ScreenCapture(screen_number)
+    try:
+        after = measure_fps(capture.grab, duration)
+    finally:
+        capture.close()
+    return before, after
+
+
+def compare_conversion(source, duration):
+    """
+    Measures the conversion of raw BGRA frames from a synthetic source, copied
+    into a new array per frame as before, against ScreenCapture's conversion
+    into a reused buffer. The mss and screeninfo setup the engine also saves
+    needs a display and is not part of this measurement.
+
+    Returns:
+    - The frames per second before and after.
+    """
+    shots = synthetic_shots(source)
+    index = 0
+
+    def next_shot():
+        nonlocal index
+        index = (index + 1) % len(shots)
+        return shots[index]
+
+    def legacy_convert():
+        raw, width, height = next_shot()
+        bgra = np.array(np.frombuffer(raw, np.uint8).reshape(height, width, 4))
+        return cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
+
+    out = np.empty((shots[0][2], shots[0][1], 3), np.uint8)
+    before = measure_fps(legacy_convert, duration)
+    after = measure_fps(lambda: convert_bgra(next_shot()[0], out), duration)
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Frames per second of the original per-frame capture path "
+        "against the persistent ScreenCapture engine."
+    )
+    parser.add_argument("screen", type=int, nargs="?", default=0, help="Screen index")
+    parser.add_argument(
+        "--seconds", type=float, default=5.0, help="Seconds measured per path"
+    )
+    parser.add_argument(
+        "--source",
+        help="Compare only the BGRA to BGR conversion on generated frames "
+        "(static|scroll|noise[:WxH]), for machines without a display",
+    )
+    args = parser.parse_args()
+
+    if args.source:
+        before, after = compare_conversion(args.source, args.seconds)
+        print(f"per-frame copy and convert:     {before:7.1f} fps")
+        print(f"convert into reused buffer:     {after:7.1f} fps")
+    else:
+        before, after = compare_screen(args.screen, args.seconds)
+        print(f"per-frame mss()/get_monitors(): {before:7.1f} fps")
+        print(f"persistent ScreenCapture:       {after:7.1f} fps")
+    print(f"speedup:                        {after / before:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
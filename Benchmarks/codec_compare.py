@@ -0,0 +1,110 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Make the server and client modules importable from the repository root
+root = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(root, "Server"))
+sys.path.insert(0, os.path.join(root, "Client"))
+
+import client  # noqa: E402
+import server  # noqa: E402
+
+
+def synthetic_frames(width, height):
+    """
+    Builds one frame per kind of screen content.
+
+    Returns:
+    - A dict mapping the content name to a BGR image.
+    """
+    rng = np.random.default_rng(0)
+
+    # Dark text on a light background, like an editor or a terminal
+    text = np.full((height, width, 3), 245, np.uint8)
+    for line, y in enumerate(range(30, height, 22)):
+        cv2.putText(
+            text,
+            f"{line:04d} def capture(self, frame): return frame[::2] + offset",
+            (10, y),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.55,
+            (30, 30, 30),
+            1,
+            cv2.LINE_AA,
+        )
+
+    # Smooth gradients with a little grain, like a photo or a video
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    photo = np.dstack([x + 0 * y, y + 0 * x, (x + y) / 2])
+    photo += rng.normal(0, 6, photo.shape)
+    photo = np.clip(photo, 0, 255).astype(np.uint8)
+
+    # Full-motion noise, the worst case for every codec
+    noise = rng.integers(0, 256, (height, width, 3), np.uint8)
+
+    return {"text": text, "photo": photo, "noise": noise}
+
+
+def median_time(function, repeat):
+    """
+    Runs function repeat times.
+
+    Returns:
+    - The median duration in milliseconds and the last result.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations)) * 1000, result
+
+
+def psnr(reference, image):
+    """
+    Peak signal-to-noise ratio in dB, infinite for identical images.
+    """
+    error = np.mean((reference.astype(np.float32) - image) ** 2)
+    return float("inf") if error == 0 else 10 * np.log10(255**2 / error)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Size, encode and decode time and quality of every codec on "
+        "text, photo and noise frames."
+    )
+    parser.add_argument("--resolution", default="1920x1080", help="Frame size WxH")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per median")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.resolution.split("x"))
+    repeat = args.repeat
+
+    print(f"{width}x{height}, median of {repeat} runs, quality 80")
+    print(
+        f"{'content':8} {'codec':6} {'bytes':>10} {'ratio':>7} "
+        f"{'encode ms':>10} {'decode ms':>10} {'PSNR dB':>8}"
+    )
+    for content, frame in synthetic_frames(width, height).items():
+        for codec in server.CODECS.values():
+            encode_ms, payload = median_time(
+                lambda: server.pack_keyframe(codec, codec.encode(frame, 80)), repeat
+            )
+            payload = memoryview(b"".join(payload))  # As the client receives it
+            decode_ms, decoded = median_time(
+                lambda: client.decode_keyframe(payload), repeat
+            )
+            print(
+                f"{content:8} {codec.name:6} {len(payload):10d} "
+                f"{frame.nbytes / len(payload):7.1f} {encode_ms:10.2f} "
+                f"{decode_ms:10.2f} {psnr(frame, decoded):8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def load_modules(root):
+    """
+    Imports client_files and server_files from the checkout at root, so the
+    same benchmark can measure the transfer path of another commit.
+    """
+    sys.path.insert(0, os.path.join(root, "Client"))
+    sys.path.insert(0, os.path.join(root, "Server"))
+    return (
+        importlib.import_module("client_files"),
+        importlib.import_module("server_files"),
+    )
+
+
+def transfer(client_files, server_files, source, directory, key, iv, options):
+    """
+    Sends source with client_files.send_file to server_files.receive_file over
+    loopback TCP connections, both in this process.
+
+    Parameters:
+    - options: Extra keyword arguments of send_file, like connections and
+      chunk_size for a parallel transfer, block_size for a delta transfer or
+      compression for a compressed one.
+
+    Returns:
+    - The wall time and the CPU time of the transfer in seconds.
+    """
+    connections = options.get("connections", 1)
+    listener = socket.create_server(("127.0.0.1", 0), backlog=connections + 1)
+    sender = socket.create_connection(listener.getsockname())
+    conn = listener.accept()[0]
+    sessions = {}
+    errors = []
+
+    def receive():
+        try:
+            if hasattr(server_files, "receive_chunks"):
+                server_files.receive_file(conn, key, iv, directory, sessions)
+            else:  # Versions without chunked transfers
+                server_files.receive_file(conn, key, iv, directory)
+        except Exception as e:  # Reported after the transfer
+            errors.append(e)
+            conn.shutdown(socket.SHUT_RDWR)  # Unblock the sender
+
+    def receive_chunks(chunk_conn):
+        try:
+            server_files.receive_chunks(chunk_conn, key, iv, sessions)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunk_conn.close()
+
+    def accept_chunks():
+        for _ in range(connections - 1):  # The first connection sends chunks too
+            chunk_conn = listener.accept()[0]
+            threading.Thread(target=receive_chunks, args=(chunk_conn,)).start()
+
+    receivers = [threading.Thread(target=receive)]
+    if connections > 1:
+        receivers.append(threading.Thread(target=accept_chunks))
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for receiver in receivers:
+            receiver.start()
+        client_files.send_file(sender, source, key, iv, **options)
+        for receiver in receivers:
+            receiver.join()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    sender.close()
+    conn.close()
+    listener.close()
+    if errors:
+        raise errors[0]
+    return elapsed, cpu
+
+
+def log_lines(rng, size):
+    """
+    Generates size bytes of log lines made of a few hundred distinct
+    messages, timestamps and numbers.
+    """
+    messages = [f"worker {i % 7} handled request /api/v1/item/{i}" for i in range(300)]
+    lines = []
+    length = 0
+    while length < size:
+        for value in rng.integers(0, 1 << 20, 4096):
+            line = (
+                f"2026-10-18T12:{value % 60:02}:{value % 59:02}.{value % 1000:03}Z "
+                f"INFO {messages[value % len(messages)]} in {value % 997} ms\n"
+            ).encode()
+            lines.append(line)
+            length += len(line)
+    return b"".join(lines)[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="MB/s of the encrypted file transfer path over loopback, "
+        "without process start-up. Run it with --root pointing at another "
+        "checkout to compare two versions of client_files and server_files."
+    )
+    parser.add_argument("--root", default=os.path.join(os.path.dirname(__file__), ".."))
+    parser.add_argument("--sizes", default="16M,256M")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="Send every file in chunks over this many connections",
+    )
+    parser.add_argument("--chunk-size", type=int, help="Bytes per chunk")
+    parser.add_argument(
+        "--changed",
+        type=float,
+        help="Send deltas against a copy on the receiver where this fraction "
+        "of the 4 KiB pages differs",
+    )
+    parser.add_argument("--block-size", type=int, default=64 << 10)
+    parser.add_argument(
+        "--compress", help="Offer this compression codec (zlib, lz4 or zstd)"
+    )
+    parser.add_argument(
+        "--text",
+        action="store_true",
+        help="Send log lines, which compress well, instead of random bytes",
+    )
+    args = parser.parse_args()
+    options = {}
+    if args.connections > 1:
+        options["connections"] = args.connections
+    if args.chunk_size:
+        options["chunk_size"] = args.chunk_size
+    if args.changed is not None:
+        options["block_size"] = args.block_size
+    if args.compress:
+        options["compression"] = [args.compress]
+    client_files, server_files = load_modules(os.path.abspath(args.root))
+    key, iv = os.urandom(16), os.urandom(16)
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+    print(
+        f"{os.path.abspath(args.root)}, {args.connections} connection(s), "
+        + (f"{args.changed:.1%} changed, " if args.changed is not None else "")
+        + (f"{args.compress}, " if args.compress else "")
+        + ("text, " if args.text else "")
+        + f"median of {args.repeat} runs"
+    )
+    print(f"{'size':>6} {'MB/s':>8} {'CPU ns/byte':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.bin")
+        received = os.path.join(directory, "received")
+        os.makedirs(received)
+        for text in args.sizes.split(","):
+            size = int(text[:-1]) * units[text[-1]] if text[-1] in units else int(text)
+            rng = np.random.default_rng(size)
+            data = log_lines(rng, size) if args.text else rng.bytes(size)
+            with open(source, "wb") as file:
+                file.write(data)
+            if args.changed is not None:
+                # The receiver's older copy, with changes spread over the file
+                old = np.frombuffer(data, np.uint8).copy()
+                pages = np.flatnonzero(rng.random(-(-size // 4096)) < args.changed)
+                for page in pages:
+                    old[page * 4096 : page * 4096 + 4096] = rng.integers(0, 256, 4096)
+            runs = []
+            for _ in range(args.repeat):
+                if args.changed is not None:
+                    old.tofile(os.path.join(received, "source.bin"))
+                runs.append(
+                    transfer(
+                        client_files, server_files, source, received, key, iv, options
+                    )
+                )
+            elapsed, cpu = np.median(runs, axis=0)
+            print(f"{text:>6} {size / elapsed / 1e6:8.1f} {cpu / size * 1e9:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
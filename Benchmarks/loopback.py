@@ -0,0 +1,334 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Make the client modules importable from the repository root
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "Client"))
+
+import client  # noqa: E402
+
+SYNTHETIC = os.path.join(root, "Benchmarks", "synthetic.py")
+SERVER_FILES = os.path.join(root, "Server", "server_files.py")
+CLIENT_FILES = os.path.join(root, "Client", "client_files.py")
+
+
+def free_port():
+    """
+    Asks the kernel for a loopback port nobody listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    """
+    Connects to a freshly started server as soon as it accepts connections.
+
+    Returns:
+    - The connected socket.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def process_cpu(pid):
+    """
+    CPU seconds (user and system) a child process used so far, read from
+    /proc on Linux.
+
+    Returns:
+    - The seconds, or None on platforms without /proc.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15, the split starts at field 3
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentiles(samples):
+    """
+    p50/p95/p99 of a list of seconds, in milliseconds.
+    """
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99)) * 1000
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def bench_stream(source, args):
+    """
+    Streams a synthetic source from a server.py process to an in-process
+    headless viewer that receives, decodes and acknowledges every frame.
+
+    Returns:
+    - A dict with FPS, latency percentiles (capture to decoded), bytes per
+      frame, MB/s and CPU nanoseconds per byte of both processes.
+    """
+    port = free_port()
+    command = [
+        sys.executable,
+        SYNTHETIC,  # server.py on generated frames
+        f"{source}:{args.resolution}",
+        "127.0.0.1",
+        str(port),
+        "0",
+        "--fps",
+        str(args.fps),
+        "--codec",
+        args.codec,
+        "--stripes",
+        str(args.stripes),
+    ]
+    if args.delta:
+        command.append("--delta")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        sock = wait_for_port(port)
+        sock.sendall(client.pack_hello([0, 0], client.CODEC_IDS[args.codec]))
+        receiver = client.FrameReceiver(sock)
+        control = client.ControlSender(sock, receiver)
+        decoder = client.StreamDecoder()
+
+        # Let the pipeline warm up before measuring
+        warmup_end = time.monotonic() + args.warmup
+        while time.monotonic() < warmup_end:
+            frame_data = receiver.receive()
+            if frame_data is None:
+                raise ConnectionError("The server closed the stream")
+            if decoder.decode(frame_data) is not None:
+                control.ack()  # Like a viewer, which acknowledges from the start
+
+        latencies = []
+        frames = total_bytes = 0
+        server_cpu = process_cpu(server.pid)
+        client_cpu = time.process_time()
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration:
+            frame_data = receiver.receive()
+            if frame_data is None:
+                raise ConnectionError("The server closed the stream")
+            frames += 1
+            total_bytes += len(frame_data)
+            if decoder.decode(frame_data) is None:
+                control.send(client.MSG_KEYFRAME_REQUEST)
+                continue
+            control.ack()
+            # Server and viewer share the clock on loopback
+            latencies.append(time.time_ns() // 1000 - receiver.timestamp)
+        elapsed = time.monotonic() - start
+        client_cpu = time.process_time() - client_cpu
+        server_end = process_cpu(server.pid)
+        server_cpu = None if server_end is None else server_end - server_cpu
+        sock.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    cpu = client_cpu + (server_cpu or 0)
+    return {
+        "source": source,
+        "frames": frames,
+        "fps": round(frames / elapsed, 2),
+        "latency": percentiles([latency / 1e6 for latency in latencies]),
+        "bytes_per_frame": round(total_bytes / max(frames, 1)),
+        "mb_per_second": round(total_bytes / elapsed / 1e6, 3),
+        "server_cpu_seconds": None if server_cpu is None else round(server_cpu, 3),
+        "client_cpu_seconds": round(client_cpu, 3),
+        "cpu_ns_per_byte": round(cpu / max(total_bytes, 1) * 1e9, 3),
+    }
+
+
+def bench_file(size, args, directory):
+    """
+    Sends a generated file of size bytes from client_files.py to
+    server_files.py over loopback and checks the received copy.
+
+    Returns:
+    - A dict with the duration, MB/s, CPU nanoseconds per byte of both
+      processes and whether the received file matches the original.
+    """
+    source = os.path.join(directory, f"bench_{size}.bin")
+    received = os.path.join(directory, "received")
+    os.makedirs(received, exist_ok=True)
+    with open(source, "wb") as file:
+        file.write(np.random.default_rng(size).bytes(size))
+    key, iv = os.urandom(32).hex(), os.urandom(16).hex()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            SERVER_FILES,
+            "127.0.0.1",
+            str(port),
+            key,
+            iv,
+            received,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    # The server keeps accepting connections, and one that closes without
+    # sending anything is not a transfer, so probing the port is harmless
+    wait_for_port(port).close()
+    start = time.monotonic()
+    children_before = os.times()
+    try:
+        # The client exits once the server confirmed the verified file
+        sender = subprocess.run(
+            [sys.executable, CLIENT_FILES, "127.0.0.1", str(port), key, iv, source],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=args.file_timeout,
+        )
+        returncode = sender.returncode
+    except subprocess.TimeoutExpired:
+        returncode = None
+    elapsed = time.monotonic() - start
+    server.terminate()  # The server keeps accepting transfers otherwise
+    server.wait()
+    children = os.times()
+    cpu = (children.children_user - children_before.children_user) + (
+        children.children_system - children_before.children_system
+    )
+
+    copy = os.path.join(received, os.path.basename(source))
+    verified = (
+        returncode == 0 and os.path.exists(copy) and digest(copy) == digest(source)
+    )
+    for path in (source, copy):
+        if os.path.exists(path):
+            os.remove(path)
+    return {
+        "size": size,
+        "seconds": round(elapsed, 3),
+        "mb_per_second": round(size / elapsed / 1e6, 3),
+        "cpu_ns_per_byte": round(cpu / size * 1e9, 3),
+        "verified": verified,
+    }
+
+
+def digest(path):
+    """
+    SHA-256 of a file, read in 1 MiB blocks.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def parse_size(text):
+    """
+    Parses sizes like 512K, 16M or 1G into bytes.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Headless loopback benchmarks for screen streaming and file "
+        "transfer, printed as JSON."
+    )
+    parser.add_argument(
+        "--sources",
+        default="static,scroll,noise",
+        help="Synthetic frame sources to stream",
+    )
+    parser.add_argument("--resolution", default="1920x1080", help="Frame size WxH")
+    parser.add_argument("--codec", default="jpeg", choices=sorted(client.CODEC_IDS))
+    parser.add_argument("--delta", action="store_true", help="Stream delta frames")
+    parser.add_argument(
+        "--stripes", type=int, default=1, help="Keyframe stripes encoded in parallel"
+    )
+    parser.add_argument(
+        "--fps", type=float, default=0, help="Server frame rate, 0 is unlimited"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5, help="Seconds measured per source"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=1, help="Seconds before measuring"
+    )
+    parser.add_argument(
+        "--file-sizes",
+        default="1M,16M,64M",
+        help="Sizes of the generated files to transfer, empty to skip",
+    )
+    parser.add_argument(
+        "--file-timeout",
+        type=float,
+        default=120,
+        help="Seconds a file transfer may take before it counts as failed",
+    )
+    parser.add_argument("--output", help="Also write the JSON to this file")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": vars(args),
+        "stream": [],
+        "file": [],
+    }
+    for source in filter(None, args.sources.split(",")):
+        results["stream"].append(bench_stream(source, args))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in filter(None, args.file_sizes.split(",")):
+            results["file"].append(bench_file(parse_size(size), args, directory))
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+
+def git_commit():
+    """
+    The commit the benchmark ran on, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
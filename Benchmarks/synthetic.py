@@ -0,0 +1,115 @@
+import functools
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Make the server modules importable from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+
+import server  # noqa: E402
+
+
+# Capture engine that generates frames instead of grabbing a screen
+class SyntheticCapture:
+    """
+    Deterministic stand-in for ScreenCapture on machines without a display,
+    for benchmarks and headless CI.
+
+    kind selects the content: "static" shows the same page of text in every
+    frame, "scroll" scrolls a long page of text by scroll_step rows per frame
+    and "noise" cycles through pre-generated full-motion noise frames. The
+    content is seeded, so runs are comparable between commits.
+    """
+
+    KINDS = ("static", "scroll", "noise")
+
+    def __init__(self, kind, width=1920, height=1080, screen_number=0, scroll_step=8):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown synthetic source {kind!r}")
+        self.kind = kind
+        self.screen_number = screen_number
+        self.scroll_step = scroll_step
+        self.lock = threading.Lock()
+        self._shape = (height, width, 3)
+        self._offset = 0
+        rng = np.random.default_rng(screen_number)
+        if kind == "noise":
+            self._frames = [
+                rng.integers(0, 256, self._shape, np.uint8) for _ in range(4)
+            ]
+        else:
+            # A page of text twice the screen height that the scroll wraps around
+            self._page = np.full((2 * height, width, 3), 245, np.uint8)
+            for line, y in enumerate(range(24, 2 * height, 22)):
+                cv2.putText(
+                    self._page,
+                    f"{line:04d} {'def capture(self, frame): return frame' * 4}",
+                    (10, y),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.55,
+                    (30, 30, 30),
+                    1,
+                    cv2.LINE_AA,
+                )
+
+    # Produce the next frame, with the same buffer semantics as ScreenCapture.grab
+    def grab(self, out=None):
+        start = time.perf_counter()
+        if out is None or out.shape != self._shape:
+            out = np.empty(self._shape, np.uint8)
+        height = self._shape[0]
+        if self.kind == "noise":
+            out[:] = self._frames[self._offset % len(self._frames)]
+            self._offset += 1
+        else:
+            if self.kind == "scroll":
+                self._offset = (self._offset + self.scroll_step) % len(self._page)
+            # Copy the visible window, wrapping around the end of the page
+            first = min(height, len(self._page) - self._offset)
+            out[:first] = self._page[self._offset : self._offset + first]
+            out[first:] = self._page[: height - first]
+        server.stats.record("capture", time.perf_counter() - start)
+        return out
+
+    def close(self):
+        pass
+
+
+# Function to build a capture engine factory from a source description
+def capture_factory(source):
+    """
+    Parses "<kind>[:<width>x<height>]", where kind is one of
+    SyntheticCapture.KINDS.
+
+    Returns:
+    - A callable that creates the capture engine for a screen number.
+    """
+    kind, _, size = source.partition(":")
+    if kind not in SyntheticCapture.KINDS:
+        raise ValueError(f"Unknown synthetic source {source!r}")
+    width, height = 1920, 1080
+    if size:
+        width, height = (int(value) for value in size.split("x"))
+    return functools.partial(SyntheticCapture, kind, width, height)
+
+
+def main():
+    """
+    Runs server.py on generated frames: the first argument is the source,
+    the rest are the arguments of server.py.
+    """
+    if len(sys.argv) < 2 or sys.argv[1].startswith("-"):
+        print(
+            "Usage: python synthetic.py static|scroll|noise[:WxH] "
+            "<server.py arguments>"
+        )
+        sys.exit(1)
+    server.main(sys.argv[2:], capture_factory(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
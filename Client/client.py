@@ -2,9 +2,121 @@ import cv2  #  OpenCV for image processing
 import socket  # Socket library for network communication
 import struct  # Struct for handling binary data
 import tkinter as tk  # Tkinter for creating GUI window
+from tkinter import ttk  # Themed widgets for the tabs of multiplexed screens
 from PIL import Image, ImageTk  # PIL for image manipulation
 import numpy as np  # NumPy for numerical operations on images
-import sys  # Sys for Clients GUI
+import argparse  # Argparse for the arguments passed by the Clients GUI
+import zlib  # Zlib for the lossless raw pixel codec
+import threading  # Threading for the background receive and decode worker
+import time  # Time for the per-stage timers
+import concurrent.futures  # Concurrent.futures to decode keyframe stripes in parallel
+import os  # Os to locate the shared modules
+import sys  # Sys to import the shared modules
+
+# The statistics code is shared with the server, in the Common folder
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common")
+)
+from pipeline_stats import PipelineStats, start_stats_reporting  # noqa: E402
+
+# Version 1 control messages sent to servers that do not speak version 2: magic,
+# window width and height, and the screen index for (un)subscriptions
+CONTROL_FORMAT = ">4sHHB"
+RESIZE_MAGIC = b"RSIZ"  # Sent when the window size changes
+SUBSCRIBE_MAGIC = b"RSUB"  # Start watching the screen given in the last byte
+UNSUBSCRIBE_MAGIC = b"RUNS"  # Stop watching the screen given in the last byte
+RESIZE_DEBOUNCE_MS = 300  # Wait for the resize to settle before reporting it
+
+# Milliseconds between two checks for a new frame to display
+RENDER_INTERVAL_MS = 10
+
+# Marks a delta frame made of changed tiles instead of a full image
+TILE_MAGIC = b"RTIL"
+
+# Marks a keyframe split into horizontal stripes that decode independently
+STRIPE_MAGIC = b"RSTR"
+
+# Marks a delta frame that first copies regions of the picture to new positions
+# (a scrolled page, a dragged window), then paints changed tiles
+MOVE_MAGIC = b"RMOV"
+
+# Multiplexed connections start with the list of shared screens, and each frame
+# is prefixed with the index of the screen it belongs to
+LIST_MAGIC = b"RLST"
+CHANNEL_MAGIC = b"RCHN"
+
+# Marks a keyframe in a codec other than JPEG; plain JPEG keyframes carry no header
+FRAME_MAGIC = b"RFRM"
+
+# Version 2 of the wire protocol: every message starts with a fixed header of
+# magic, version, message type, channel (screen index), codec id, frame sequence
+# number, capture timestamp in microseconds, flags and payload length. Servers
+# that only speak version 1 ignore the version 2 hello and send length-prefixed
+# frames, which never start with V2_MAGIC.
+V2_MAGIC = b"RFV2"
+PROTOCOL_VERSION = 2
+HEADER_FORMAT = ">4sBBBBLQBL"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Message types sent by the server
+MSG_FRAME = 1
+MSG_LIST = 2
+# Message types sent to the server
+MSG_HELLO = 16
+MSG_RESIZE = 17
+MSG_SUBSCRIBE = 18
+MSG_UNSUBSCRIBE = 19
+MSG_ACK = 20
+MSG_KEYFRAME_REQUEST = 21
+
+# Header flags
+FLAG_KEYFRAME = 1
+FLAG_MULTIPLEX = 2
+
+# Version 1 control messages for the message types that have one
+V1_CONTROL_MAGICS = {
+    MSG_RESIZE: RESIZE_MAGIC,
+    MSG_SUBSCRIBE: SUBSCRIBE_MAGIC,
+    MSG_UNSUBSCRIBE: UNSUBSCRIBE_MAGIC,
+}
+
+
+# Timings and throughput of every stage on this client
+stats = PipelineStats()
+
+
+# Function to decode an image written with one of OpenCV's image formats
+def decode_image(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+# Function to decode raw BGR pixels compressed with zlib
+def decode_zlib(data):
+    width, height = struct.unpack_from(">HH", data)
+    pixels = zlib.decompress(data[4:])
+    return np.frombuffer(pixels, np.uint8).reshape(height, width, 3)
+
+
+# Codec ids from the frame headers, their names and decoders
+CODECS = {
+    1: ("jpeg", decode_image),
+    2: ("webp", decode_image),
+    3: ("png", decode_image),
+    4: ("zlib", decode_zlib),
+}
+CODEC_IDS = {name: codec_id for codec_id, (name, _) in CODECS.items()}
+
+
+# Function to decode the payload of a keyframe into a writable BGR image
+def decode_keyframe(frame_data):
+    if frame_data[: len(FRAME_MAGIC)] == FRAME_MAGIC:
+        codec_id = frame_data[len(FRAME_MAGIC)]
+        image = CODECS[codec_id][1](frame_data[len(FRAME_MAGIC) + 1 :])
+    else:
+        image = decode_image(frame_data)  # Plain JPEG
+    if not image.flags.writeable:
+        image = image.copy()  # Delta frames are painted into the keyframe
+    return image
 
 
 # Function to resize a frame to fit target dimensions
@@ -14,8 +126,405 @@ def resize_frame(frame, target_width, target_height):
     return resized_frame
 
 
+# Reads length-prefixed frames into a reusable buffer
+class FrameReceiver:
+    """
+    Receives the messages of the video stream without per-chunk copies.
+
+    A version 1 message is a ">L" length followed by the payload, a version 2
+    message a HEADER_FORMAT header; the first four bytes tell them apart. The
+    header and the payload are read with recv_into straight into preallocated
+    buffers, asking the kernel for everything that is still missing in every
+    call, so short reads of either part are simply continued. The payload
+    buffer grows to the largest message seen and is then reused.
+
+    After each receive() the header fields of the message are available as
+    attributes. Version 1 channel and list messages are translated to the
+    same fields, so callers never look at version 1 magics.
+    """
+
+    def __init__(self, sock, initial_size=1 << 20):
+        self.sock = sock
+        self._header = bytearray(HEADER_SIZE)
+        self._header_view = memoryview(self._header)
+        self._buffer = bytearray(initial_size)
+        self._view = memoryview(self._buffer)
+        self.version = None  # Protocol version the server speaks, once known
+        self.msg_type = MSG_FRAME
+        self.channel = 0  # Screen the message belongs to
+        self.codec_id = 0
+        self.seq = 0  # Frame sequence number (version 2 only)
+        self.timestamp = 0  # Capture time in microseconds (version 2 only)
+        self.flags = 0
+
+    # Fill the first size bytes of view, returning False if the stream ended
+    def _fill(self, view, size):
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:size])
+            if count == 0:
+                return False
+            received += count
+        return True
+
+    def receive(self):
+        """
+        Receives the next message.
+
+        Returns:
+        - A memoryview of the payload, only valid until the next call, or None
+          when the server closed the stream.
+        """
+        if not self._fill(self._header_view, 4):
+            return None
+        if self._header[:4] == V2_MAGIC:
+            if not self._fill(self._header_view[4:], HEADER_SIZE - 4):
+                return None
+            (
+                _,
+                _,
+                self.msg_type,
+                self.channel,
+                self.codec_id,
+                self.seq,
+                self.timestamp,
+                self.flags,
+                size,
+            ) = struct.unpack(HEADER_FORMAT, self._header)
+            self.version = PROTOCOL_VERSION
+        else:
+            size = struct.unpack_from(">L", self._header)[0]
+            self.version = 1
+        start = time.perf_counter()  # The header arrived, time the payload
+        if size > len(self._buffer):
+            # Grow geometrically so a slowly rising frame size reallocates rarely
+            self._buffer = bytearray(max(size, 2 * len(self._buffer)))
+            self._view = memoryview(self._buffer)
+        if not self._fill(self._view, size):
+            return None
+        stats.record("recv", time.perf_counter() - start)
+        stats.count("received", size)
+        payload = self._view[:size]
+        if self.version == 1:
+            payload = self._translate_v1(payload)
+        return payload
+
+    # Fill in the header fields of a version 1 message and strip its magic
+    def _translate_v1(self, payload):
+        self.msg_type, self.channel = MSG_FRAME, 0
+        self.flags = self.seq = self.timestamp = 0
+        if payload[: len(CHANNEL_MAGIC)] == CHANNEL_MAGIC:
+            self.channel = payload[len(CHANNEL_MAGIC)]
+            return payload[len(CHANNEL_MAGIC) + 1 :]
+        if payload[: len(LIST_MAGIC)] == LIST_MAGIC:
+            self.msg_type = MSG_LIST
+            return payload[len(LIST_MAGIC) :]
+        return payload
+
+
+# Sends control messages to the server in the protocol version it speaks
+class ControlSender:
+    """
+    Serializes the control messages of the decode worker and the Tk thread
+    on the socket.
+
+    Messages are sent in version 2 until the receiver found out that the
+    server only speaks version 1. Acknowledgements and keyframe requests have
+    no version 1 equivalent and are then dropped.
+    """
+
+    def __init__(self, sock, receiver):
+        self.sock = sock
+        self.receiver = receiver
+        self._lock = threading.Lock()
+
+    def send(self, msg_type, channel=0, width=0, height=0, seq=0, timestamp=0):
+        if self.receiver.version == 1:
+            magic = V1_CONTROL_MAGICS.get(msg_type)
+            if magic is None:
+                return
+            message = struct.pack(CONTROL_FORMAT, magic, width, height, channel)
+        else:
+            payload = b""
+            if msg_type == MSG_RESIZE:
+                payload = struct.pack(">HH", width, height)
+            message = pack_header(msg_type, len(payload), channel, 0, seq, timestamp)
+            message += payload
+        with self._lock:
+            self.sock.sendall(message)
+
+    # Acknowledge the frame the receiver returned last
+    def ack(self):
+        receiver = self.receiver
+        if receiver.version != 1:
+            self.send(
+                MSG_ACK,
+                receiver.channel,
+                seq=receiver.seq,
+                timestamp=receiver.timestamp,
+            )
+
+
+# Function to build a version 2 message header
+def pack_header(msg_type, length, channel=0, codec_id=0, seq=0, timestamp=0, flags=0):
+    return struct.pack(
+        HEADER_FORMAT,
+        V2_MAGIC,
+        PROTOCOL_VERSION,
+        msg_type,
+        channel,
+        codec_id,
+        seq,
+        timestamp,
+        flags,
+        length,
+    )
+
+
+# Function to build the version 2 hello announcing window size, codec and mode
+def pack_hello(display_size, codec_id, multiplexed=False):
+    payload = struct.pack(">HH", *display_size)
+    flags = FLAG_MULTIPLEX if multiplexed else 0
+    return pack_header(MSG_HELLO, len(payload), 0, codec_id, flags=flags) + payload
+
+
+# Function to paint the changed tiles of a delta frame into the framebuffer
+def apply_tiles(framebuffer, frame_data):
+    # Codec, frame dimensions and number of changed rectangles follow the magic bytes
+    codec_id, width, height, count = struct.unpack_from(
+        ">BHHH", frame_data, len(TILE_MAGIC)
+    )
+    if framebuffer.shape[:2] != (height, width):
+        return False  # The delta belongs to a different resolution
+    paint_tiles(framebuffer, frame_data, len(TILE_MAGIC) + 7, count, codec_id)
+    return True
+
+
+# Function to apply the copies and then the changed tiles of a delta frame
+def apply_moves(framebuffer, frame_data):
+    # Codec, frame dimensions, number of copies and of changed rectangles
+    codec_id, width, height, copies, count = struct.unpack_from(
+        ">BHHHH", frame_data, len(MOVE_MAGIC)
+    )
+    if framebuffer.shape[:2] != (height, width):
+        return False  # The delta belongs to a different resolution
+
+    # Every copy reads the picture as it was before this frame, so take all the
+    # sources before writing any destination
+    offset = len(MOVE_MAGIC) + 9
+    regions = []
+    for _ in range(copies):
+        src_x, src_y, copy_width, copy_height, x, y = struct.unpack_from(
+            ">HHHHHH", frame_data, offset
+        )
+        offset += 12
+        source = framebuffer[src_y : src_y + copy_height, src_x : src_x + copy_width]
+        regions.append((x, y, source.copy()))
+    for x, y, region in regions:
+        region_height, region_width = region.shape[:2]
+        framebuffer[y : y + region_height, x : x + region_width] = region
+
+    paint_tiles(framebuffer, frame_data, offset, count, codec_id)
+    return True
+
+
+# Function to decode count rectangles, starting at offset, into the framebuffer
+def paint_tiles(framebuffer, frame_data, offset, count, codec_id):
+    decode = CODECS[codec_id][1]
+    for _ in range(count):
+        # Position of the rectangle and size of its encoded image
+        x, y, size = struct.unpack_from(">HHL", frame_data, offset)
+        offset += 8
+        tile = decode(frame_data[offset : offset + size])
+        offset += size
+        tile_height, tile_width = tile.shape[:2]
+        framebuffer[y : y + tile_height, x : x + tile_width] = tile
+
+
+# Holds the newest decoded frame until the renderer picks it up
+class LatestFrame:
+    """
+    Single-slot mailbox between the decode worker and the Tk renderer.
+
+    Publishing replaces a frame the renderer has not shown yet, so the window
+    always jumps to the newest picture and a slow renderer never holds up the
+    socket. closed is set once the stream ended, error if it failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self.closed = False
+        self.error = None
+
+    def publish(self, frame):
+        with self._lock:
+            self._frame = frame
+
+    # Return the newest unseen frame, or None if there is none
+    def take(self):
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+    def close(self, error=None):
+        self.error = error
+        self.closed = True
+
+
+# Keeps the picture of one stream up to date
+class StreamDecoder:
+    """
+    Turns the keyframes and delta frames of one screen into full pictures.
+
+    framebuffer is the last full picture received, updated in place by delta
+    frames; it stays None until the first keyframe arrived.
+    """
+
+    def __init__(self):
+        self.framebuffer = None
+        self._pool = None  # Threads that decode keyframe stripes, made on demand
+
+    # Apply one frame, returning the updated picture or None if it can't be shown yet
+    def decode(self, frame_data):
+        start = time.perf_counter()
+        if frame_data[: len(TILE_MAGIC)] == TILE_MAGIC:
+            # A delta frame only carries the tiles that changed, so paint them
+            # over the picture we already have; wait for a keyframe otherwise.
+            if self.framebuffer is None or not apply_tiles(
+                self.framebuffer, frame_data
+            ):
+                return None
+        elif frame_data[: len(STRIPE_MAGIC)] == STRIPE_MAGIC:
+            self.decode_stripes(frame_data)
+        elif frame_data[: len(MOVE_MAGIC)] == MOVE_MAGIC:
+            # Moved content is copied within the picture we already have
+            if self.framebuffer is None or not apply_moves(
+                self.framebuffer, frame_data
+            ):
+                return None
+        else:
+            # Decode the keyframe into a color image/frame with the codec it names.
+            self.framebuffer = decode_keyframe(frame_data)
+        stats.record("decode", time.perf_counter() - start)
+        return self.framebuffer
+
+    # Decode the stripes of a keyframe in parallel into the framebuffer
+    def decode_stripes(self, frame_data):
+        # Codec, frame dimensions and number of stripes follow the magic bytes
+        codec_id, width, height, count = struct.unpack_from(
+            ">BHHH", frame_data, len(STRIPE_MAGIC)
+        )
+        if self.framebuffer is None or self.framebuffer.shape[:2] != (height, width):
+            self.framebuffer = np.empty((height, width, 3), np.uint8)
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix="stripe-decoder"
+            )
+        decode = CODECS[codec_id][1]
+        stripes = []
+        offset = len(STRIPE_MAGIC) + 7
+        for _ in range(count):
+            # First row of the stripe and size of its encoded image
+            y, size = struct.unpack_from(">HL", frame_data, offset)
+            offset += 6
+            stripes.append((y, frame_data[offset : offset + size]))
+            offset += size
+
+        # The decoders release the GIL, so the stripes decode on several cores
+        def decode_stripe(stripe):
+            y, data = stripe
+            image = decode(data)
+            self.framebuffer[y : y + image.shape[0]] = image
+
+        for _ in self._pool.map(decode_stripe, stripes):
+            pass
+
+
+# Function to resize a picture to the window and convert it for Tkinter.
+def prepare_image(frame, display_size):
+    # Resize the frame to fit the current window dimensions.
+    start = time.perf_counter()
+    frame_np = resize_frame(frame, *display_size)
+    resized = time.perf_counter()
+    stats.record("resize", resized - start)
+
+    # Convert the resized frame into a format suitable for display with Tkinter.
+    image = Image.fromarray(cv2.cvtColor(frame_np, cv2.COLOR_BGR2RGB))
+    stats.record("convert", time.perf_counter() - resized)
+    return image
+
+
+# Function to receive, decode and prepare frames on a background thread.
+def decode_worker(receiver, latest, display_size, control):
+    decoder = StreamDecoder()
+
+    try:
+        while True:
+            # Receive the next frame into the reusable buffer.
+            frame_data = receiver.receive()
+
+            # Check if no frame is received (indicating the end of the stream).
+            if frame_data is None:
+                break
+            if receiver.msg_type != MSG_FRAME:
+                continue
+
+            frame = decoder.decode(frame_data)
+            if frame is None:
+                # A delta we cannot apply: ask for a fresh picture right away.
+                control.send(MSG_KEYFRAME_REQUEST)
+                continue
+            latest.publish(prepare_image(frame, display_size))
+            control.ack()  # Lets the server measure the end-to-end latency
+
+    except Exception as e:
+        latest.close(e)
+        return
+    latest.close()
+
+
+# Function to read the list of shared screens that opens a multiplexed stream
+def receive_screen_list(receiver):
+    frame_data = receiver.receive()
+    if frame_data is None or receiver.msg_type != MSG_LIST:
+        raise ConnectionError("The server does not share several screens")
+    count = frame_data[0]
+    return list(frame_data[1 : 1 + count])
+
+
+# Function to route the frames of a multiplexed stream to the screen they belong to.
+def mux_decode_worker(receiver, latest_frames, display_size, control):
+    decoders = {screen: StreamDecoder() for screen in latest_frames}
+    error = None
+
+    try:
+        while True:
+            frame_data = receiver.receive()
+            if frame_data is None:
+                break
+            screen = receiver.channel
+            if receiver.msg_type != MSG_FRAME or screen not in decoders:
+                continue  # Not a frame of a screen the server announced
+
+            frame = decoders[screen].decode(frame_data)
+            if frame is None:
+                control.send(MSG_KEYFRAME_REQUEST, screen)
+                continue
+            latest_frames[screen].publish(prepare_image(frame, display_size))
+            control.ack()
+
+    except Exception as e:
+        error = e
+    for latest in latest_frames.values():
+        latest.close(error)
+
+
 # Function to receive and display a video stream from a remote server.
-def receive_video(host, port, window_width, window_height):
+def receive_video(host, port, window_width, window_height, codec=None, screens=None):
+    client_socket = None
+    root = None
+    latest_frames = {}  # LatestFrame per displayed screen
     try:
         # Create a socket object for network communication using the IPv4 protocol (AF_INET)
         # and the TCP transport protocol (SOCK_STREAM).
@@ -24,6 +533,19 @@ def receive_video(host, port, window_width, window_height):
         # Connect the client socket to the specified server using the provided host and port.
         client_socket.connect((host, int(port)))
 
+        # Announce the window size so the server downscales frames before sending them,
+        # along with the codec this session should use. A list of screens asks for a
+        # multiplexed connection that carries several screens at once.
+        # The hello also offers version 2 of the protocol; the server answers in
+        # the version it supports.
+        display_size = [int(window_width), int(window_height)]
+        codec_id = CODEC_IDS[codec] if codec else 0
+        client_socket.sendall(
+            pack_hello(display_size, codec_id, multiplexed=screens is not None)
+        )
+        receiver = FrameReceiver(client_socket)
+        control = ControlSender(client_socket, receiver)
+
         # Create a GUI window using the Tkinter library.
         root = tk.Tk()
         root.title("Video Stream")
@@ -32,55 +554,100 @@ def receive_video(host, port, window_width, window_height):
         window_size = f"{window_width}x{window_height}"
         root.geometry(window_size)
 
-        # Create a Tkinter label widget to display the video stream within the GUI window.
-        label = tk.Label(root)
+        labels = {}  # Label showing each screen
+        if screens is None:
+            # Create a Tkinter label widget to display the video stream within the GUI window.
+            labels[None] = tk.Label(root)
 
-        # Pack the label widget with optional padding to position it within the window.
-        label.pack(padx=10, pady=10)
+            # Pack the label widget with optional padding to position it within the window.
+            labels[None].pack(padx=10, pady=10)
+        else:
+            # One tab per shared screen, each with a switch to (un)subscribe from it.
+            shared = receive_screen_list(receiver)
+            notebook = ttk.Notebook(root)
+            notebook.pack(fill="both", expand=True)
 
-        while True:
-            # Receive the size of the incoming video frame from the server.
-            frame_size_data = client_socket.recv(4)
+            def toggle(screen, subscribed):
+                kind = MSG_SUBSCRIBE if subscribed.get() else MSG_UNSUBSCRIBE
+                control.send(kind, screen)
 
-            # Check if no frame size data is received (indicating the end of the stream).
-            if not frame_size_data:
-                break
+            for screen in shared:
+                tab = tk.Frame(notebook)
+                notebook.add(tab, text=f"Screen {screen}")
+                subscribed = tk.BooleanVar(value=not screens or screen in screens)
+                tk.Checkbutton(
+                    tab,
+                    text="Watch this screen",
+                    variable=subscribed,
+                    command=lambda s=screen, v=subscribed: toggle(s, v),
+                ).pack(anchor="w")
+                labels[screen] = tk.Label(tab)
+                labels[screen].pack(padx=10, pady=10)
+                if subscribed.get():
+                    toggle(screen, subscribed)
 
-            # Unpack the binary data to retrieve the size of the video frame in bytes.
-            frame_size = struct.unpack(">L", frame_size_data)[0]
+        for screen in labels:
+            latest_frames[screen] = LatestFrame()
 
-            # Initialize an empty binary data buffer to store the frame data.
-            frame_data = b""
+        # Track window resizes and tell the server about the new size once the user
+        # stops dragging, so it can renegotiate the resolution it sends.
+        pending_resize = [None]
 
-            # Receive the frame data in chunks until the entire frame is received.
-            while len(frame_data) < frame_size:
-                remaining_size = frame_size - len(frame_data)
+        def send_resize():
+            pending_resize[0] = None
+            control.send(MSG_RESIZE, 0, *display_size)
 
-                # Receive a chunk of frame data, with a maximum chunk size of 4096 bytes.
-                # This ensures that large frames are received in smaller segments.
-                frame_data += client_socket.recv(
-                    4096 if remaining_size > 4096 else remaining_size
-                )
+        def on_configure(event):
+            if event.widget is not root:
+                return
+            if [event.width, event.height] == display_size:
+                return
+            display_size[:] = [event.width, event.height]
+            if pending_resize[0] is not None:
+                root.after_cancel(pending_resize[0])
+            pending_resize[0] = root.after(RESIZE_DEBOUNCE_MS, send_resize)
 
-            # Convert the received frame data into a NumPy array of unsigned 8-bit integers.
-            nparr = np.frombuffer(frame_data, np.uint8)
+        root.bind("<Configure>", on_configure)
 
-            # Decode the NumPy array into a color image/frame using OpenCV.
-            frame_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Network reads and decoding run on a worker thread, so a slow network never
+        # freezes the window and slow rendering never throttles the socket.
+        if screens is None:
+            worker, latest = decode_worker, latest_frames[None]
+        else:
+            worker, latest = mux_decode_worker, latest_frames
+        threading.Thread(
+            target=worker,
+            args=(receiver, latest, display_size, control),
+            daemon=True,
+        ).start()
 
-            # Resize the frame to fit the target dimensions (window_width x window_height).
-            frame_np = resize_frame(frame_np, int(window_width), int(window_height))
+        # Show the newest decoded frame of every screen on the Tk thread at a steady pace.
+        def render():
+            closed = False
+            for screen, latest in latest_frames.items():
+                image = latest.take()
+                if image is not None:
+                    start = time.perf_counter()
+                    photo = ImageTk.PhotoImage(image)
 
-            # Convert the resized frame into a format suitable for display with Tkinter.
-            image = cv2.cvtColor(frame_np, cv2.COLOR_BGR2RGB)
-            image = ImageTk.PhotoImage(Image.fromarray(image))
+                    # Update the Tkinter label with the new frame, allowing real-time display.
+                    labels[screen].config(image=photo)
+                    labels[screen].image = photo
+                    stats.record("render", time.perf_counter() - start)
+                    stats.count("displayed")
+                elif latest.closed:
+                    closed = True
+            if closed:
+                root.quit()  # The stream ended and its last frame was shown
+                return
+            root.after(RENDER_INTERVAL_MS, render)
 
-            # Update the Tkinter label with the new frame, allowing real-time display.
-            label.config(image=image)
-            label.image = image
+        render()
+        root.mainloop()
 
-            # Update the Tkinter GUI to reflect the changes - Update the displayed frame.
-            root.update()
+        for latest in latest_frames.values():
+            if latest.error is not None:
+                raise latest.error
 
     except Exception as e:
         # Handle any exceptions that may occur during the execution of the function.
@@ -88,28 +655,67 @@ def receive_video(host, port, window_width, window_height):
 
     finally:
         # Close the client socket to release network resources.
-        client_socket.close()
+        if client_socket is not None:
+            client_socket.close()
 
         # Destroy the Tkinter GUI window when the video stream ends or an error occurs.
-        root.destroy()
+        if root is not None:
+            try:
+                root.destroy()
+            except tk.TclError:
+                pass  # The user already closed the window
 
 
 # Main function
 def main():
-    if len(sys.argv) != 6:
-        print(
-            "Usage: python client.py <IP> <Port> <Screen Index> <Window Width> <Window Height>"
-        )
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Watch a shared screen.")
+    parser.add_argument("host", help="IP address of the server")
+    parser.add_argument("port", help="Port of the server")
+    parser.add_argument("screen_index", help="Index of the shared screen")
+    parser.add_argument("window_width", help="Target window width in px")
+    parser.add_argument("window_height", help="Target window height in px")
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODEC_IDS),
+        default=None,
+        help="Codec to ask the server for (default: the server's choice)",
+    )
+    parser.add_argument(
+        "--screens",
+        default=None,
+        help="Watch several screens over one connection, in tabs: a "
+        "comma-separated list of indices, or 'all' for every shared screen",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="Seconds between JSON log lines with per-stage timings, 0 disables them",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        default=0,
+        help="Local port serving the statistics as /stats (JSON) and /metrics "
+        "(Prometheus), 0 disables it",
+    )
+    args = parser.parse_args()
+
+    start_stats_reporting(stats, args.stats_interval, args.stats_port, "client")
 
-    host = sys.argv[1]  # Retrieve the IP address from Clients GUI
-    port = sys.argv[2]  # Retrieve the port number from Clients GUI
-    screen_index = sys.argv[3]
-    window_width = sys.argv[4]  # Retrieve the target window width from Clients GUI
-    window_height = sys.argv[5]  # Retrieve the target window height from Clients GUI
+    screens = None
+    if args.screens == "all":
+        screens = []  # Subscribe to whatever the server shares
+    elif args.screens:
+        screens = [int(screen) for screen in args.screens.split(",")]
 
     receive_video(
-        host, port, window_width, window_height
+        args.host,
+        args.port,
+        args.window_width,
+        args.window_height,
+        args.codec,
+        screens,
     )  # Start receiving and displaying the video stream
 
 
@@ -1,80 +1,750 @@
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import struct
 import sys
 import socket
+import threading
+import zlib
+
+import numpy as np
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad
 
+# Optional faster compression codecs for file transfers
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# A transfer starts with TRANSFER_MAGIC and a random salt, followed by records:
+# a RECORD_HEADER (record type and length), the AES-GCM ciphertext and its tag.
+# The first record holds the filename, then come the data records and an end
+# record with the file size, so a truncated transfer is detected. The server
+# answers every complete, verified file with TRANSFER_OK.
+# In a chunked transfer, a plan record and the manifest (the SHA-256 of every
+# chunk) follow the filename instead of the data. The server answers with a
+# bitmap of the chunks it already has from an earlier attempt. The missing
+# chunks follow, each a chunk record with the offset and then its data
+# records, over this connection and any others that join the session. Every
+# connection draws nonces from its own salt.
+# In a delta transfer, the client first asks for the signatures of the copy of
+# the file the server already has: the server answers with TRANSFER_OK, its
+# own salt and encrypted signature records, one weak checksum and one strong
+# hash per block. Chunks then consist of data records for the bytes that
+# changed and copy records for the bytes the server copies from its old copy.
+# In a compressed transfer, a compress record with the codecs the client can
+# use precedes the plan, and the server appends the codec it picked to its
+# bitmap. Data records that compress well are then sent as packed records,
+# the codec followed by the compressed data, and the others as they are.
+TRANSFER_MAGIC = b"RFX1"
+SALT_SIZE = 8
+RECORD_HEADER = ">BL"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+RECORD_NAME = 1
+RECORD_DATA = 2
+RECORD_END = 3
+RECORD_PLAN = 4  # Session, file size and chunk size of a chunked transfer
+RECORD_JOIN = 5  # First record of a connection that sends chunks
+RECORD_CHUNK = 6  # Offset of the chunk the following data records belong to
+RECORD_MANIFEST = 7  # SHA-256 digests of chunks, in order
+RECORD_DELTA = 8  # Block size of the signatures the client asks for
+RECORD_SIGNATURES = 9  # Signatures of blocks of the server's copy, in order
+RECORD_COPY = 10  # Offset and length of data to take from the server's copy
+RECORD_COMPRESS = 11  # Compression codecs the client can use, best first
+RECORD_PACKED = 12  # Codec and compressed data of a data record
+PLAN_FORMAT = ">16sQL"
+COPY_FORMAT = ">QL"
+SESSION_ID_SIZE = 16
+TAG_SIZE = 16
+RECORD_SIZE = 1 << 20  # Bytes of the file per data record
+TRANSFER_OK = b"\x01"
+CHUNK_SIZE = 8 << 20  # Default bytes of the file per chunk
+MIN_CHUNK_SIZE = 64 << 10
+MAX_CHUNKS = 1 << 20  # Most chunks per file the server accepts
+DELTA_BLOCK_SIZE = 64 << 10  # Default bytes per block of a delta transfer
+MIN_BLOCK_SIZE = 4 << 10
+DELTA_WINDOW = 1 << 20  # Offsets of the file checked per batch
+WEAK_TABLE_BITS = 24  # Largest table that prefilters weak checksums
+STRONG_SIZE = 16
+# Weak checksum (a: sum of the bytes, b: sum weighted by the distance to the
+# end of the block, both modulo 2^32) and truncated SHA-256 of a block
+SIGNATURE = np.dtype([("a", ">u4"), ("b", ">u4"), ("strong", "u1", STRONG_SIZE)])
+# Compression codecs by name, and those installed here, fastest first
+COMPRESSION_IDS = {"zlib": 1, "lz4": 2, "zstd": 3}
+COMPRESSION_CODECS = [
+    name
+    for name, module in (("lz4", lz4), ("zstd", zstandard), ("zlib", zlib))
+    if module is not None
+]
+SAMPLES = 4  # Pieces of a data record compressed to decide whether to pack it
+SAMPLE_SIZE = 4 << 10
+MAX_PACKED_RATIO = 0.9  # Largest compressed size worth unpacking, relative
+
+
+def record_nonce(iv, salt, counter):
+    """
+    Builds the 12-byte AES-GCM nonce of a record.
+
+    Parameters:
+    - iv: The initialization vector shared with the server (at least 12 bytes).
+    - salt: The random salt of the transfer.
+    - counter: The number of the record within the transfer.
+
+    Returns:
+    - The first 12 bytes of the IV XOR the salt and the counter, so no nonce
+      repeats under the same key as long as the salts do not.
+    """
+    mixed = salt + struct.pack(">L", counter)
+    return bytes(a ^ b for a, b in zip(iv[:12], mixed))
+
+
+def send_buffers(client_socket, buffers):
+    """
+    Sends several buffers with as few vectored writes as possible.
+
+    Parameters:
+    - client_socket: The socket object used to communicate with the server.
+    - buffers: The bytes-like objects to send, in order.
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    if not hasattr(client_socket, "sendmsg"):
+        for view in views:  # No vectored sends on this platform
+            client_socket.sendall(view)
+        return
+    while views:
+        sent = client_socket.sendmsg(views)
+        # Drop the buffers that went out and trim the one sent partially
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+
+
+class RecordWriter:
+    """
+    Encrypts and sends the records of one transfer with AES in GCM mode.
+    The ciphertext goes to a reused output buffer and leaves together with
+    its header and tag in a single vectored write.
+    """
+
+    def __init__(self, client_socket, key, iv, salt):
+        self.client_socket = client_socket
+        self.key = key
+        self.iv = iv
+        self.salt = salt
+        self.counter = 0
+        self.compressor = None  # Compresses data records once a codec is agreed
+        self._output = memoryview(bytearray(RECORD_SIZE))
+
+    def send(self, record_type, data):
+        """
+        Encrypts, authenticates and sends the next record.
+
+        Parameters:
+        - record_type: RECORD_NAME, RECORD_DATA or RECORD_END.
+        - data: The plaintext of the record, at most RECORD_SIZE bytes.
+        """
+        # The header is authenticated too, so type and length cannot be altered
+        header = struct.pack(RECORD_HEADER, record_type, len(data))
+        cipher = AES.new(
+            self.key, AES.MODE_GCM, nonce=record_nonce(self.iv, self.salt, self.counter)
+        )
+        self.counter += 1
+        cipher.update(header)
+        ciphertext = self._output[: len(data)]
+        tag = cipher.encrypt_and_digest(data, output=ciphertext)[1]
+        send_buffers(self.client_socket, [header, ciphertext, tag])
+
+    def send_data(self, data):
+        """
+        Sends data of the file as a packed record if the compressor of the
+        transfer shrinks it, and as a data record otherwise.
+        """
+        if self.compressor is not None:
+            packed = self.compressor.pack(data)
+            if packed is not None:
+                self.send(RECORD_PACKED, packed)
+                return
+        self.send(RECORD_DATA, data)
+
+
+class Compressor:
+    """
+    Compresses data records with one codec at its fastest level. A record is
+    only compressed if a few samples of it compress well, so data that is
+    compressed already, like JPEG images or archives, costs little CPU.
+    """
+
+    def __init__(self, codec):
+        self.codec_id = COMPRESSION_IDS[codec]
+        if codec == "lz4":
+            self.compress = lambda data: lz4.block.compress(data, store_size=False)
+        elif codec == "zstd":
+            self.compress = zstandard.ZstdCompressor(level=1).compress
+        else:
+            self.compress = lambda data: zlib.compress(data, 1)
+        self.packed = 0  # Bytes of the file sent compressed
+        self.saved = 0  # Bytes compression kept off the wire
+
+    def pack(self, data):
+        """
+        Compresses a data record.
+
+        Returns:
+        - The codec and the compressed data, or None if the record does not
+          compress well enough.
+        """
+        if len(data) > SAMPLES * SAMPLE_SIZE:
+            step = len(data) // SAMPLES
+            sample = b"".join(
+                data[start : start + SAMPLE_SIZE]
+                for start in range(0, step * SAMPLES, step)
+            )
+            if len(self.compress(sample)) > len(sample) * MAX_PACKED_RATIO:
+                return None
+        compressed = self.compress(data)
+        if len(compressed) >= len(data) * MAX_PACKED_RATIO:
+            return None
+        self.packed += len(data)
+        self.saved += len(data) - len(compressed) - 1
+        return struct.pack(">B", self.codec_id) + compressed
+
+
+def recv_exactly(client_socket, size):
+    """
+    Receives exactly size bytes, or fewer if the server closes the connection.
+    """
+    data = bytearray()
+    while len(data) < size:
+        block = client_socket.recv(size - len(data))
+        if not block:
+            break
+        data += block
+    return bytes(data)
+
+
+class RecordReader:
+    """
+    Receives and verifies the records the server sends, the way the server
+    receives those of the client.
+    """
+
+    def __init__(self, client_socket, key, iv, salt):
+        self.client_socket = client_socket
+        self.key = key
+        self.iv = iv
+        self.salt = salt
+        self.counter = 0
 
-def encrypt_data(key, iv, data):
+    def receive(self):
+        """
+        Receives, decrypts and authenticates the next record.
+
+        Returns:
+        - The record type and its plaintext.
+        """
+        header = recv_exactly(self.client_socket, RECORD_HEADER_SIZE)
+        if len(header) < RECORD_HEADER_SIZE:
+            raise ConnectionError("The server closed the connection")
+        record_type, length = struct.unpack(RECORD_HEADER, header)
+        if length > RECORD_SIZE:
+            raise ValueError("Record too long")
+        data = recv_exactly(self.client_socket, length + TAG_SIZE)
+        if len(data) < length + TAG_SIZE:
+            raise ConnectionError("The server closed the connection")
+
+        cipher = AES.new(
+            self.key, AES.MODE_GCM, nonce=record_nonce(self.iv, self.salt, self.counter)
+        )
+        self.counter += 1
+        cipher.update(header)
+        return record_type, cipher.decrypt_and_verify(data[:length], data[length:])
+
+
+def request_signatures(writer, block_size):
+    """
+    Asks the server for the signatures of its copy of the file.
+
+    Parameters:
+    - writer: The RecordWriter of the connection the transfer started on.
+    - block_size: The number of bytes per block.
+
+    Returns:
+    - A SIGNATURE array with one entry per whole block of the server's copy,
+      empty if the server has no copy.
     """
-    Encrypts data using AES encryption in CBC mode.
+    writer.send(RECORD_DELTA, struct.pack(">L", block_size))
+    reply = recv_exactly(writer.client_socket, len(TRANSFER_OK) + SALT_SIZE)
+    if len(reply) < len(TRANSFER_OK) + SALT_SIZE or not reply.startswith(TRANSFER_OK):
+        raise ConnectionError("The server does not accept delta transfers")
+    reader = RecordReader(
+        writer.client_socket, writer.key, writer.iv, reply[len(TRANSFER_OK) :]
+    )
+    parts = []
+    while True:
+        record_type, data = reader.receive()
+        if record_type == RECORD_END:
+            break
+        if record_type != RECORD_SIGNATURES:
+            raise ValueError("Unexpected record in the signatures")
+        parts.append(data)
+    signatures = np.frombuffer(b"".join(parts), SIGNATURE)
+    if len(signatures) != struct.unpack(">Q", data)[0]:
+        raise ValueError("Incomplete signatures")
+    return signatures
+
+
+def rolling_checksums(data, block_size):
+    """
+    Computes the weak checksum of the block at every offset of data. Like the
+    rolling checksum of rsync, but from prefix sums, so that a whole batch
+    of offsets takes a few array operations instead of a loop.
 
     Parameters:
+    - data: A bytes-like object.
+    - block_size: The number of bytes per block.
+
+    Returns:
+    - The a and b halves of the checksums (see SIGNATURE), one per offset
+      from 0 to len(data) - block_size.
+    """
+    # sums[i] is the sum of the first i bytes and b, the sum of the sums of
+    # the first 1 to block_size bytes of the block, comes from their prefix
+    # sums. uint32 wraps around, so the differences stay exact modulo 2^32.
+    sums = np.zeros(len(data) + 1, np.uint32)
+    np.cumsum(np.frombuffer(data, np.uint8), dtype=np.uint32, out=sums[1:])
+    sums_of_sums = np.zeros(len(data) + 1, np.uint32)
+    np.cumsum(sums[1:], out=sums_of_sums[1:])
+    a = sums[block_size:] - sums[:-block_size]
+    b = sums_of_sums[block_size:] - sums_of_sums[:-block_size]
+    b -= sums[:-block_size] * np.uint32(block_size)
+    return a, b
+
+
+class FileDelta:
+    """
+    The parts of a file the server can copy from its old copy of the file, as
+    [offset, source offset, length] in the order of the file.
+    """
+
+    def __init__(self, copies):
+        self.copies = copies
+        self._offsets = [copy[0] for copy in copies]
+
+    def copied(self):
+        """
+        Returns:
+        - The number of bytes the server copies.
+        """
+        return sum(copy[2] for copy in self.copies)
+
+    def parts(self, offset, end):
+        """
+        Splits the bytes from offset to end into bytes to send and bytes to
+        copy.
+
+        Returns:
+        - (offset, length, source) tuples in order, source being the offset in
+          the server's copy, or None for bytes to send.
+        """
+        parts = []
+        first = max(bisect.bisect_right(self._offsets, offset) - 1, 0)
+        for copy_offset, source, length in self.copies[first:]:
+            if copy_offset >= end:
+                break
+            start, stop = max(copy_offset, offset), min(copy_offset + length, end)
+            if stop <= start:
+                continue
+            if start > offset:
+                parts.append((offset, start - offset, None))
+            parts.append((start, stop - start, source + start - copy_offset))
+            offset = stop
+        if offset < end:
+            parts.append((offset, end - offset, None))
+        return parts
+
+
+def find_copies(view, signatures, block_size):
+    """
+    Finds the blocks of the server's copy of the file anywhere in the file.
+    Weak checksums of every offset are computed in batches and prefiltered
+    with a table, so only the few offsets whose weak checksum matches a block
+    are hashed.
+
+    Parameters:
+    - view: A memoryview of the whole file.
+    - signatures: The signatures of the server's copy (request_signatures).
+    - block_size: The number of bytes per block.
+
+    Returns:
+    - A FileDelta with the parts of the file the server can copy.
+    """
+    copies = []
+    if not len(signatures) or len(view) < block_size:
+        return FileDelta(copies)
+    a, b = signatures["a"].astype(np.uint32), signatures["b"].astype(np.uint32)
+    weak = np.unique((a.astype(np.uint64) << 32) | b)
+    # A table with room for 64 times the blocks lets few false candidates
+    # through, and a small one stays in the cache
+    table_bits = min(max((len(signatures) * 64).bit_length(), 16), WEAK_TABLE_BITS)
+    table_mask = np.uint32((1 << table_bits) - 1)
+    table = np.zeros(1 << table_bits, bool)
+    table[b & table_mask] = True
+    blocks = {
+        strong.tobytes(): index for index, strong in enumerate(signatures["strong"])
+    }
+
+    covered = 0  # Offsets before this one are part of a copy already
+    for start in range(0, len(view) - block_size + 1, DELTA_WINDOW):
+        a, b = rolling_checksums(
+            view[start : start + DELTA_WINDOW + block_size - 1], block_size
+        )
+        candidates = np.flatnonzero(table[b & table_mask])
+        keys = (a[candidates].astype(np.uint64) << 32) | b[candidates]
+        found = np.minimum(np.searchsorted(weak, keys), len(weak) - 1)
+        candidates = candidates[weak[found] == keys] + start
+
+        i = np.searchsorted(candidates, covered)
+        while i < len(candidates):
+            offset = int(candidates[i])
+            block = view[offset : offset + block_size]
+            strong = hashlib.sha256(block).digest()[:STRONG_SIZE]
+            index = blocks.get(strong)
+            if index is None:
+                i += 1
+                continue
+            last = copies[-1] if copies else None
+            if last and last[0] + last[2] == offset:
+                # Prefer the block after the last one copied, which extends the
+                # copy when the server's copy repeats a block (runs of zeros)
+                following = (last[1] + last[2]) // block_size
+                if following < len(signatures) and (
+                    signatures["strong"][following].tobytes() == strong
+                ):
+                    index = following
+            source = index * block_size
+            if last and last[0] + last[2] == offset and last[1] + last[2] == source:
+                last[2] += block_size  # Extend the copy of consecutive blocks
+            else:
+                copies.append([offset, source, block_size])
+            covered = offset + block_size
+            i = np.searchsorted(candidates, covered)
+    return FileDelta(copies)
+
+
+def send_chunk_records(writer, view, chunks, chunk_size, delta=None):
+    """
+    Sends chunks of the file until no chunk is left, each a chunk record with
+    its offset followed by its data records.
+
+    Parameters:
+    - writer: The RecordWriter of the connection.
+    - view: A memoryview of the whole file.
+    - chunks: A function returning the offset of the next chunk to send, or
+      None once every chunk was taken.
+    - chunk_size: The number of bytes of the file per chunk.
+    - delta: The FileDelta of a delta transfer, whose copies are sent as copy
+      records instead of data.
+
+    Returns:
+    - The number of bytes of the file that were sent or copied.
+    """
+    sent = 0
+    while (offset := chunks()) is not None:
+        end = min(offset + chunk_size, len(view))
+        writer.send(RECORD_CHUNK, struct.pack(">Q", offset))
+        parts = delta.parts(offset, end) if delta else [(offset, end - offset, None)]
+        for start, length, source in parts:
+            if source is not None:
+                writer.send(RECORD_COPY, struct.pack(COPY_FORMAT, source, length))
+                continue
+            for position in range(start, start + length, RECORD_SIZE):
+                stop = min(position + RECORD_SIZE, start + length)
+                writer.send_data(view[position:stop])
+        sent += end - offset
+    return sent
+
+
+def send_chunks(
+    address, key, iv, session_id, view, chunks, chunk_size, delta=None, compressor=None
+):
+    """
+    Opens an additional connection of a chunked transfer and sends chunks of
+    the file over it until no chunk is left.
+
+    Parameters:
+    - address: The address of the server.
     - key: The secret key used for encryption.
     - iv: The initialization vector for encryption.
-    - data: The plaintext data to be encrypted.
+    - session_id: The identifier of the transfer the connection joins.
+    - view: A memoryview of the whole file.
+    - chunks: A function returning the offset of the next chunk to send, or
+      None once every chunk was taken.
+    - chunk_size: The number of bytes of the file per chunk.
+    - delta: The FileDelta of a delta transfer.
+    - compressor: The Compressor of the connection in a compressed transfer.
+    """
+    with socket.create_connection(address) as chunk_socket:
+        salt = os.urandom(SALT_SIZE)  # Every connection has its own nonces
+        chunk_socket.sendall(TRANSFER_MAGIC + salt)
+        writer = RecordWriter(chunk_socket, key, iv, salt)
+        writer.compressor = compressor
+        writer.send(RECORD_JOIN, session_id)
+        sent = send_chunk_records(writer, view, chunks, chunk_size, delta)
+        writer.send(RECORD_END, struct.pack(">Q", sent))
+        if chunk_socket.recv(len(TRANSFER_OK)) != TRANSFER_OK:
+            raise ConnectionError("The server did not confirm the chunks")
 
-    Returns:
-    - The encrypted data.
+
+def send_chunked(writer, view, connections, chunk_size, delta=None, codecs=None):
     """
-    cipher = AES.new(key, AES.MODE_CBC, iv)  # Create a new AES cipher object
-    return cipher.encrypt(pad(data, AES.block_size))  # Pad and encrypt the data
+    Sends a file as chunks, leaving out those the server already has from
+    an earlier attempt. With more than one connection the chunks are spread
+    over several connections, which keeps a link busy that a single TCP
+    stream cannot fill.
+
+    Parameters:
+    - writer: The RecordWriter of the connection the transfer started on.
+    - view: A memoryview of the whole file.
+    - connections: The number of connections sending chunks at once.
+    - chunk_size: The number of bytes of the file per chunk.
+    - delta: The FileDelta of a delta transfer.
+    - codecs: The names of the compression codecs to offer the server, best
+      first, or None to send the data as it is.
+    """
+    count = -(-len(view) // chunk_size)
+    if count > MAX_CHUNKS:
+        raise ValueError("Too many chunks for the file, use larger chunks")
+    manifest = b"".join(
+        hashlib.sha256(view[offset : offset + chunk_size]).digest()
+        for offset in range(0, len(view), chunk_size)
+    )
+    session_id = os.urandom(SESSION_ID_SIZE)
+    if codecs:
+        ids = bytes(COMPRESSION_IDS[codec] for codec in codecs)
+        writer.send(RECORD_COMPRESS, ids)
+    writer.send(
+        RECORD_PLAN, struct.pack(PLAN_FORMAT, session_id, len(view), chunk_size)
+    )
+    for start in range(0, len(manifest), RECORD_SIZE):
+        writer.send(RECORD_MANIFEST, manifest[start : start + RECORD_SIZE])
+
+    # The server confirms with a bitmap of the chunks it already has, and
+    # the codec it picked if compression was offered
+    client_socket = writer.client_socket
+    bitmap_size = -(-count // 8)
+    reply_size = len(TRANSFER_OK) + bitmap_size + (1 if codecs else 0)
+    reply = recv_exactly(client_socket, reply_size)
+    if len(reply) < reply_size or reply[: len(TRANSFER_OK)] != TRANSFER_OK:
+        raise ConnectionError("The server does not accept chunked transfers")
+    bitmap = reply[len(TRANSFER_OK) : len(TRANSFER_OK) + bitmap_size]
+    codec = None
+    if codecs:
+        codec = {COMPRESSION_IDS[name]: name for name in codecs}.get(reply[-1])
+        if codec is None:
+            print("The server cannot decompress any of the codecs offered")
+    missing = [i for i in range(count) if not bitmap[i >> 3] >> (i & 7) & 1]
+    if len(missing) < count:
+        print(f"Resuming: {count - len(missing)} of {count} chunks already sent")
+
+    offsets = iter([index * chunk_size for index in missing])
+    lock = threading.Lock()
+    errors = []
+    compressors = []
+    if codec:
+        writer.compressor = Compressor(codec)
+        compressors.append(writer.compressor)
 
+    def next_chunk():
+        with lock:
+            return next(offsets, None)
 
-def send_file(client_socket, filepath, key, iv):
+    def run():
+        compressor = Compressor(codec) if codec else None  # One per thread
+        if compressor:
+            with lock:
+                compressors.append(compressor)
+        try:
+            send_chunks(
+                client_socket.getpeername(),
+                writer.key,
+                writer.iv,
+                session_id,
+                view,
+                next_chunk,
+                chunk_size,
+                delta,
+                compressor,
+            )
+        except (OSError, ConnectionError) as e:
+            errors.append(e)
+
+    # This connection sends chunks too, next to connections - 1 others
+    threads = [threading.Thread(target=run) for _ in range(connections - 1)]
+    for thread in threads:
+        thread.start()
+    try:
+        send_chunk_records(writer, view, next_chunk, chunk_size, delta)
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    if compressors:
+        packed = sum(compressor.packed for compressor in compressors)
+        saved = sum(compressor.saved for compressor in compressors)
+        print(f"Compressed {packed} bytes with {codec}, saving {saved} bytes")
+
+
+def send_file(
+    client_socket,
+    filepath,
+    key,
+    iv,
+    connections=1,
+    chunk_size=CHUNK_SIZE,
+    block_size=None,
+    compression=None,
+):
     """
-    Encrypts and sends a file to the server.
+    Encrypts and sends a file to the server as authenticated records, in
+    chunks the server verifies against a manifest. The file is memory-mapped,
+    so its data is encrypted straight from the page cache without being read
+    into Python objects first.
 
     Parameters:
     - client_socket: The socket object used to communicate with the server.
     - filepath: The path to the file to be sent.
     - key: The secret key used for encryption.
     - iv: The initialization vector for encryption.
+    - connections: The number of connections to send the chunks over.
+    - chunk_size: The number of bytes of the file per chunk.
+    - block_size: With a block size, only send the bytes that differ from the
+      server's copy of the file, looking for its blocks of that many bytes.
+    - compression: The names of the compression codecs to offer the server,
+      best first, or None to send the data as it is.
+
+    Returns:
+    - The number of bytes of the file that were sent or copied, which is the
+      size of the file.
     """
+    salt = os.urandom(SALT_SIZE)  # Fresh nonces for every transfer
+    client_socket.sendall(TRANSFER_MAGIC + salt)
+    writer = RecordWriter(client_socket, key, iv, salt)
+    writer.send(RECORD_NAME, os.path.basename(filepath).encode())
+
     with open(filepath, "rb") as file:  # Open the file in binary read mode
-        while True:
-            bytes_read = file.read(
-                1024 - (1024 % AES.block_size)
-            )  # Read the file in chunks
-            if not bytes_read:
-                break  # Break the loop if end of file is reached
-            encrypted_data = encrypt_data(key, iv, bytes_read)  # Encrypt the chunk
-            client_socket.sendall(encrypted_data)  # Send the encrypted chunk
+        size = os.fstat(file.fileno()).st_size
+        if size:  # Empty files cannot be mapped
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)  # Read ahead aggressively
+            view = memoryview(mapped)
+            delta = None
+            if block_size:
+                signatures = request_signatures(writer, block_size)
+                delta = find_copies(view, signatures, block_size)
+                print(f"The server copies {delta.copied()} of {size} bytes")
+            send_chunked(writer, view, connections, chunk_size, delta, compression)
+            # Not closed on errors: the traceback may still hold views of it
+            view.release()
+            mapped.close()
+    writer.send(RECORD_END, struct.pack(">Q", size))
+    return size
 
 
 def client_program():
     """
     Main client program to handle file encryption and sending.
     """
-    # Ensure the correct number of command-line arguments
-    if len(sys.argv) != 6:
-        print(
-            "Usage: python client_files.py <ip_address> <port> <key_hex> <iv_hex> <filepath>"
-        )
-        sys.exit(1)
-
-    # Parse command-line arguments
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-    key_hex = sys.argv[3]
-    iv_hex = sys.argv[4]
-    filepath = sys.argv[5]
+    # Parse the command-line arguments passed by the Clients GUI
+    parser = argparse.ArgumentParser(description="Send an encrypted file.")
+    parser.add_argument("ip_address", help="IP address of the server")
+    parser.add_argument("port", type=int, help="Port of the server")
+    parser.add_argument("key_hex", help="AES key in hexadecimal")
+    parser.add_argument("iv_hex", help="Initialization vector in hexadecimal")
+    parser.add_argument("filepath", help="The file to send")
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="Send the chunks of the file over this many connections at once",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Bytes of the file per chunk; resuming needs the same chunk size",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only send what differs from the copy of the file on the server",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=DELTA_BLOCK_SIZE,
+        help="Bytes per block compared with the server's copy",
+    )
+    parser.add_argument(
+        "--compress",
+        nargs="?",
+        const="auto",
+        choices=["auto", *COMPRESSION_IDS],
+        help="Compress the data that compresses well, with the given codec or "
+        "the fastest one both sides have (lz4 and zstd need their packages)",
+    )
+    args = parser.parse_args()
+    compression = None
+    if args.compress == "auto":
+        compression = COMPRESSION_CODECS
+    elif args.compress:
+        if args.compress not in COMPRESSION_CODECS:
+            parser.error(f"{args.compress} is not installed")
+        compression = [args.compress]
+    if not MIN_BLOCK_SIZE <= args.block_size <= RECORD_SIZE:
+        parser.error(f"Use blocks of {MIN_BLOCK_SIZE} to {RECORD_SIZE} bytes")
+    if args.connections < 1 or args.chunk_size < MIN_CHUNK_SIZE:
+        parser.error(f"Use at least 1 connection and chunks of {MIN_CHUNK_SIZE} bytes")
+    host, port, filepath = args.ip_address, args.port, args.filepath
 
     # Convert hexadecimal key and IV to bytes
-    key = bytes.fromhex(key_hex)
-    iv = bytes.fromhex(iv_hex)
+    key = bytes.fromhex(args.key_hex)
+    iv = bytes.fromhex(args.iv_hex)
+    if len(iv) < 12:
+        print("The IV must be at least 12 bytes long.")
+        sys.exit(1)
 
     # Establish a socket connection to the server
     client_socket = socket.socket()
     print(f"Connecting to {host}:{port}")
     client_socket.connect((host, port))
 
-    # Send the filename to the server as a preamble to file transfer
-    filename = filepath.split("/")[-1]  # Extract the filename from the filepath
-    client_socket.send(filename.encode())  # Encode and send the filename
-
-    # Start the file transfer
+    # Start the file transfer; the filename travels in the first record
     print("Sending file...")
-    send_file(client_socket, filepath, key, iv)  # Encrypt and send the file
+    send_file(
+        client_socket,
+        filepath,
+        key,
+        iv,
+        args.connections,
+        args.chunk_size,
+        args.block_size if args.delta else None,
+        compression,
+    )
+
+    # Wait for the server to confirm it verified and stored the whole file
+    if client_socket.recv(len(TRANSFER_OK)) != TRANSFER_OK:
+        print("The server did not confirm the file transfer.")
+        client_socket.close()
+        sys.exit(1)
     print("File has been encrypted and sent successfully.")
 
     # Close the socket connection
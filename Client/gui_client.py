@@ -11,6 +11,9 @@ script_directory = os.path.dirname(__file__)
 customtkinter.set_appearance_mode("System")
 customtkinter.set_default_color_theme("blue")
 
+# Codec menu entry that starts client.py without --codec, so the server picks
+SERVER_DEFAULT_CODEC = "server default"
+
 
 class Intro_Frame(customtkinter.CTkFrame):
     """
@@ -119,6 +122,18 @@ class Access_Frame(customtkinter.CTkFrame):
             entry.grid(row=i * 2 + 1, column=0, padx=0, pady=0, sticky="nesw")
             self.entry_widgets.append(entry)
 
+        # Codec the server should use for this screen sharing session.
+        codec_label = customtkinter.CTkLabel(self, text="**Codec:", font=("Roboto", 20))
+        codec_label.grid(row=16, column=0, padx=0, pady=10, sticky="nesw")
+
+        self.codec_menu = customtkinter.CTkOptionMenu(
+            self,
+            values=[SERVER_DEFAULT_CODEC, "jpeg", "webp", "png", "zlib"],
+            font=("Roboto", 20),
+            height=40,
+        )
+        self.codec_menu.grid(row=17, column=0, padx=0, pady=0, sticky="nesw")
+
         # Button to initiate screen monitoring.
         self.button_connect = customtkinter.CTkButton(
             self,
@@ -183,19 +198,20 @@ class Access_Frame(customtkinter.CTkFrame):
             try:
                 # Construct the full path to client.py in the same directory
                 client_py_path = os.path.join(script_directory, "client.py")
+                command = [
+                    "python",
+                    client_py_path,
+                    ip_address,
+                    port_number,
+                    screen_index,
+                    window_width,
+                    window_height,
+                ]
+                codec = self.codec_menu.get()
+                if codec != SERVER_DEFAULT_CODEC:
+                    command += ["--codec", codec]
                 # Start the screen sharing process in a subprocess
-                subprocess.Popen(
-                    [
-                        "python",
-                        client_py_path,
-                        ip_address,
-                        port_number,
-                        screen_index,
-                        window_width,
-                        window_height,
-                    ],
-                    shell=True,
-                )
+                subprocess.Popen(command, shell=True)
                 # Notify the client of the successful operation
                 messagebox.showinfo(
                     "Success",
@@ -0,0 +1,215 @@
+import argparse  # Argparse for the command-line arguments
+import mmap  # Mmap to read frames straight from the recording without copies
+import os  # Os for file sizes
+import struct  # Struct for the frame headers
+import time  # Time for real-time playback
+import tkinter as tk  # Tkinter for the playback window
+import cv2  # OpenCV to save snapshots
+import numpy as np  # NumPy to load and search the frame index
+from PIL import ImageTk  # PIL to show frames in Tkinter
+
+from client import (
+    CODEC_IDS,
+    CODECS,
+    FLAG_KEYFRAME,
+    HEADER_FORMAT,
+    HEADER_SIZE,
+    StreamDecoder,
+    prepare_image,
+)
+
+# Recordings written by server.py --record: RECORD_MAGIC, then the frames as
+# version 2 FRAME messages; the index file has one entry per frame
+RECORD_MAGIC = b"RREC\x01"
+INDEX_SUFFIX = ".idx"
+INDEX_DTYPE = np.dtype(
+    [
+        ("offset", ">u8"),  # Offset of the frame's header in the recording
+        ("timestamp", ">u8"),  # Capture time in microseconds since the epoch
+        ("flags", "u1"),
+        ("channel", "u1"),  # Screen index
+        ("codec", "u1"),
+    ]
+)
+
+
+# Random access to the frames of a session recording
+class Recording:
+    """
+    Memory-maps a session recording and loads its index, so any point of the
+    session is reached by a binary search over the timestamps followed by
+    decoding from the nearest keyframe, instead of decoding from the start.
+
+    A recording can hold several screens (channels) and, when viewers used
+    different codecs, several encodings of the same screen. Every combination
+    is an independent stream; frames() selects one.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(RECORD_MAGIC)] != RECORD_MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        index_path = path + INDEX_SUFFIX
+        # A partly written last entry is ignored
+        count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.index = np.fromfile(index_path, INDEX_DTYPE, count)
+        self.index = self.index[self.index["offset"] < len(self._map)]
+
+    # (channel, codec name) pairs in the recording, in order of appearance
+    def streams(self):
+        pairs = self.index[["channel", "codec"]].tolist()
+        return [(channel, CODECS[codec][0]) for channel, codec in dict.fromkeys(pairs)]
+
+    # Index entries of one stream, the first stream of the channel by default
+    def frames(self, channel=0, codec=None):
+        entries = self.index[self.index["channel"] == channel]
+        if len(entries) == 0:
+            raise ValueError(f"No frames of screen {channel} in the recording")
+        codec_id = CODEC_IDS[codec] if codec else entries["codec"][0]
+        return entries[entries["codec"] == codec_id]
+
+    # Payload of a frame as a view into the mapped recording
+    def payload(self, entry):
+        offset = int(entry["offset"])
+        length = struct.unpack_from(HEADER_FORMAT, self._map, offset)[-1]
+        start = offset + HEADER_SIZE
+        return memoryview(self._map)[start : start + length]
+
+    # Position of the frame shown at timestamp and of the keyframe it needs
+    @staticmethod
+    def seek(entries, timestamp):
+        position = max(
+            0, int(np.searchsorted(entries["timestamp"], timestamp, "right")) - 1
+        )
+        keyframes = np.flatnonzero(entries["flags"][: position + 1] & FLAG_KEYFRAME)
+        return position, int(keyframes[-1]) if len(keyframes) else 0
+
+    # Decode the picture shown at timestamp
+    def frame_at(self, entries, timestamp):
+        position, keyframe = self.seek(entries, timestamp)
+        decoder = StreamDecoder()
+        frame = None
+        for entry in entries[keyframe : position + 1]:
+            frame = decoder.decode(self.payload(entry))
+        return frame
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# Function to print what a recording contains
+def print_info(recording):
+    for channel, codec in recording.streams():
+        entries = recording.frames(channel, codec)
+        duration = (int(entries["timestamp"][-1]) - int(entries["timestamp"][0])) / 1e6
+        keyframes = int(np.count_nonzero(entries["flags"] & FLAG_KEYFRAME))
+        start = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(int(entries["timestamp"][0]) / 1e6)
+        )
+        print(
+            f"screen {channel} {codec}: {len(entries)} frames, {keyframes} keyframes, "
+            f"{duration:.1f} s from {start}"
+        )
+
+
+# Function to play a recording in a window from a given second on
+def play(recording, entries, start, speed, window_width, window_height):
+    root = tk.Tk()
+    root.title("Session Replay")
+    root.geometry(f"{window_width}x{window_height}")
+    label = tk.Label(root)
+    label.pack(padx=10, pady=10)
+    display_size = [window_width, window_height]
+
+    def on_configure(event):
+        if event.widget is root:
+            display_size[:] = [event.width, event.height]
+
+    root.bind("<Configure>", on_configure)
+
+    # Jump to the requested time: decode from the keyframe before it
+    first = int(entries["timestamp"][0])
+    position, keyframe = Recording.seek(entries, first + int(start * 1e6))
+    decoder = StreamDecoder()
+    for entry in entries[keyframe:position]:
+        decoder.decode(recording.payload(entry))
+
+    # Map recording time to wall-clock time for real-time playback
+    origin = time.perf_counter()
+    origin_timestamp = int(entries["timestamp"][position])
+    state = {"position": position}
+
+    def show_next():
+        position = state["position"]
+        if position >= len(entries):
+            root.quit()
+            return
+        frame = decoder.decode(recording.payload(entries[position]))
+        if frame is not None:
+            photo = ImageTk.PhotoImage(prepare_image(frame, display_size))
+            label.config(image=photo)
+            label.image = photo
+        state["position"] = position + 1
+        if position + 1 < len(entries):
+            due = (int(entries["timestamp"][position + 1]) - origin_timestamp) / 1e6
+            delay = due / speed - (time.perf_counter() - origin)
+            root.after(max(1, int(delay * 1000)), show_next)
+        else:
+            root.after(1000, root.quit)  # Keep the last frame on screen briefly
+
+    show_next()
+    root.mainloop()
+    try:
+        root.destroy()
+    except tk.TclError:
+        pass  # The user already closed the window
+
+
+# Main function
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session.")
+    parser.add_argument("recording", help="Recording written by server.py --record")
+    parser.add_argument(
+        "--start", type=float, default=0, help="Second of the session to start at"
+    )
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed")
+    parser.add_argument("--screen", type=int, default=0, help="Screen to replay")
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODEC_IDS),
+        default=None,
+        help="Encoding to replay when viewers used several codecs",
+    )
+    parser.add_argument("--width", type=int, default=1280, help="Window width")
+    parser.add_argument("--height", type=int, default=720, help="Window height")
+    parser.add_argument(
+        "--info", action="store_true", help="Only list the recorded screens"
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=None,
+        help="Save the picture at --start to this image file instead of playing",
+    )
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    try:
+        if args.info:
+            print_info(recording)
+            return
+        entries = recording.frames(args.screen, args.codec)
+        if args.snapshot:
+            frame = recording.frame_at(
+                entries, int(entries["timestamp"][0]) + int(args.start * 1e6)
+            )
+            cv2.imwrite(args.snapshot, frame)
+            return
+        play(recording, entries, args.start, args.speed, args.width, args.height)
+    finally:
+        recording.close()
+
+
+if __name__ == "__main__":
+    main()
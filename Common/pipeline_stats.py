@@ -0,0 +1,149 @@
+# Per-stage statistics shared by server.py and client.py, which import this
+# module from the Common folder next to theirs
+import collections  # Collections for the rolling statistics
+import http.server  # Http.server for the local statistics endpoint
+import json  # Json for the structured statistics log lines and endpoint
+import threading  # Threading for the reporting threads
+import time  # Time for the rolling windows and log timestamps
+
+import numpy as np  # NumPy for the percentiles
+
+
+# Rolling per-stage timings and throughput of the pipeline
+class PipelineStats:
+    """
+    Lightweight timers and throughput counters for the stages of the pipeline.
+
+    record() keeps the last window durations of every stage, from which
+    snapshot() computes p50/p95/p99. count() remembers the messages and bytes
+    of every stream during the last period seconds, giving FPS and bytes per
+    second. Recording is a locked deque append, cheap enough for every frame.
+    """
+
+    def __init__(self, window=1000, period=5.0):
+        self.window = window  # Samples kept per stage
+        self.period = period  # Seconds the throughput is averaged over
+        self._lock = threading.Lock()
+        self._stages = {}  # Stage name -> deque of durations in seconds
+        self._streams = {}  # Stream name -> deque of (time, bytes)
+        self._started = time.monotonic()
+
+    # Add the duration of one run of a stage
+    def record(self, stage, seconds):
+        with self._lock:
+            samples = self._stages.get(stage)
+            if samples is None:
+                samples = self._stages[stage] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    # Add one message of size bytes to a stream
+    def count(self, stream, size=0):
+        now = time.monotonic()
+        with self._lock:
+            events = self._streams.get(stream)
+            if events is None:
+                events = self._streams[stream] = collections.deque()
+            events.append((now, size))
+            while events[0][0] < now - self.period:
+                events.popleft()
+
+    def snapshot(self):
+        """
+        Summarizes the collected samples.
+
+        Returns:
+        - A dict with p50/p95/p99 in milliseconds and the sample count per
+          stage, and FPS and bytes per second per stream.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stages = {stage: list(samples) for stage, samples in self._stages.items()}
+            streams = {
+                stream: [size for at, size in events if at >= now - self.period]
+                for stream, events in self._streams.items()
+            }
+        elapsed = max(min(self.period, now - self._started), 1e-3)
+        result = {"stages": {}, "streams": {}}
+        for stage, samples in stages.items():
+            p50, p95, p99 = np.percentile(samples, (50, 95, 99)) * 1000
+            result["stages"][stage] = {
+                "count": len(samples),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+            }
+        for stream, sizes in streams.items():
+            result["streams"][stream] = {
+                "fps": round(len(sizes) / elapsed, 2),
+                "bytes_per_second": round(sum(sizes) / elapsed),
+            }
+        return result
+
+    # Render a snapshot in the Prometheus text format
+    def prometheus(self, prefix):
+        snapshot = self.snapshot()
+        lines = []
+        for stage, values in snapshot["stages"].items():
+            for quantile, key in (
+                ("0.5", "p50_ms"),
+                ("0.95", "p95_ms"),
+                ("0.99", "p99_ms"),
+            ):
+                lines.append(
+                    f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                    f"{values[key] / 1000}"
+                )
+        for stream, values in snapshot["streams"].items():
+            lines.append(f'{prefix}_fps{{stream="{stream}"}} {values["fps"]}')
+            lines.append(
+                f'{prefix}_bytes_per_second{{stream="{stream}"}} '
+                f'{values["bytes_per_second"]}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+# Function to print the statistics as one JSON line every interval seconds
+def log_stats(stats, interval, side):
+    while True:
+        time.sleep(interval)
+        record = {"event": "stats", "side": side, "time": round(time.time(), 3)}
+        record.update(stats.snapshot())
+        print(json.dumps(record), flush=True)
+
+
+# Function to serve the statistics over HTTP on a local port for monitoring agents
+def serve_stats(stats, port, side, host="127.0.0.1"):
+    class StatsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = stats.prometheus(f"remote_{side}").encode()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path in ("/", "/stats"):
+                body = json.dumps(stats.snapshot()).encode()
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are too frequent to log
+
+    httpd = http.server.ThreadingHTTPServer((host, port), StatsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+# Function to start the periodic log lines and the stats endpoint that are enabled
+def start_stats_reporting(stats, interval, port, side):
+    if interval:
+        threading.Thread(
+            target=log_stats, args=(stats, interval, side), daemon=True
+        ).start()
+    if port:
+        serve_stats(stats, port, side)
+        print(f"Statistics on http://127.0.0.1:{port}/stats and /metrics")
@@ -120,6 +120,20 @@ class Access_Frame(customtkinter.CTkFrame):
             entry.grid(row=i * 2 + 1, column=0, padx=0, pady=0, sticky="nesw")
             self.entry_widgets.append(entry)
 
+        # Codec used for viewers that do not ask for one
+        self.codec_label = customtkinter.CTkLabel(
+            self, text="**Codec:", font=("Roboto", 20)
+        )
+        self.codec_label.grid(row=8, column=0, padx=0, pady=10, sticky="nesw")
+
+        self.codec_menu = customtkinter.CTkOptionMenu(
+            self,
+            values=["jpeg", "webp", "png", "zlib"],
+            font=("Roboto", 20),
+            height=40,
+        )
+        self.codec_menu.grid(row=9, column=0, padx=0, pady=0, sticky="nesw")
+
         # Buttons for starting monitoring, receiving files, copying keys/IV, and clearing fields
         self.button_connect = customtkinter.CTkButton(
             self,
@@ -217,7 +231,15 @@ class Access_Frame(customtkinter.CTkFrame):
                 # Full path to server.py in the same directory
                 server_py_path = os.path.join(script_directory, "server.py")
                 subprocess.Popen(
-                    ["python", server_py_path, ip_address, port_number, screen_index],
+                    [
+                        "python",
+                        server_py_path,
+                        ip_address,
+                        port_number,
+                        screen_index,
+                        "--codec",
+                        self.codec_menu.get(),
+                    ],
                     shell=True,
                 )
                 messagebox.showinfo(
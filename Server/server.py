@@ -1,5 +1,6 @@
 import socket  # Socket library for network communication
 import threading  # Threading for concurrent client handling
+import queue  # Queue for per-viewer frame buffering
 import cv2  # OpenCV for image processing
 import struct  # Struct for handling binary data
 import numpy as np  # NumPy for numerical operations on images
@@ -7,62 +8,2030 @@ from mss import mss  # mss library for screen capture
 from screeninfo import (
     get_monitors,
 )  # get_monitors for monitor information retrieval
-import sys  # sys for command-line arguments
+import argparse  # argparse for command-line arguments
+import asyncio  # asyncio for the event loop server mode
+import signal  # signal for a clean shutdown of the event loop server
+import functools  # functools for encoder and controller factories
+import time  # time for layout refresh scheduling and send timing
+import zlib  # zlib for the lossless raw pixel codec
+import collections  # collections for control messages
+import concurrent.futures  # concurrent.futures for the stripe encoding pool
+import os  # os to locate the shared modules
+import sys  # sys to import the shared modules
 
+# The statistics code is shared with the client, in the Common folder
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common")
+)
+from pipeline_stats import PipelineStats, start_stats_reporting  # noqa: E402
 
-# Function to capture the screen specified by its number
-def capture_screen(screen_number):
-    monitors = get_monitors()  # Retrieve information about available monitors
-    if screen_number >= len(monitors):  # Check if the specified screen number is valid
-        raise ValueError("Screen number out of range.")
-    monitor = monitors[screen_number]  # Get information about the specified monitor
+# Optional ioctl to read the unsent bytes of a socket (Linux only)
+try:
+    import fcntl
+    import termios
 
-    # Capture a screenshot of the specified monitor
-    with mss() as sct:
-        monitor_region = {
+    TIOCOUTQ = termios.TIOCOUTQ
+except (ImportError, AttributeError):
+    fcntl = None
+    TIOCOUTQ = None
+
+# Unsent bytes a viewer connection may hold before the next frame is picked
+MAX_QUEUED_BYTES = 64 * 1024
+
+# Buffers passed to one sendmsg call, well below the usual IOV_MAX of 1024
+MAX_SEND_BUFFERS = 512
+
+# Frames a version 2 viewer that acknowledges frames may have in flight, and
+# seconds without an acknowledgement after which it is no longer held back
+MAX_UNACKED_FRAMES = 2
+ACK_TIMEOUT = 1.0
+
+# Seconds between keyframes encoded only for viewers that lost delta frames
+RECOVERY_INTERVAL = 0.5
+
+# Control messages a viewer sends to the server: magic, window width and height,
+# and in the hello the id of the codec it prefers (0 leaves the choice to the server)
+CONTROL_FORMAT = ">4sHHB"
+CONTROL_SIZE = struct.calcsize(CONTROL_FORMAT)
+HELLO_MAGIC = b"RHLO"  # First message of a viewer, announces its window size
+MUX_HELLO_MAGIC = b"RMUX"  # Hello of a viewer that multiplexes several screens
+RESIZE_MAGIC = b"RSIZ"  # Sent whenever the viewer's window size changes
+SUBSCRIBE_MAGIC = b"RSUB"  # Multiplexed viewer starts watching a screen (last byte)
+UNSUBSCRIBE_MAGIC = b"RUNS"  # Multiplexed viewer stops watching a screen
+HELLO_TIMEOUT = 0.5  # Seconds to wait for the hello of a viewer
+
+# Marks a delta frame made of changed tiles instead of a full image
+TILE_MAGIC = b"RTIL"
+
+# Marks a keyframe split into horizontal stripes that decode independently;
+# stripe heights are a multiple of STRIPE_ALIGN rows, the largest JPEG block
+STRIPE_MAGIC = b"RSTR"
+STRIPE_ALIGN = 16
+
+# Marks a delta frame that first copies regions of the previous picture to new
+# positions (a scrolled page, a dragged window), then paints changed tiles
+MOVE_MAGIC = b"RMOV"
+
+# Motion search of the delta encoder: the previous frame is sampled every
+# MOTION_STEP pixels and searched for horizontal segments of MOTION_SEGMENT
+# samples taken from the changed tiles; a motion needs MIN_MOTION_VOTES
+# matching segments, and is only looked for once MIN_MOTION_TILES changed.
+# Segments are taken from at most MAX_ANCHOR_TILES of the changed tiles and
+# looked up through a table of ANCHOR_TABLE_SIZE bits first. After a search
+# found nothing, the next MOTION_RETRY_FRAMES frames are not searched
+MOTION_STEP = 4
+MOTION_SEGMENT = 16
+MIN_MOTION_VOTES = 4
+MIN_MOTION_TILES = 4
+MAX_ANCHOR_TILES = 128
+ANCHOR_TABLE_SIZE = 1 << 20
+MOTION_RETRY_FRAMES = 4
+SEGMENT_WEIGHTS = np.array(
+    [pow(0x9E3779B97F4A7C15, k, 1 << 64) for k in range(MOTION_SEGMENT)], np.uint64
+)
+
+# Multiplexed connections: the first message lists the screens the server
+# shares (count and screen indices as bytes), and every frame is prefixed with
+# CHANNEL_MAGIC and the index of its screen
+LIST_MAGIC = b"RLST"
+CHANNEL_MAGIC = b"RCHN"
+
+# Marks a keyframe in a codec other than JPEG; plain JPEG keyframes carry no header
+FRAME_MAGIC = b"RFRM"
+
+# Version 2 of the wire protocol. Every message in both directions starts with
+# a fixed header: magic, version, message type, channel (screen index), codec
+# id, frame sequence number, capture timestamp in microseconds since the epoch,
+# flags and payload length. Viewers opt in with a version 2 hello; a version 1
+# message never starts with V2_MAGIC, so both versions are told apart by their
+# first four bytes and older viewers keep the format above.
+V2_MAGIC = b"RFV2"
+PROTOCOL_VERSION = 2
+HEADER_FORMAT = ">4sBBBBLQBL"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_CONTROL_PAYLOAD = 1024  # Longest control message payload a viewer may send
+
+# Message types sent by the server
+MSG_FRAME = 1  # Payload is a keyframe or delta frame in the formats above
+MSG_LIST = 2  # Payload is the count and indices of the shared screens
+# Message types sent by the viewer
+MSG_HELLO = 16  # Payload is ">HH" window size; codec in the header
+MSG_RESIZE = 17  # Payload is ">HH" window size
+MSG_SUBSCRIBE = 18  # Start watching the screen in the channel field
+MSG_UNSUBSCRIBE = 19  # Stop watching the screen in the channel field
+MSG_ACK = 20  # Frame seq and capture timestamp of the channel were displayed
+MSG_KEYFRAME_REQUEST = 21  # The viewer lost its picture of the channel
+
+# Header flags
+FLAG_KEYFRAME = 1  # The frame does not depend on earlier frames
+FLAG_MULTIPLEX = 2  # In a hello: the viewer watches several screens
+
+# Session recordings start with RECORD_MAGIC (including the format version)
+# and hold the frames as version 2 FRAME messages. The index file next to them
+# has one INDEX_FORMAT entry per frame: offset of the frame's header, capture
+# timestamp, flags, channel and codec id.
+RECORD_MAGIC = b"RREC\x01"
+INDEX_FORMAT = ">QQBBB"
+INDEX_SUFFIX = ".idx"
+
+# Version 1 control messages and the version 2 message types they stand for
+V1_CONTROL_TYPES = {
+    HELLO_MAGIC: MSG_HELLO,
+    MUX_HELLO_MAGIC: MSG_HELLO,
+    RESIZE_MAGIC: MSG_RESIZE,
+    SUBSCRIBE_MAGIC: MSG_SUBSCRIBE,
+    UNSUBSCRIBE_MAGIC: MSG_UNSUBSCRIBE,
+}
+
+# A control message from a viewer in either protocol version
+ControlMessage = collections.namedtuple(
+    "ControlMessage",
+    "version kind channel codec_id seq timestamp flags width height",
+)
+
+
+# Timings and throughput of every stage on this server
+stats = PipelineStats()
+
+
+# Convert raw BGRA screen pixels into the BGR array out
+def convert_bgra(raw, out):
+    # View the raw BGRA pixels without copying them into a new array
+    height, width = out.shape[:2]
+    bgra = np.frombuffer(raw, np.uint8).reshape(height, width, 4)
+    # Convert from Blue-Green-Red-Alpha to Blue-Green-Red into the reused buffer
+    cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+    return out
+
+
+# Long-lived capture engine for one screen
+class ScreenCapture:
+    """
+    Captures frames of a single screen without per-frame setup cost.
+
+    The mss grab context is opened once and kept for the lifetime of the engine,
+    the monitor geometry is cached and only re-read from screeninfo every
+    refresh_interval seconds (or when a grab fails because the layout changed),
+    and the BGR output buffer is allocated once per resolution and reused.
+
+    The array returned by grab() is overwritten by the next grab, so callers that
+    share an engine must hold its lock while they use the frame.
+    """
+
+    def __init__(self, screen_number, refresh_interval=2.0):
+        self.screen_number = screen_number
+        self.refresh_interval = refresh_interval  # Seconds between layout checks
+        self.lock = threading.Lock()  # Serializes grabs on the shared engine
+        self._sct = None  # mss grab context, opened lazily by the grabbing thread
+        self._region = None  # Cached monitor geometry in mss format
+        self._frame = None  # Reused BGR output buffer
+        self._next_refresh = 0.0
+
+    # Re-read the monitor layout and resize the output buffer if it changed
+    def refresh_layout(self):
+        monitors = get_monitors()  # Retrieve information about available monitors
+        if self.screen_number >= len(monitors):  # Check if the screen number is valid
+            raise ValueError("Screen number out of range.")
+        monitor = monitors[self.screen_number]
+        region = {
             "top": monitor.y,
             "left": monitor.x,
             "width": monitor.width,
             "height": monitor.height,
         }
-        sct_img = sct.grab(monitor_region)  # Capture the screen region
-        frame = np.array(
-            sct_img
-        )  # Convert the screenshot to a NumPy array to avoid software crashing
-        frame = cv2.cvtColor(
-            frame, cv2.COLOR_BGRA2BGR
-        )  # Convert from Blue-Green-Red-Alpha to Blue-Green-Red color format
-        return frame  # Return the captured screen as a BGR image
+        if region != self._region:
+            self._region = region
+            self._frame = np.empty((monitor.height, monitor.width, 3), np.uint8)
+        self._next_refresh = time.monotonic() + self.refresh_interval
 
+    # Capture the current screen content as a BGR image
+    def grab(self, out=None):
+        """
+        Captures the screen into out, or into the engine's own reused buffer
+        when out is None. If out does not match the screen size a new array is
+        allocated and returned instead.
+        """
+        if self._sct is None:
+            self._sct = mss()
+        if time.monotonic() >= self._next_refresh:
+            self.refresh_layout()
 
-# Function to handle each client connection in a separate thread
-def client_thread(conn, addr, screen_number):
+        start = time.perf_counter()
+        try:
+            sct_img = self._sct.grab(self._region)  # Capture the screen region
+        except Exception:
+            # The cached geometry may be stale (monitor unplugged, resolution
+            # switch), so re-read the layout once before giving up
+            self.refresh_layout()
+            sct_img = self._sct.grab(self._region)
+        converted = time.perf_counter()
+        stats.record("capture", converted - start)
+
+        shape = (sct_img.height, sct_img.width, 3)
+        if out is None:
+            if self._frame.shape != shape:
+                self._frame = np.empty(shape, np.uint8)
+            out = self._frame
+        elif out.shape != shape:
+            out = np.empty(shape, np.uint8)
+        convert_bgra(sct_img.raw, out)
+        stats.record("convert", time.perf_counter() - converted)
+        return out
+
+    # Release the grab context
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+
+# Image codec backed by cv2.imencode
+class ImageCodec:
+    """
+    Frame codec that compresses images with one of OpenCV's image formats.
+
+    quality_flag is the imwrite parameter the adaptive quality is written to,
+    or None for lossless formats that ignore the quality.
+    """
+
+    def __init__(
+        self, codec_id, name, extension, quality_flag=None, params=(), lossless=False
+    ):
+        self.codec_id = codec_id  # Identifies the codec in the frame header
+        self.name = name  # Name used on the command line and in the GUIs
+        self.extension = extension  # Image format passed to cv2.imencode
+        self.quality_flag = quality_flag
+        self.params = list(params)  # Fixed imwrite parameters
+        self.lossless = lossless
+
+    # Compress a BGR image, returning the encoded bytes as a list of buffers
+    def encode(self, image, quality):
+        params = self.params
+        if self.quality_flag is not None:
+            params = params + [self.quality_flag, quality]
+        _, buffer = cv2.imencode(self.extension, image, params)
+        return [buffer]
+
+
+# Raw pixels compressed with zlib
+class ZlibCodec:
+    """
+    Lossless frame codec that deflates the raw BGR pixels.
+
+    The payload is the image width and height (">HH") followed by the zlib
+    stream. At the fastest compression level this costs far less CPU than any
+    image format, which suits loopback and LAN links.
+    """
+
+    codec_id = 4
+    name = "zlib"
+    lossless = True
+
+    def __init__(self, level=1, slice_bytes=1 << 20):
+        self.level = level  # zlib compression level
+        self.slice_bytes = slice_bytes  # Input compressed per call
+
+    # Compress a BGR image, returning the encoded bytes as a list of buffers
+    def encode(self, image, quality):
+        height, width = image.shape[:2]
+        pixels = memoryview(np.ascontiguousarray(image)).cast("B")
+        # Compress slice by slice and keep the pieces of the stream as they are,
+        # so no output buffer is ever grown or joined
+        compressor = zlib.compressobj(self.level)
+        parts = [struct.pack(">HH", width, height)]
+        for start in range(0, len(pixels), self.slice_bytes):
+            parts.append(compressor.compress(pixels[start : start + self.slice_bytes]))
+        parts.append(compressor.flush())
+        return parts
+
+
+# Codecs a session can choose from, by name
+CODECS = {
+    codec.name: codec
+    for codec in (
+        ImageCodec(1, "jpeg", ".jpg", cv2.IMWRITE_JPEG_QUALITY),
+        ImageCodec(2, "webp", ".webp", cv2.IMWRITE_WEBP_QUALITY),
+        ImageCodec(
+            3, "png", ".png", params=(cv2.IMWRITE_PNG_COMPRESSION, 1), lossless=True
+        ),
+        ZlibCodec(),
+    )
+}
+JPEG_CODEC_ID = CODECS["jpeg"].codec_id
+
+
+# Function to prepend the codec header to the buffers of an encoded keyframe
+def pack_keyframe(codec, parts):
+    if codec.codec_id == JPEG_CODEC_ID:
+        return parts  # Plain JPEG, readable by clients that predate codec headers
+    return [FRAME_MAGIC + struct.pack(">B", codec.codec_id), *parts]
+
+
+# Function to count the bytes of a payload made of several buffers
+def payload_size(parts):
+    return sum(memoryview(part).nbytes for part in parts)
+
+
+# Function to create the thread pool that encodes the stripes of keyframes
+def stripe_pool(stripes):
+    if stripes <= 1:
+        return None
+    # The codecs release the GIL while they compress, so threads encode in
+    # parallel without copying frames to other processes
+    return concurrent.futures.ThreadPoolExecutor(
+        stripes, thread_name_prefix="stripe-encoder"
+    )
+
+
+# Function to encode a keyframe, as stripes on pool if there is one
+def encode_keyframe(codec, frame, quality, pool=None, stripes=1):
+    """
+    Without a pool the keyframe is a single image (pack_keyframe). Otherwise
+    the frame is cut into stripes horizontal stripes that are encoded in
+    parallel; the payload is STRIPE_MAGIC followed by the codec id, frame
+    width, height and stripe count (">BHHH") and, per stripe, its first row
+    and encoded size (">HL") followed by the encoded image.
+    """
+    if pool is None:
+        return pack_keyframe(codec, codec.encode(frame, quality))
+    height, width = frame.shape[:2]
+    rows = -(-height // stripes)
+    rows = -(-rows // STRIPE_ALIGN) * STRIPE_ALIGN
+    starts = range(0, height, rows)
+    encoded = pool.map(lambda y: codec.encode(frame[y : y + rows], quality), starts)
+    parts = [
+        STRIPE_MAGIC + struct.pack(">BHHH", codec.codec_id, width, height, len(starts))
+    ]
+    for y, stripe in zip(starts, encoded):
+        parts.append(struct.pack(">HL", y, payload_size(stripe)))
+        parts.extend(stripe)
+    return parts
+
+
+# Encoder that sends every frame as a full image
+class FullFrameEncoder:
+    """
+    Encodes every captured frame as a complete keyframe, with stripes > 1 as
+    that many stripes encoded in parallel (encode_keyframe).
+    """
+
+    def __init__(self, codec=None, quality=80, stripes=1):
+        self.codec = codec or CODECS["jpeg"]  # Codec of the session
+        self.quality = quality  # Quality of the encoded frames (lossy codecs)
+        self.stripes = stripes  # Stripes encoded in parallel per frame
+        self._pool = stripe_pool(stripes)
+
+    # Encode a frame, returning the payload buffers and whether it is a keyframe
+    def encode(self, frame, keyframe=False):
+        # Encode the captured frame, change the quality to reduce the size of the frame
+        # Control the quality of the frame - Default Value is 80%
+        return (
+            encode_keyframe(self.codec, frame, self.quality, self._pool, self.stripes),
+            True,
+        )
+
+
+# Encoder that only sends the tiles that changed since the previous frame
+class TileEncoder:
+    """
+    Delta encoder that splits the screen into tiles and only encodes the
+    tiles whose pixels differ from the previous frame.
+
+    Keyframes look exactly like the full-frame stream. Delta frames are
+    TILE_MAGIC followed by the codec id, frame width, height and rectangle
+    count (">BHHH") and, per changed rectangle, its position and encoded size
+    (">HHL") followed by the encoded image. Neighbouring dirty tiles in a tile
+    row are merged into one rectangle to save per-image codec overhead. A
+    keyframe is sent every keyframe_interval frames, whenever the resolution
+    changes and when most of the screen changed anyway.
+
+    With detect_moves, enough changed tiles trigger a search for content that
+    moved (scrolling, dragging a window): tiles that equal the previous frame
+    shifted by the motion found are sent as copies instead of images. Such
+    frames start with MOVE_MAGIC, the codec id, frame width, height, copy
+    count and rectangle count (">BHHHH"), then per copy its source position,
+    width, height and destination position (">HHHHHH"), then the rectangles
+    as above. Every copy reads the picture as it was before the frame.
+    Keyframes are encoded in stripes like FullFrameEncoder's.
+    """
+
+    def __init__(
+        self,
+        codec=None,
+        quality=80,
+        tile_size=64,
+        keyframe_interval=150,
+        detect_moves=True,
+        stripes=1,
+    ):
+        self.codec = codec or CODECS["jpeg"]  # Codec of keyframes and tiles
+        self.quality = quality  # Quality of keyframes and tiles (lossy codecs)
+        self.tile_size = tile_size  # Edge length of a tile in pixels
+        self.keyframe_interval = keyframe_interval  # Frames between keyframes
+        self.detect_moves = detect_moves  # Send moved content as copies
+        self.stripes = stripes  # Stripes encoded in parallel per keyframe
+        self._pool = stripe_pool(stripes)
+        self._previous = None  # Copy of the last encoded frame
+        self._shifted = None  # Reused previous frame shifted by a motion
+        self._motion_wait = 0  # Frames until the next motion search
+        self._changed = None  # Reused per-word comparison result
+        self._column_starts = None  # Reused reduceat offsets of the tile columns
+        self._row_starts = None  # Reused reduceat offsets of the tile rows
+        self._frames_since_keyframe = 0
+
+    # Compute a boolean grid with one entry per tile telling whether it changed
+    # since the previous frame (or reference)
+    def dirty_tiles(self, frame, reference=None):
+        if reference is None:
+            reference = self._previous
+        height, width = frame.shape[:2]
+        row_bytes, tile_bytes = width * 3, self.tile_size * 3
+        # Compare 8 bytes at a time when the rows and tiles are word aligned
+        word = 8 if row_bytes % 8 == 0 and tile_bytes % 8 == 0 else 1
+        dtype = np.uint64 if word == 8 else np.uint8
+        current = np.ascontiguousarray(frame).reshape(height, row_bytes).view(dtype)
+        previous = reference.reshape(height, row_bytes).view(dtype)
+        if self._changed is None or self._changed.shape != current.shape:
+            # Allocate the comparison buffer and offsets once per resolution
+            self._changed = np.empty(current.shape, bool)
+            self._column_starts = np.arange(0, row_bytes // word, tile_bytes // word)
+            self._row_starts = np.arange(0, height, self.tile_size)
+        changed = np.not_equal(current, previous, out=self._changed)
+        # OR-reduce each run of tile_size pixels per row, then each run of
+        # tile_size rows, which also handles partial edge tiles
+        columns = np.logical_or.reduceat(changed, self._column_starts, axis=1)
+        return np.logical_or.reduceat(columns, self._row_starts, axis=0)
+
+    # Encode a frame, returning the payload buffers (None if nothing changed) and whether it is a keyframe
+    def encode(self, frame, keyframe=False):
+        if (
+            keyframe
+            or self._previous is None
+            or self._previous.shape != frame.shape
+            or self._frames_since_keyframe >= self.keyframe_interval
+        ):
+            return self._keyframe(frame), True
+
+        dirty = self.dirty_tiles(frame)
+        dirty_count = int(np.count_nonzero(dirty))
+        if dirty_count == 0:
+            self._frames_since_keyframe += 1
+            return None, False
+        moved = None
+        self._motion_wait = max(0, self._motion_wait - 1)
+        if (
+            self.detect_moves
+            and dirty_count >= MIN_MOTION_TILES
+            and self._motion_wait == 0
+        ):
+            motion = self.find_motion(frame, dirty)
+            if motion is not None:
+                moved = self.moved_tiles(frame, dirty, *motion)
+            if moved is not None and moved.any():
+                dirty &= ~moved  # Only what did not just move is encoded
+                dirty_count = int(np.count_nonzero(dirty))
+            else:
+                # Content that keeps changing in place (a video) would pay for
+                # a search on every frame
+                moved = None
+                self._motion_wait = MOTION_RETRY_FRAMES
+        if dirty_count * 2 > dirty.size:
+            return self._keyframe(frame), True  # A full image is cheaper here
+
+        height, width = frame.shape[:2]
+        size = self.tile_size
+        parts = [None]  # The frame header goes first once the count is known
+        copies = 0
+        if moved is not None:
+            dx, dy = motion
+            for row, column_start, column_end in self._dirty_runs(moved):
+                x, y = column_start * size, row * size
+                copy_width = min(column_end * size, width) - x
+                copy_height = min(size, height - y)
+                parts.append(
+                    struct.pack(
+                        ">HHHHHH", x - dx, y - dy, copy_width, copy_height, x, y
+                    )
+                )
+                copies += 1
+        rectangles = 0
+        for row, column_start, column_end in self._dirty_runs(dirty):
+            x, y = column_start * size, row * size
+            tile = frame[y : y + size, x : column_end * size]
+            encoded = self.codec.encode(tile, self.quality)
+            # The encoded buffers are sent as they are, without joining them
+            parts.append(struct.pack(">HHL", x, y, payload_size(encoded)))
+            parts.extend(encoded)
+            rectangles += 1
+
+        np.copyto(self._previous, frame)
+        self._frames_since_keyframe += 1
+        if moved is None:
+            parts[0] = TILE_MAGIC + struct.pack(
+                ">BHHH", self.codec.codec_id, width, height, rectangles
+            )
+        else:
+            parts[0] = MOVE_MAGIC + struct.pack(
+                ">BHHHH", self.codec.codec_id, width, height, copies, rectangles
+            )
+        return parts, False
+
+    # Find the motion (dx, dy) of most of the content of the dirty tiles since
+    # the previous frame, or None if there is none
+    def find_motion(self, frame, dirty):
+        height, width = frame.shape[:2]
+        size, step = self.tile_size, MOTION_STEP
+        span = step * (MOTION_SEGMENT - 1)  # Pixels a segment covers
+
+        # Hash every segment of the previous frame's samples within the
+        # bounding box of the dirty tiles, where moved content came from
+        rows, columns = np.flatnonzero(dirty.any(axis=1)), np.flatnonzero(
+            dirty.any(axis=0)
+        )
+        y0, y1 = rows[0] * size, min(height, (rows[-1] + 1) * size)
+        x0, x1 = columns[0] * size, min(width, (columns[-1] + 1) * size)
+        grid = pack_colors(self._previous[y0:y1:step, x0:x1:step])
+        if grid.shape[1] < MOTION_SEGMENT:
+            return None
+        hashes = segment_hashes(grid).ravel()
+
+        # Take segments of the current frame near the top left of each dirty
+        # tile, at every sampling phase so that any motion lines one of them
+        # up with the samples of the previous frame
+        tile_rows, tile_columns = np.nonzero(dirty)
+        stride = -(-len(tile_rows) // MAX_ANCHOR_TILES)
+        tile_rows, tile_columns = tile_rows[::stride], tile_columns[::stride]
+        phases = np.arange(step)
+        anchor_y = (
+            tile_rows[:, None, None] * size
+            + np.concatenate([phases, phases + size // 2])[None, :, None]
+        )
+        anchor_x = tile_columns[:, None, None] * size + phases[None, None, :]
+        anchor_y, anchor_x = np.broadcast_arrays(anchor_y, anchor_x)
+        inside = (anchor_y < height) & (anchor_x + span < width)
+        anchor_y, anchor_x = anchor_y[inside], anchor_x[inside]
+        samples = pack_colors(
+            frame[
+                anchor_y[:, None], anchor_x[:, None] + step * np.arange(MOTION_SEGMENT)
+            ]
+        )
+        # Flat segments (background) and content repeated across the anchors
+        # match everywhere and tell nothing about the motion
+        varied = np.flatnonzero((samples != samples[:, :1]).any(axis=1))
+        values, first, counts = np.unique(
+            segment_hashes(samples[varied])[:, 0],
+            return_index=True,
+            return_counts=True,
+        )
+        distinct = counts == 1
+        values, anchors = values[distinct], varied[first[distinct]]
+        if len(values) == 0:
+            return None
+
+        # Look the previous frame's segments up among the anchors, after a
+        # cheap check of their low bits, and let every anchor found in at most
+        # two places vote for its motion
+        mask = np.uint64(ANCHOR_TABLE_SIZE - 1)
+        table = np.zeros(ANCHOR_TABLE_SIZE, bool)
+        table[(values & mask).astype(np.intp)] = True
+        found = np.flatnonzero(table[(hashes & mask).astype(np.intp)])
+        positions = np.searchsorted(values, hashes[found]).clip(max=len(values) - 1)
+        hit = values[positions] == hashes[found]
+        found, which = found[hit], positions[hit]
+        unique = np.bincount(which, minlength=len(values))[which] <= 2
+        found, which = found[unique], anchors[which[unique]]
+        grid_y, grid_x = np.divmod(found, grid.shape[1] - MOTION_SEGMENT + 1)
+        motions = np.stack(
+            [
+                anchor_x[which] - x0 - grid_x * step,
+                anchor_y[which] - y0 - grid_y * step,
+            ],
+            axis=1,
+        )
+        motions = motions[(motions != 0).any(axis=1)]  # Unchanged content
+        if len(motions) == 0:
+            return None
+        candidates, votes = np.unique(motions, axis=0, return_counts=True)
+        best = int(np.argmax(votes))
+        if votes[best] < MIN_MOTION_VOTES:
+            return None
+        return int(candidates[best][0]), int(candidates[best][1])
+
+    # Compute the grid of dirty tiles whose pixels equal the previous frame
+    # shifted by (dx, dy)
+    def moved_tiles(self, frame, dirty, dx, dy):
+        height, width = frame.shape[:2]
+        if self._shifted is None or self._shifted.shape != frame.shape:
+            self._shifted = np.empty_like(frame)
+        # Parts of the shifted frame the previous one does not cover keep
+        # stale pixels, the tiles there are excluded below
+        self._shifted[
+            max(0, dy) : height + min(0, dy), max(0, dx) : width + min(0, dx)
+        ] = self._previous[
+            max(0, -dy) : height - max(0, dy), max(0, -dx) : width - max(0, dx)
+        ]
+        same = ~self.dirty_tiles(frame, self._shifted)
+
+        # A tile can only be copied if its whole source lies within the frame
+        size = self.tile_size
+        tops = np.arange(dirty.shape[0]) * size
+        lefts = np.arange(dirty.shape[1]) * size
+        rows = (tops >= dy) & (np.minimum(tops + size, height) <= height + dy)
+        columns = (lefts >= dx) & (np.minimum(lefts + size, width) <= width + dx)
+        return dirty & same & rows[:, None] & columns[None, :]
+
+    # Yield (row, first column, end column) for each horizontal run of dirty tiles
+    @staticmethod
+    def _dirty_runs(dirty):
+        for row in range(dirty.shape[0]):
+            columns = np.flatnonzero(dirty[row])
+            if columns.size == 0:
+                continue
+            # Split the dirty columns wherever they are not consecutive
+            breaks = np.flatnonzero(np.diff(columns) != 1) + 1
+            for run in np.split(columns, breaks):
+                yield row, int(run[0]), int(run[-1]) + 1
+
+    def _keyframe(self, frame):
+        if self._previous is None or self._previous.shape != frame.shape:
+            self._previous = np.empty_like(frame)
+        np.copyto(self._previous, frame)
+        self._frames_since_keyframe = 0
+        return self.recovery_keyframe(frame)
+
+    # Encode a keyframe of the frame just encoded for viewers that lost delta
+    # frames, without restarting the delta stream of the others
+    def recovery_keyframe(self, frame):
+        return encode_keyframe(
+            self.codec, frame, self.quality, self._pool, self.stripes
+        )
+
+
+# Function to pack the BGR pixels of an image into one 24-bit integer each
+def pack_colors(pixels):
+    pixels = pixels.astype(np.uint32)
+    colors = pixels[..., 0] | (pixels[..., 1] << 8) | (pixels[..., 2] << 16)
+    return colors.astype(np.uint64)
+
+
+# Function to hash every run of MOTION_SEGMENT consecutive values in each row
+def segment_hashes(values):
+    count = values.shape[1] - MOTION_SEGMENT + 1
+    hashes = values[:, :count] * SEGMENT_WEIGHTS[0]
+    for k in range(1, MOTION_SEGMENT):
+        hashes += values[:, k : k + count] * SEGMENT_WEIGHTS[k]  # Wraps modulo 2**64
+    return hashes
+
+
+# Adapts encoder quality and resolution to the backpressure seen by viewers
+class RateController:
+    """
+    Adjusts the JPEG quality, and optionally the resolution, of a broadcaster
+    so that the link stays within a latency budget or target bitrate.
+
+    Every viewer reports, per frame, how long sendall() blocked and how many
+    bytes were still waiting in the kernel send buffer afterwards. The bytes
+    the kernel drained between two reports give the link throughput, so the
+    queued bytes divided by that throughput plus the blocking time estimate
+    the latency the link adds. The slowest viewer drives the decision: above
+    the budget the quality is cut multiplicatively and, once it reaches
+    min_quality, the resolution; below half of the budget the resolution is
+    restored first and then the quality is raised in small steps.
+    """
+
+    def __init__(
+        self,
+        target_latency=0.15,
+        target_bitrate=None,
+        min_quality=30,
+        max_quality=90,
+        min_scale=1.0,
+        interval=0.5,
+    ):
+        self.target_latency = target_latency  # Latency budget in seconds
+        self.target_bitrate = target_bitrate  # Optional bits per second cap
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale  # 1.0 disables downscaling
+        self.interval = interval  # Seconds between two adjustments
+        self.scale = 1.0  # Current resolution factor applied before encoding
+        self._estimates = {}  # Smoothed link measurements per viewer
+        self._lock = threading.Lock()
+        self._next_adjust = 0.0
+
+    # Record the cost of sending one frame to a viewer
+    def report(self, viewer, size, send_seconds, queued):
+        now = time.monotonic()
+        with self._lock:
+            estimate = self._estimates.get(viewer)
+            if estimate is None:
+                self._estimates[viewer] = {
+                    "time": now,
+                    "queued": queued,
+                    "latency": send_seconds,
+                    "throughput": None,
+                    "bitrate": 0.0,
+                }
+                return
+
+            elapsed = max(now - estimate["time"], 1e-6)
+            drained = max(estimate["queued"] + size - queued, 0)
+            throughput = drained / elapsed
+            if estimate["throughput"] is not None:
+                throughput = 0.7 * estimate["throughput"] + 0.3 * throughput
+            latency = send_seconds + queued / max(throughput, 1.0)
+
+            estimate["time"] = now
+            estimate["queued"] = queued
+            estimate["throughput"] = throughput
+            estimate["latency"] = 0.7 * estimate["latency"] + 0.3 * latency
+            estimate["bitrate"] = 0.7 * estimate["bitrate"] + 0.3 * size * 8 / elapsed
+
+    # Forget the measurements of a viewer that disconnected
+    def remove_viewer(self, viewer):
+        with self._lock:
+            self._estimates.pop(viewer, None)
+
+    # Update the encoder quality and return the scale to apply to the next frame
+    def adjust(self, encoder):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_adjust or not self._estimates:
+                return self.scale
+            self._next_adjust = now + self.interval
+            latency = max(e["latency"] for e in self._estimates.values())
+            bitrate = max(e["bitrate"] for e in self._estimates.values())
+
+        congested = latency > self.target_latency or (
+            self.target_bitrate is not None and bitrate > self.target_bitrate
+        )
+        relaxed = latency < self.target_latency / 2 and (
+            self.target_bitrate is None or bitrate < 0.8 * self.target_bitrate
+        )
+
+        if congested:
+            if encoder.quality > self.min_quality:
+                encoder.quality = max(self.min_quality, int(encoder.quality * 0.8))
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale * 0.8)
+        elif relaxed:
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale / 0.8)
+            elif encoder.quality < self.max_quality:
+                encoder.quality = min(self.max_quality, encoder.quality + 5)
+        return self.scale
+
+
+# Paces a loop to a fixed frame rate
+class FramePacer:
+    """
+    Sleeps until the next frame slot of a target frame rate.
+
+    Slots are scheduled from a fixed start time rather than from the end of
+    the previous frame, so the rate does not drift with the loop's own cost.
+    When the loop falls more than one slot behind, the schedule restarts from
+    now instead of bursting frames to catch up. A frame rate of 0 disables
+    pacing.
+    """
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps else 0.0  # Seconds per frame slot
+        self._next = None  # Start of the next frame slot
+
+    # Forget the schedule, e.g. after the loop was idle
+    def reset(self):
+        self._next = None
+
+    # Block until the next frame slot starts
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._next is None or now > self._next + self.interval:
+            self._next = now  # First frame, or too far behind to catch up
+        else:
+            remaining = self._next - now
+            if remaining > 0.002:
+                time.sleep(remaining - 0.001)  # Coarse sleep, wake up early
+            while time.perf_counter() < self._next:
+                time.sleep(0)  # Yield for the last fraction of a millisecond
+        self._next += self.interval
+
+
+# State of one connected viewer of a broadcaster
+class Viewer:
+    """
+    Bounded queue of encoded frames for one viewer. With the default size of
+    one the viewer always sends the newest frame available.
+
+    needs_keyframe is set until the viewer has received a keyframe, so that a
+    newly connected or lagging viewer never applies a delta frame to a picture
+    it does not have. target_size is the viewer's window size in pixels, or
+    None for viewers that did not announce one and get full resolution.
+    on_frame, if set, is called from the producer after a frame was queued,
+    which lets viewers that do not block on the queue (asyncio) wake up.
+
+    Once a viewer acknowledges frames, at most MAX_UNACKED_FRAMES of them are
+    in flight: the kernel buffers of a fast link hold many frames, and
+    TIOCOUTQ cannot see the ones the viewer's kernel already accepted.
+
+    close() marks a viewer whose connection closed and queues None, which
+    wakes a sender that waits for frames of a screen where nothing changes.
+    """
+
+    def __init__(self, queue_size, target_size=None):
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        self.needs_keyframe = True
+        self.target_size = target_size
+        self.on_frame = None
+        self.sent_seq = 0  # Last frame sent to the viewer
+        self.sent_time = 0.0  # When it was sent, in time.monotonic() seconds
+        self.acked_seq = 0  # Last frame the viewer acknowledged (version 2)
+        self.latency = None  # Seconds from capture to that acknowledgement
+
+    # Mark the viewer as disconnected and wake its sender
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.frames.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()  # The frame will not be sent anyway
+                except queue.Empty:
+                    pass
+
+    # Note that a frame went out to the viewer
+    def sent(self, frame):
+        self.sent_seq = frame.seq
+        self.sent_time = time.monotonic()
+
+    # Whether the viewer must acknowledge a frame before it gets the next one
+    def window_full(self):
+        if not self.acked_seq or time.monotonic() - self.sent_time > ACK_TIMEOUT:
+            return False  # The viewer does not acknowledge frames (any more)
+        return (self.sent_seq - self.acked_seq) & 0xFFFFFFFF >= MAX_UNACKED_FRAMES
+
+
+# An encoded frame on its way to the viewers
+class EncodedFrame:
+    """
+    Payload of an encoded frame with the metadata of the version 2 header:
+    sequence number, capture timestamp in microseconds, whether it is a
+    keyframe and the id of the codec it was encoded with.
+
+    The payload is the list of buffers the encoder produced (headers, encoded
+    images); they are sent with one vectored write and never joined, and
+    size is their total length.
+    """
+
+    __slots__ = ("payload", "size", "seq", "timestamp", "keyframe", "codec_id")
+
+    def __init__(self, payload, seq, timestamp, keyframe, codec_id):
+        self.payload = payload
+        self.size = payload_size(payload)
+        self.seq = seq
+        self.timestamp = timestamp
+        self.keyframe = keyframe
+        self.codec_id = codec_id
+
+
+# One capture-and-encode producer per screen, shared by all of its viewers
+class ScreenBroadcaster:
+    """
+    Captures and encodes a screen once per frame and fans the encoded frame
+    out to every connected viewer.
+
+    The producer is a pipeline of two threads: the capture stage grabs
+    frames at most at the pacer's target rate and hands them to the encode
+    stage through a one-frame slot, so capturing frame N+1 overlaps encoding
+    frame N while the viewer threads send frame N-1. When the encoder is
+    slower than the capture, the frame waiting in the slot is replaced by the
+    newest one. Capture buffers circulate through a small pool and are reused
+    once the encoder is done with them. Both stages idle while nobody is
+    watching.
+
+    Each viewer gets its own bounded queue. When a viewer falls behind, its
+    queued frames are dropped in favour of the newest one so that a slow
+    connection never stalls the producer or the other viewers and never sends
+    stale pictures. In delta mode such a viewer resumes at a keyframe that is
+    encoded for the viewers that lost frames alone, at most every
+    RECOVERY_INTERVAL seconds, while the others keep receiving deltas.
+
+    If a SessionRecorder is given, every encoded frame is also recorded under
+    the screen's number.
+    """
+
+    def __init__(
+        self,
+        capture,
+        encoder=None,
+        controller=None,
+        pacer=None,
+        queue_size=1,
+        recorder=None,
+    ):
+        self.capture = capture
+        self.encoder = encoder or FullFrameEncoder()  # Full-frame or delta encoder
+        self.controller = controller  # Optional RateController
+        self.pacer = pacer or FramePacer(0)  # Target frame rate
+        self.queue_size = queue_size  # Frames buffered per viewer before dropping
+        self.recorder = recorder  # Optional SessionRecorder
+        self._viewers = []
+        self._condition = threading.Condition()  # Guards the fields below
+        self._running = False
+        self._keyframe_requested = False
+        self._next_recovery = 0.0  # When lagging viewers may get a keyframe again
+        self._seq = 0  # Sequence number of the last encoded frame
+        self._scaled = None  # Reused output buffer of the server-side downscale
+        self._captured = queue.Queue(maxsize=1)  # Handoff from capture to encode
+        self._free = queue.Queue()  # Capture buffers ready for reuse
+        for _ in range(3):
+            # One buffer being captured, one waiting, one being encoded; the
+            # empty placeholders are replaced by real buffers on first use
+            self._free.put(np.empty((0, 0, 3), np.uint8))
+        self._threads = []
+
+    # Start the capture and encode threads
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._encode_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # Stop the pipeline and wait for its threads to finish
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    # Register a new viewer; its frames are delivered to viewer.frames
+    def add_viewer(self, target_size=None):
+        viewer = Viewer(self.queue_size, target_size)
+        with self._condition:
+            self._viewers.append(viewer)
+            self._keyframe_requested = True  # The new viewer needs a full image
+            self._condition.notify_all()  # Wake the producer if it was idle
+        return viewer
+
+    # Unregister a viewer, e.g. after its connection closed
+    def remove_viewer(self, viewer):
+        with self._condition:
+            if viewer in self._viewers:
+                self._viewers.remove(viewer)
+        if self.controller is not None:
+            self.controller.remove_viewer(viewer)
+
+    # Ask the producer to send a keyframe next
+    def request_keyframe(self):
+        with self._condition:
+            self._keyframe_requested = True
+
+    # Offer a frame to a viewer
+    @staticmethod
+    def _deliver(viewer, frame):
+        keyframe = frame.keyframe
+        if viewer.needs_keyframe and not keyframe:
+            return  # Wait for a keyframe to resume from
+        try:
+            viewer.frames.put_nowait(frame)
+            viewer.needs_keyframe = False
+        except queue.Full:
+            # The viewer fell behind: drop everything it has not sent yet
+            try:
+                while True:
+                    viewer.frames.get_nowait()
+            except queue.Empty:
+                pass
+            if not keyframe:
+                viewer.needs_keyframe = True
+                return
+            viewer.frames.put_nowait(frame)  # A keyframe stands on its own
+        if viewer.on_frame is not None:
+            viewer.on_frame()
+
+    # Whether a keyframe should be encoded for the viewers that lost frames
+    def _recovery_due(self, viewers):
+        if not any(viewer.needs_keyframe for viewer in viewers):
+            return False
+        now = time.monotonic()
+        if now < self._next_recovery:
+            return False  # Bound the extra encoding one slow viewer causes
+        self._next_recovery = now + RECOVERY_INTERVAL
+        return True
+
+    # Put a frame and its capture time into the handoff slot, replacing a frame
+    # the encoder missed
+    def _hand_off(self, captured):
+        while True:
+            try:
+                self._captured.put_nowait(captured)
+                return
+            except queue.Full:
+                try:
+                    stale = self._captured.get_nowait()
+                except queue.Empty:
+                    continue
+                if stale is not None:
+                    self._free.put(stale[0])  # Recycle the skipped frame's buffer
+
+    def _capture_loop(self):
+        while True:
+            with self._condition:
+                # Sleep until somebody is watching or the broadcaster is stopped
+                while self._running and not self._viewers:
+                    self._condition.wait()
+                    self.pacer.reset()
+                if not self._running:
+                    break
+
+            self.pacer.wait()  # Do not capture faster than the target frame rate
+            buffer = self._free.get()
+            try:
+                with self.capture.lock:  # The engine may serve other codecs too
+                    timestamp = time.time_ns() // 1000  # Capture time for the header
+                    frame = self.capture.grab(out=buffer)  # Capture the frame
+            except Exception as e:
+                self._free.put(buffer)
+                print(f"Capture error on screen {self.capture.screen_number}: {e}")
+                time.sleep(0.5)  # Do not spin on a persistent capture failure
+                continue
+            self._hand_off((frame, timestamp))
+
+        self._hand_off(None)  # Tell the encode stage to finish
+
+    # Scale factors that still give the largest viewer window full detail
+    @staticmethod
+    def _viewer_scale(viewers, width, height):
+        scale_x = scale_y = 0.0
+        for viewer in viewers:
+            if viewer.target_size is None:
+                return 1.0, 1.0  # A viewer wants the full resolution
+            target_width, target_height = viewer.target_size
+            scale_x = max(scale_x, target_width / width)
+            scale_y = max(scale_y, target_height / height)
+        return min(scale_x, 1.0), min(scale_y, 1.0)
+
+    def _encode_loop(self):
+        while True:
+            captured = self._captured.get()  # Wait for the next captured frame
+            if captured is None:
+                return
+            frame, timestamp = captured
+            with self._condition:
+                viewers = list(self._viewers)
+                keyframe = self._keyframe_requested
+                self._keyframe_requested = False
+
+            try:
+                start = time.perf_counter()
+                image = frame
+                height, width = frame.shape[:2]
+                scale_x, scale_y = self._viewer_scale(viewers, width, height)
+                if self.controller is not None:
+                    scale = self.controller.adjust(self.encoder)
+                    scale_x, scale_y = scale_x * scale, scale_y * scale
+                if scale_x < 1.0 or scale_y < 1.0:
+                    # Downscale on the server so no viewer receives more pixels
+                    # than it can display
+                    size = (
+                        max(1, round(width * scale_x)),
+                        max(1, round(height * scale_y)),
+                    )
+                    shape = (size[1], size[0], 3)
+                    if self._scaled is None or self._scaled.shape != shape:
+                        self._scaled = np.empty(shape, np.uint8)
+                    # Resize into the reused buffer; encoders copy what they keep
+                    image = cv2.resize(
+                        frame, size, dst=self._scaled, interpolation=cv2.INTER_AREA
+                    )
+                    stats.record("scale", time.perf_counter() - start)
+                start = time.perf_counter()
+                buffer, keyframe = self.encoder.encode(image, keyframe)
+                recovery = None
+                if not keyframe and self._recovery_due(viewers):
+                    recovery = self.encoder.recovery_keyframe(image)
+                stats.record("encode", time.perf_counter() - start)
+            except Exception as e:
+                print(f"Encoding error on screen {self.capture.screen_number}: {e}")
+                continue
+            finally:
+                self._free.put(frame)  # The capture stage may reuse the buffer
+
+            if buffer is None and recovery is None:
+                continue  # Nothing changed on screen
+
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            codec_id = self.encoder.codec.codec_id
+            if recovery is not None:
+                # The lagging viewers get the keyframe in place of this frame
+                recovered = EncodedFrame(recovery, self._seq, timestamp, True, codec_id)
+                stats.count("encoded", recovered.size)
+                lagging = [viewer for viewer in viewers if viewer.needs_keyframe]
+                for viewer in lagging:
+                    self._deliver(viewer, recovered)
+                viewers = [viewer for viewer in viewers if viewer not in lagging]
+            if buffer is None:
+                continue  # Nothing changed on screen, the others are up to date
+
+            encoded = EncodedFrame(buffer, self._seq, timestamp, keyframe, codec_id)
+            stats.count("encoded", encoded.size)
+            for viewer in viewers:
+                self._deliver(viewer, encoded)
+            if self.recorder is not None:
+                if not self.recorder.record(self.capture.screen_number, encoded):
+                    self.request_keyframe()  # The recording resumes at a keyframe
+
+
+# Appends the encoded frames of a session to an indexed recording
+class SessionRecorder:
+    """
+    Writes every frame the broadcasters encode to an append-only recording,
+    for auditing sessions.
+
+    The recording starts with RECORD_MAGIC, followed by each frame as a
+    version 2 FRAME message (header and payload), so it can be re-indexed
+    from the data alone. The index file next to it holds one INDEX_FORMAT
+    entry per frame: offset of the frame's header, capture timestamp, flags,
+    channel and codec id. A writer thread collects frames into batches of
+    batch_bytes, or whatever arrived within flush_interval seconds, and
+    appends each batch with a single write per file.
+
+    record() only queues the frame and never blocks the producer. When the
+    writer falls behind, or cannot write a frame, the frame is dropped and
+    the stream of its channel and codec skips frames until the next
+    keyframe, so the recording never contains a delta frame without the
+    picture it applies to.
+    """
+
+    def __init__(self, path, batch_bytes=4 << 20, flush_interval=1.0, queue_size=256):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self._data = open(path, "ab")
+        self._index = open(self.index_path, "ab")
+        if self._data.tell() == 0:
+            self._data.write(RECORD_MAGIC)
+        self._offset = self._data.tell()  # Where the next frame will start
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._broken = set()  # (channel, codec id) waiting for a keyframe
+        self._failed = set()  # Streams the writer lost a frame of
+        self._stopped = False  # The writer gave up on the recording
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    # Queue a frame of a channel, returning False if it had to be dropped
+    def record(self, channel, frame):
+        if self._stopped:
+            return True  # Nothing is recorded any more, keep the stream going
+        stream = (channel, frame.codec_id)
+        if stream in self._failed:
+            self._failed.discard(stream)
+            if not frame.keyframe:
+                self._broken.add(stream)
+                return False  # Ask for a keyframe to resume the stream from
+        if stream in self._broken:
+            if not frame.keyframe:
+                return True  # Wait for the keyframe that was already requested
+            self._broken.discard(stream)
+        try:
+            self._queue.put_nowait((channel, frame))
+            return True
+        except queue.Full:
+            self._broken.add(stream)
+            return False
+
+    def _write_loop(self):
+        try:
+            self._write_batches()
+        except Exception as e:
+            self._stopped = True
+            print(f"Recording to {self.path} stopped: {e}")
+
+    # Collect queued frames into batches and append them until close()
+    def _write_batches(self):
+        data = bytearray()
+        index = bytearray()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False  # The flush interval passed
+            if item:
+                channel, frame = item
+                start = len(data)
+                try:
+                    self._append(data, index, channel, frame)
+                except Exception as e:
+                    del data[start:]  # Leave no partial frame behind
+                    self._failed.add((channel, frame.codec_id))
+                    print(f"Could not record a frame of screen {channel}: {e}")
+            if not item or len(data) >= self.batch_bytes:
+                self._flush(data, index)
+                deadline = time.monotonic() + self.flush_interval
+                if item is None:
+                    return
+
+    # Add a frame to the batch and its entry to the index batch
+    def _append(self, data, index, channel, frame):
+        flags = FLAG_KEYFRAME if frame.keyframe else 0
+        offset = self._offset + len(data)
+        data += pack_header(
+            MSG_FRAME,
+            frame.size,
+            channel,
+            frame.codec_id,
+            frame.seq,
+            frame.timestamp,
+            flags,
+        )
+        for part in frame.payload:
+            # Encoders return NumPy arrays, which += would add element-wise
+            data += memoryview(part).cast("B")
+        index += struct.pack(
+            INDEX_FORMAT, offset, frame.timestamp, flags, channel, frame.codec_id
+        )
+
+    # Append a batch to the recording, the data before the index entries
+    def _flush(self, data, index):
+        if data:
+            self._data.write(data)
+            self._data.flush()
+            self._index.write(index)
+            self._index.flush()
+            self._offset += len(data)
+            data.clear()
+            index.clear()
+
+    # Write what is still queued and close the files
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._data.close()
+        self._index.close()
+
+
+# The broadcasters of one screen, one per codec its viewers asked for
+class BroadcasterPool:
+    """
+    Creates and starts a broadcaster for every codec in use on a screen.
+
+    All broadcasters share the screen's capture engine and the optional
+    SessionRecorder. Viewers that do not ask for a codec get default_codec.
+    """
+
+    def __init__(
+        self,
+        capture,
+        make_encoder,
+        make_controller=None,
+        fps=30,
+        default_codec="jpeg",
+        recorder=None,
+    ):
+        self.capture = capture
+        self.recorder = recorder
+        self.make_encoder = make_encoder  # Builds an encoder for a codec
+        self.make_controller = make_controller  # Builds a RateController or None
+        self.fps = fps
+        self.default_codec = default_codec
+        self._broadcasters = {}
+        self._lock = threading.Lock()
+
+    # Return the running broadcaster for a codec id (0 selects the default codec)
+    def get(self, codec_id=0):
+        codec = next(
+            (codec for codec in CODECS.values() if codec.codec_id == codec_id),
+            CODECS[self.default_codec],
+        )
+        with self._lock:
+            broadcaster = self._broadcasters.get(codec.name)
+            if broadcaster is None:
+                controller = self.make_controller() if self.make_controller else None
+                broadcaster = ScreenBroadcaster(
+                    self.capture,
+                    self.make_encoder(codec),
+                    controller,
+                    FramePacer(self.fps),
+                    recorder=self.recorder,
+                )
+                broadcaster.start()
+                self._broadcasters[codec.name] = broadcaster
+            return broadcaster
+
+    # Stop every broadcaster
+    def stop(self):
+        with self._lock:
+            broadcasters = list(self._broadcasters.values())
+            self._broadcasters.clear()
+        for broadcaster in broadcasters:
+            broadcaster.stop()
+
+
+# Subscriptions of one connection that multiplexes several screens
+class MuxSession:
+    """
+    The screens a multiplexed viewer watches over its single connection.
+
+    Every subscribed screen has its own Viewer on that screen's broadcaster,
+    so screens keep their own keyframes, pacing and frame dropping. wake is
+    called whenever one of them has a new frame, and when the session closes.
+    """
+
+    def __init__(self, pools, codec_id, target_size, wake, version=1):
+        self.pools = pools  # BroadcasterPool per shared screen
+        self.version = version  # Wire protocol version of the viewer
+        self.codec_id = codec_id
+        self.target_size = target_size
+        self.wake = wake
+        self.closed = False
+        self._subscriptions = {}  # Screen index -> (broadcaster, viewer)
+        self._lock = threading.Lock()
+
+    # Message announcing the screens the viewer may subscribe to
+    def channel_list(self):
+        screens = sorted(self.pools)
+        payload = struct.pack(f">B{len(screens)}B", len(screens), *screens)
+        if self.version >= 2:
+            return pack_header(MSG_LIST, len(payload)) + payload
+        return struct.pack(">L", len(LIST_MAGIC) + len(payload)) + LIST_MAGIC + payload
+
+    def subscribe(self, screen):
+        with self._lock:
+            if self.closed or screen in self._subscriptions or screen not in self.pools:
+                return
+            broadcaster = self.pools[screen].get(self.codec_id)
+            viewer = broadcaster.add_viewer(self.target_size)
+            viewer.on_frame = self.wake
+            self._subscriptions[screen] = (broadcaster, viewer)
+
+    def unsubscribe(self, screen):
+        with self._lock:
+            subscription = self._subscriptions.pop(screen, None)
+        if subscription is not None:
+            broadcaster, viewer = subscription
+            broadcaster.remove_viewer(viewer)
+
+    # Apply a control message received from the viewer
+    def handle_control(self, message):
+        if message.kind == MSG_SUBSCRIBE:
+            self.subscribe(message.channel)
+        elif message.kind == MSG_UNSUBSCRIBE:
+            self.unsubscribe(message.channel)
+        elif message.kind == MSG_RESIZE and message.width and message.height:
+            with self._lock:
+                self.target_size = (message.width, message.height)
+                for _, viewer in self._subscriptions.values():
+                    viewer.target_size = self.target_size
+        else:
+            with self._lock:
+                subscription = self._subscriptions.get(message.channel)
+            if subscription is not None:
+                apply_control(message, *subscription)
+                if message.kind == MSG_ACK:
+                    self.wake()  # The viewer may take another frame now
+
+    # Take the frames that are ready, as (screen, broadcaster, viewer, frame)
+    def ready_frames(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        frames = []
+        for screen, (broadcaster, viewer) in subscriptions:
+            if viewer.window_full():
+                continue  # Sent again after the viewer's next acknowledgement
+            try:
+                frames.append((screen, broadcaster, viewer, viewer.frames.get_nowait()))
+            except queue.Empty:
+                pass
+        return frames
+
+    # Drop every subscription
+    def close(self):
+        with self._lock:
+            self.closed = True
+            screens = list(self._subscriptions)
+        for screen in screens:
+            self.unsubscribe(screen)
+        self.wake()
+
+
+# Function to build a version 2 message header
+def pack_header(msg_type, length, channel=0, codec_id=0, seq=0, timestamp=0, flags=0):
+    return struct.pack(
+        HEADER_FORMAT,
+        V2_MAGIC,
+        PROTOCOL_VERSION,
+        msg_type,
+        channel,
+        codec_id,
+        seq,
+        timestamp,
+        flags,
+        length,
+    )
+
+
+# Function to build the header sent in front of a frame's payload
+def frame_header(version, frame, channel=None):
+    size = frame.size
+    if version >= 2:
+        return pack_header(
+            MSG_FRAME,
+            size,
+            channel or 0,
+            frame.codec_id,
+            frame.seq,
+            frame.timestamp,
+            FLAG_KEYFRAME if frame.keyframe else 0,
+        )
+    if channel is None:
+        return struct.pack(">L", size)  # The original length-prefixed stream
+    # Multiplexed version 1 frames carry the screen after CHANNEL_MAGIC
+    return (
+        struct.pack(">L", len(CHANNEL_MAGIC) + 1 + size)
+        + CHANNEL_MAGIC
+        + bytes((channel,))
+    )
+
+
+# Function to send several buffers with as few system calls as possible
+def send_buffers(conn, buffers):
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    if not hasattr(conn, "sendmsg"):
+        for view in views:  # No vectored sends on this platform
+            conn.sendall(view)
+        return
+    while views:
+        sent = conn.sendmsg(views[:MAX_SEND_BUFFERS])
+        # Drop the buffers that went out and trim the one sent partially
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+
+
+# Function to send a frame and its header in one vectored write
+def send_frame(conn, version, frame, channel=None):
+    send_buffers(conn, [frame_header(version, frame, channel), *frame.payload])
+
+
+# Function to turn the bytes of a control message into a ControlMessage
+def parse_control(header, payload=b""):
+    if header[: len(V2_MAGIC)] == V2_MAGIC:
+        _, version, kind, channel, codec_id, seq, timestamp, flags, _ = struct.unpack(
+            HEADER_FORMAT, header
+        )
+        width = height = 0
+        if kind in (MSG_HELLO, MSG_RESIZE) and len(payload) >= 4:
+            width, height = struct.unpack_from(">HH", payload)
+        return ControlMessage(
+            version, kind, channel, codec_id, seq, timestamp, flags, width, height
+        )
+    magic, width, height, extra = struct.unpack(CONTROL_FORMAT, header)
+    kind = V1_CONTROL_TYPES.get(magic)
+    # The last byte is the codec id in a hello and the screen index otherwise
+    codec_id, channel = (extra, 0) if kind == MSG_HELLO else (0, extra)
+    flags = FLAG_MULTIPLEX if magic == MUX_HELLO_MAGIC else 0
+    return ControlMessage(1, kind, channel, codec_id, 0, 0, flags, width, height)
+
+
+# Function to apply a control message that concerns a single viewer
+def apply_control(message, broadcaster, viewer):
+    if message.kind == MSG_RESIZE and message.width and message.height:
+        viewer.target_size = (message.width, message.height)
+    elif message.kind == MSG_ACK:
+        viewer.acked_seq = message.seq
+        viewer.latency = max(0, time.time_ns() // 1000 - message.timestamp) / 1e6
+        stats.record("end_to_end", viewer.latency)  # Capture until displayed
+    elif message.kind == MSG_KEYFRAME_REQUEST:
+        viewer.needs_keyframe = True  # Only this viewer lost its picture
+
+
+# Function to receive exactly size bytes, returning None if the peer closed
+def recv_exact(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+# Function to receive the next control message of a viewer, None if it closed
+def recv_message(conn):
+    magic = recv_exact(conn, len(V2_MAGIC))
+    if magic is None:
+        return None
+    if magic != V2_MAGIC:
+        rest = recv_exact(conn, CONTROL_SIZE - len(magic))
+        return None if rest is None else parse_control(magic + rest)
+    rest = recv_exact(conn, HEADER_SIZE - len(magic))
+    if rest is None:
+        return None
+    length = struct.unpack_from(">L", rest, HEADER_SIZE - len(magic) - 4)[0]
+    if length > MAX_CONTROL_PAYLOAD:
+        raise ConnectionError("Control message too long")
+    payload = recv_exact(conn, length) if length else b""
+    if payload is None:
+        return None
+    return parse_control(magic + rest, payload)
+
+
+# Function to read the hello a viewer sends when it connects
+def read_hello(conn, timeout=HELLO_TIMEOUT):
+    conn.settimeout(timeout)
+    try:
+        message = recv_message(conn)
+    except socket.timeout:
+        return None  # An older client that only listens: send full resolution
+    finally:
+        conn.settimeout(None)
+    return message if message is not None and message.kind == MSG_HELLO else None
+
+
+# Function to extract protocol version, mode, window size and codec id from a hello
+def parse_hello(hello):
+    if hello is None:
+        return 1, False, None, 0
+    target_size = (hello.width, hello.height) if hello.width and hello.height else None
+    multiplexed = bool(hello.flags & FLAG_MULTIPLEX)
+    return hello.version, multiplexed, target_size, hello.codec_id
+
+
+# Function to apply the control messages a viewer sends while it is connected
+def control_thread(conn, broadcaster, viewer):
+    try:
+        while True:
+            message = recv_message(conn)
+            if message is None:
+                break  # The viewer closed the connection
+            apply_control(message, broadcaster, viewer)
+    except OSError:
+        pass  # The connection is gone
+    finally:
+        viewer.close()  # client_thread may wait for a frame that never comes
+
+
+# Function to notice when a viewer that sends no control messages disconnects
+def disconnect_thread(conn, broadcaster, viewer):
+    try:
+        while conn.recv(4096):
+            pass  # Such viewers are not expected to send anything
+    except OSError:
+        pass  # The connection is gone
+    finally:
+        viewer.close()  # client_thread may wait for a frame that never comes
+
+
+# Function to apply the control messages of a multiplexed viewer
+def mux_control_thread(conn, session):
     try:
         while True:
-            frame = capture_screen(screen_number)  # Capture the current screen frame
+            message = recv_message(conn)
+            if message is None:
+                break  # The viewer closed the connection
+            session.handle_control(message)
+    except OSError:
+        pass  # The connection is gone
+    session.close()
 
-            # Encode the captured frame as JPEG , change the quality to reduce the size of the frame
-            # Control the quality of the frame - Default Value is 80%
-            _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
 
-            # Send the size of the frame to the client in a binary format
-            size = len(buffer)
-            conn.sendall(struct.pack(">L", size))
+# Function to stream several screens over one connection in a separate thread
+def mux_client_thread(conn, pools, version, target_size, codec_id):
+    ready = threading.Event()
+    session = MuxSession(pools, codec_id, target_size, ready.set, version)
+    try:
+        conn.sendall(session.channel_list())
+        threading.Thread(
+            target=mux_control_thread, args=(conn, session), daemon=True
+        ).start()
 
-            # Send the frame data to the client
-            conn.sendall(buffer)
+        while not session.closed:
+            ready.wait()  # Wait for a frame of any subscribed screen
+            ready.clear()
+            for screen, broadcaster, viewer, frame in session.ready_frames():
+                start = time.perf_counter()
+                send_frame(conn, version, frame, screen)
+                viewer.sent(frame)
+                stats.record("send", time.perf_counter() - start)
+                stats.count("sent", frame.size)
+                if broadcaster.controller is not None:
+                    broadcaster.controller.report(
+                        viewer,
+                        frame.size,
+                        time.perf_counter() - start,
+                        queued_bytes(conn),
+                    )
+                ready.set()  # Check again, more frames may have arrived meanwhile
+            wait_for_drain(conn, MAX_QUEUED_BYTES)
+
+    except Exception as e:
+        print(f"Error on multiplexed connection: {e}")
+    finally:
+        session.close()  # Stop producing frames for this client
+        conn.close()  # Close the client connection when done
+
+
+# Function to handle each client connection in a separate thread
+def client_thread(conn, addr, screen_number, pools):
+    # Negotiate the protocol version, the viewer's window size and codec
+    try:
+        hello = read_hello(conn)
+    except OSError as e:
+        print(f"Error on screen {screen_number}: {e}")
+        conn.close()  # The viewer is gone before it was subscribed
+        return
+    version, multiplexed, target_size, codec_id = parse_hello(hello)
+    if multiplexed:
+        mux_client_thread(conn, pools, version, target_size, codec_id)
+        return
+    broadcaster = pools[screen_number].get(codec_id)
+    # Subscribe to the screen's encoded frames
+    viewer = broadcaster.add_viewer(target_size)
+    # Viewers without a hello send nothing, but their EOF still has to be seen
+    watcher = control_thread if hello is not None else disconnect_thread
+    threading.Thread(
+        target=watcher, args=(conn, broadcaster, viewer), daemon=True
+    ).start()
+    try:
+        while True:
+            # Let the kernel drain the previous frame first, so the frame picked
+            # next is the newest one rather than stale data piling up in the
+            # socket buffer
+            wait_for_drain(conn, MAX_QUEUED_BYTES)
+            wait_for_acks(viewer)
+            frame = viewer.frames.get()  # Wait for the next encoded frame
+            if viewer.closed:
+                break  # The viewer disconnected
+            start = time.perf_counter()
+
+            # Send the header with the size of the frame and the frame data to
+            # the client in a single system call
+            size = frame.size
+            send_frame(conn, version, frame)
+            viewer.sent(frame)
+            stats.record("send", time.perf_counter() - start)
+            stats.count("sent", size)
+
+            if broadcaster.controller is not None:
+                # Feed the socket backpressure to the rate controller
+                broadcaster.controller.report(
+                    viewer, size, time.perf_counter() - start, queued_bytes(conn)
+                )
 
     except Exception as e:
         print(f"Error on screen {screen_number}: {e}")
     finally:
+        broadcaster.remove_viewer(viewer)  # Stop producing frames for this client
         conn.close()  # Close the client connection when done
 
 
+# Function to read how many bytes are still waiting in a socket's send buffer
+def queued_bytes(conn):
+    if TIOCOUTQ is None:
+        return 0  # Not available on this platform, rely on send times only
+    try:
+        data = fcntl.ioctl(conn.fileno(), TIOCOUTQ, b"\0" * 4)
+    except (OSError, ValueError):
+        return 0  # The socket is already closed
+    return struct.unpack("i", data)[0]
+
+
+# Function to wait until at most limit bytes are waiting in a socket's send buffer
+def wait_for_drain(conn, limit, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while queued_bytes(conn) > limit and time.monotonic() < deadline:
+        time.sleep(0.002)
+
+
+# Function to wait until a viewer may have another frame in flight
+def wait_for_acks(viewer):
+    while viewer.window_full():
+        time.sleep(0.002)
+
+
+# Function to read the next control message of a viewer on the asyncio event loop
+async def read_message_async(reader):
+    magic = await reader.readexactly(len(V2_MAGIC))
+    if magic != V2_MAGIC:
+        rest = await reader.readexactly(CONTROL_SIZE - len(magic))
+        return parse_control(magic + rest)
+    rest = await reader.readexactly(HEADER_SIZE - len(magic))
+    length = struct.unpack_from(">L", rest, HEADER_SIZE - len(magic) - 4)[0]
+    if length > MAX_CONTROL_PAYLOAD:
+        raise ConnectionError("Control message too long")
+    payload = await reader.readexactly(length) if length else b""
+    return parse_control(magic + rest, payload)
+
+
+# Function to read the hello of a viewer on the asyncio event loop
+async def read_hello_async(reader, timeout=HELLO_TIMEOUT):
+    try:
+        message = await asyncio.wait_for(read_message_async(reader), timeout)
+    except asyncio.TimeoutError:
+        return None  # An older client that only listens: send full resolution
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return message if message.kind == MSG_HELLO else None
+
+
+# Function to apply the control messages of a viewer on the asyncio event loop
+async def control_task_async(reader, broadcaster, viewer):
+    try:
+        while True:
+            apply_control(await read_message_async(reader), broadcaster, viewer)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass  # The viewer closed the connection
+
+
+# Function to send a viewer its frames on the asyncio event loop
+async def send_task_async(writer, broadcaster, viewer, version, idle_timeout):
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    viewer.on_frame = lambda: loop.call_soon_threadsafe(ready.set)
+    sock = writer.get_extra_info("socket")
+    while True:
+        try:
+            frame = viewer.frames.get_nowait()
+        except queue.Empty:
+            # Clear before waiting; a frame queued in between sets it again
+            ready.clear()
+            if viewer.frames.empty():
+                await ready.wait()
+            continue
+
+        start = time.perf_counter()
+        size = frame.size
+        # writelines uses a vectored send where the event loop supports it
+        writer.writelines([frame_header(version, frame), *frame.payload])
+        viewer.sent(frame)
+        # A viewer that does not take the frame within idle_timeout is stuck
+        await asyncio.wait_for(writer.drain(), idle_timeout)
+        stats.record("send", time.perf_counter() - start)
+        stats.count("sent", size)
+
+        # Let the kernel drain the frame too before picking the next one, so the
+        # next frame is the newest rather than stale data in the socket buffer
+        deadline = time.monotonic() + idle_timeout
+        while queued_bytes(sock) > MAX_QUEUED_BYTES:
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(0.002)
+        while viewer.window_full():
+            await asyncio.sleep(0.002)  # See wait_for_acks
+
+        if broadcaster.controller is not None:
+            # Feed the socket backpressure to the rate controller
+            broadcaster.controller.report(
+                viewer,
+                size,
+                time.perf_counter() - start,
+                queued_bytes(sock) + writer.transport.get_write_buffer_size(),
+            )
+
+
+# Function to stream several screens over one connection on the asyncio event loop
+async def serve_mux_async(
+    reader, writer, pools, version, target_size, codec_id, idle_timeout
+):
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    session = MuxSession(
+        pools,
+        codec_id,
+        target_size,
+        lambda: loop.call_soon_threadsafe(ready.set),
+        version,
+    )
+    writer.transport.set_write_buffer_limits(high=MAX_QUEUED_BYTES)
+
+    async def control():
+        try:
+            while True:
+                session.handle_control(await read_message_async(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # The viewer closed the connection
+        session.close()
+
+    control_task = asyncio.create_task(control())
+    try:
+        writer.write(session.channel_list())
+        while not session.closed:
+            await ready.wait()  # Wait for a frame of any subscribed screen
+            ready.clear()
+            for screen, broadcaster, viewer, frame in session.ready_frames():
+                start = time.perf_counter()
+                writer.writelines(
+                    [frame_header(version, frame, screen), *frame.payload]
+                )
+                viewer.sent(frame)
+                # A viewer that does not take the frame within idle_timeout is stuck
+                await asyncio.wait_for(writer.drain(), idle_timeout)
+                stats.record("send", time.perf_counter() - start)
+                stats.count("sent", frame.size)
+                if broadcaster.controller is not None:
+                    broadcaster.controller.report(
+                        viewer,
+                        frame.size,
+                        time.perf_counter() - start,
+                        writer.transport.get_write_buffer_size(),
+                    )
+                ready.set()  # Check again, more frames may have arrived meanwhile
+    except asyncio.TimeoutError:
+        print("Error on multiplexed connection: idle timeout")
+    except ConnectionError as e:
+        print(f"Error on multiplexed connection: {e}")
+    finally:
+        control_task.cancel()
+        await asyncio.gather(control_task, return_exceptions=True)
+        session.close()  # Stop producing frames for this client
+        writer.close()  # Close the client connection when done
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+# Function to serve one viewer connection on the asyncio event loop
+async def serve_viewer_async(reader, writer, screen_number, pools, idle_timeout):
+    # Negotiate the protocol version, the viewer's window size and codec
+    hello = await read_hello_async(reader)
+    version, multiplexed, target_size, codec_id = parse_hello(hello)
+    if multiplexed:
+        await serve_mux_async(
+            reader, writer, pools, version, target_size, codec_id, idle_timeout
+        )
+        return
+    broadcaster = pools[screen_number].get(codec_id)
+    viewer = broadcaster.add_viewer(target_size)
+    writer.transport.set_write_buffer_limits(high=MAX_QUEUED_BYTES)
+    tasks = [
+        asyncio.create_task(
+            send_task_async(writer, broadcaster, viewer, version, idle_timeout)
+        ),
+        asyncio.create_task(control_task_async(reader, broadcaster, viewer)),
+    ]
+    try:
+        # Stop as soon as the viewer disconnects or its connection fails
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                error = task.exception()
+                if isinstance(error, asyncio.TimeoutError):
+                    error = "idle timeout"
+                print(f"Error on screen {screen_number}: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        broadcaster.remove_viewer(viewer)  # Stop producing frames for this client
+        writer.close()  # Close the client connection when done
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+# Function to run the server for a specific screen on an asyncio event loop
+async def serve_screen_async(
+    host,
+    port,
+    screen_number,
+    make_encoder=FullFrameEncoder,
+    make_controller=None,
+    fps=30,
+    codec="jpeg",
+    max_connections=32,
+    idle_timeout=30.0,
+    screens=(),
+    make_capture=ScreenCapture,
+    recorder=None,
+):
+    # Producers shared by all clients that use the same screen and codec;
+    # capture and encoding run on the broadcaster threads, never on the loop
+    pools = make_pools(
+        {screen_number, *screens},
+        make_capture,
+        make_encoder,
+        make_controller,
+        fps,
+        codec,
+        recorder,
+    )
+    viewers = set()  # Tasks of the connected viewers
+    stopped = asyncio.Event()
+
+    async def on_connect(reader, writer):
+        addr = writer.get_extra_info("peername")
+        if len(viewers) >= max_connections:
+            print(f"Rejecting {addr}: {max_connections} viewers already connected")
+            writer.close()
+            return
+        print("Connection from:", addr)
+        task = asyncio.current_task()
+        viewers.add(task)
+        try:
+            await serve_viewer_async(reader, writer, screen_number, pools, idle_timeout)
+        except asyncio.CancelledError:
+            # The server is stopping; the handler already closed the connection
+            writer.close()
+        finally:
+            viewers.discard(task)
+
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stopped.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on this platform; Ctrl+C still interrupts
+
+    server = await asyncio.start_server(on_connect, host, port, backlog=5)
+    print(
+        f"Server for screen {screen_number} listening on {host}:{port} "
+        f"(asyncio, up to {max_connections} viewers)"
+    )
+    try:
+        await stopped.wait()
+    finally:
+        # Stop accepting, disconnect every viewer, then stop the producers
+        server.close()
+        await server.wait_closed()
+        for task in list(viewers):
+            task.cancel()
+        await asyncio.gather(*viewers, return_exceptions=True)
+        await loop.run_in_executor(None, stop_pools, pools)
+        print(f"Server for screen {screen_number} stopped")
+
+
+# Function to create the broadcaster pools of the shared screens
+def make_pools(
+    screens, make_capture, make_encoder, make_controller, fps, codec, recorder=None
+):
+    return {
+        screen: BroadcasterPool(
+            make_capture(screen_number=screen),
+            make_encoder,
+            make_controller,
+            fps,
+            codec,
+            recorder,
+        )
+        for screen in screens
+    }
+
+
+# Function to stop the broadcaster pools and release their capture engines
+def stop_pools(pools):
+    recorders = set()
+    for pool in pools.values():
+        pool.stop()
+        pool.capture.close()
+        if pool.recorder is not None:
+            recorders.add(pool.recorder)
+    for recorder in recorders:
+        recorder.close()  # Write the frames that are still buffered
+
+
 # Function to start the server for a specific screen
-def start_server_for_screen(host, port, screen_number):
+def start_server_for_screen(
+    host,
+    port,
+    screen_number,
+    make_encoder=FullFrameEncoder,
+    make_controller=None,
+    fps=30,
+    codec="jpeg",
+    screens=(),
+    make_capture=ScreenCapture,
+    recorder=None,
+):
     server_socket = socket.socket(
         socket.AF_INET, socket.SOCK_STREAM
     )  # Create a socket object
+    # Producers shared by all clients that use the same screen and codec
+    pools = make_pools(
+        {screen_number, *screens},
+        make_capture,
+        make_encoder,
+        make_controller,
+        fps,
+        codec,
+        recorder,
+    )
 
     try:
         server_socket.bind(
@@ -76,28 +2045,209 @@ def start_server_for_screen(host, port, screen_number):
         while True:
             conn, addr = server_socket.accept()  # Accept a new client connection
             print("Connection from:", addr)
+            # Send every frame right away instead of letting Nagle's algorithm
+            # hold back its tail (asyncio streams do this already)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
             # Start a new thread to handle the client
             threading.Thread(
-                target=client_thread, args=(conn, addr, screen_number)
+                target=client_thread,
+                args=(conn, addr, screen_number, pools),
+                daemon=True,
             ).start()
 
     except Exception as e:
         print(f"Server error: {e}")
     finally:
         server_socket.close()  # Close the server socket when done
+        stop_pools(pools)  # Stop the shared producers and capture engines
 
 
 # Entry point of the program
-if __name__ == "__main__":
-    # Check if the correct number of command-line arguments is provided
-    if len(sys.argv) != 4:
-        print("Usage: python server.py <IP address> <Port> <Screen Index>")
-        sys.exit(1)
+def main(argv=None, make_capture=ScreenCapture):
+    """
+    Parses the command line (argv, or sys.argv) and runs the server. Other
+    programs, like the benchmarks, may pass their own capture engine
+    factory; make_capture is called with the screen number.
+    """
+    parser = argparse.ArgumentParser(description="Share a screen over TCP.")
+    parser.add_argument("host", help="IP address to listen on")
+    parser.add_argument("port", type=int, help="Port to listen on")
+    parser.add_argument("screen_number", type=int, help="Index of the screen")
+    parser.add_argument(
+        "--fps",
+        type=float,
+        default=30,
+        help="Target frames per second, 0 captures as fast as possible",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Append every encoded frame to this session recording (and its "
+        ".idx index) for auditing; replay it with Client/replay.py",
+    )
+    parser.add_argument(
+        "--screens",
+        default="",
+        help="Further screens to share over multiplexed connections, "
+        "as a comma-separated list of indices or 'all'",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Serve all viewers from one asyncio event loop instead of a thread each",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=32,
+        help="Viewers the asyncio mode accepts at the same time",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=30,
+        help="Seconds a viewer may stall a frame before the asyncio mode drops it",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=sorted(CODECS),
+        default="jpeg",
+        help="Codec for viewers that do not ask for one",
+    )
+    parser.add_argument(
+        "--stripes",
+        type=int,
+        default=1,
+        help="Encode keyframes as this many horizontal stripes in parallel, for "
+        "4K and larger screens",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only send the screen tiles that changed since the previous frame",
+    )
+    parser.add_argument(
+        "--tile-size", type=int, default=64, help="Tile edge length in delta mode"
+    )
+    parser.add_argument(
+        "--no-moves",
+        action="store_true",
+        help="In delta mode, encode scrolled or moved content as new tiles "
+        "instead of copying it",
+    )
+    parser.add_argument(
+        "--keyframe-interval",
+        type=int,
+        default=150,
+        help="Frames between full keyframes in delta mode",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt the JPEG quality to the link instead of a fixed quality of 80",
+    )
+    parser.add_argument(
+        "--target-latency",
+        type=float,
+        default=150,
+        help="Latency budget of the adaptive mode in milliseconds",
+    )
+    parser.add_argument(
+        "--target-bitrate",
+        type=float,
+        default=None,
+        help="Optional bitrate cap of the adaptive mode in kbit/s",
+    )
+    parser.add_argument(
+        "--min-quality", type=int, default=30, help="Lowest adaptive JPEG quality"
+    )
+    parser.add_argument(
+        "--min-scale",
+        type=float,
+        default=1.0,
+        help="Lowest resolution factor the adaptive mode may downscale to",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=0,
+        help="Seconds between JSON log lines with per-stage timings, 0 disables them",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        default=0,
+        help="Local port serving the statistics as /stats (JSON) and /metrics "
+        "(Prometheus), 0 disables it",
+    )
+    args = parser.parse_args(argv)
+
+    start_stats_reporting(stats, args.stats_interval, args.stats_port, "server")
+
+    if args.delta:
+        make_encoder = functools.partial(
+            TileEncoder,
+            tile_size=args.tile_size,
+            keyframe_interval=args.keyframe_interval,
+            detect_moves=not args.no_moves,
+            stripes=args.stripes,
+        )
+    else:
+        make_encoder = functools.partial(FullFrameEncoder, stripes=args.stripes)
+
+    recorder = SessionRecorder(args.record) if args.record else None
 
-    host = sys.argv[1]  # Retrieve the IP address from arguments
-    port = int(sys.argv[2])  # Retrieve the port number from arguments
-    screen_number = int(sys.argv[3])  # Retrieve the screen index from arguments
+    if args.screens == "all":
+        screens = range(len(get_monitors()))
+    else:
+        screens = [int(screen) for screen in args.screens.split(",") if screen]
+
+    make_controller = None
+    if args.adaptive:
+        make_controller = functools.partial(
+            RateController,
+            target_latency=args.target_latency / 1000,
+            target_bitrate=args.target_bitrate and args.target_bitrate * 1000,
+            min_quality=args.min_quality,
+            min_scale=args.min_scale,
+        )
 
     # Start the server for the specified screen
-    start_server_for_screen(host, port, screen_number)
+    if args.asyncio:
+        try:
+            asyncio.run(
+                serve_screen_async(
+                    args.host,
+                    args.port,
+                    args.screen_number,
+                    make_encoder,
+                    make_controller,
+                    args.fps,
+                    args.codec,
+                    args.max_connections,
+                    args.idle_timeout,
+                    screens,
+                    make_capture,
+                    recorder,
+                )
+            )
+        except KeyboardInterrupt:
+            pass  # Platforms without signal handlers stop with Ctrl+C
+    else:
+        start_server_for_screen(
+            args.host,
+            args.port,
+            args.screen_number,
+            make_encoder,
+            make_controller,
+            args.fps,
+            args.codec,
+            screens,
+            make_capture,
+            recorder,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,812 @@
+import hashlib
+import json
 import os
 import socket
+import struct
 import sys
+import threading
+import zlib
+
+import numpy as np
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
+
+# Optional faster compression codecs for file transfers
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# A transfer starts with TRANSFER_MAGIC and a random salt, followed by records:
+# a RECORD_HEADER (record type and length), the AES-GCM ciphertext and its tag.
+# The first record holds the filename, then come the data records and an end
+# record with the file size, so a truncated transfer is detected. The server
+# answers every complete, verified file with TRANSFER_OK.
+# In a chunked transfer, a plan record and the manifest (the SHA-256 of every
+# chunk) follow the filename instead of the data. The server answers with a
+# bitmap of the chunks it already has from an earlier attempt. The missing
+# chunks follow, each a chunk record with the offset and then its data
+# records, over this connection and any others that join the session. Every
+# connection draws nonces from its own salt.
+# In a delta transfer, the client first asks for the signatures of the copy of
+# the file the server already has: the server answers with TRANSFER_OK, its
+# own salt and encrypted signature records, one weak checksum and one strong
+# hash per block. Chunks then consist of data records for the bytes that
+# changed and copy records for the bytes the server copies from its old copy.
+# In a compressed transfer, a compress record with the codecs the client can
+# use precedes the plan, and the server appends the codec it picked to its
+# bitmap. Data records that compress well are then sent as packed records,
+# the codec followed by the compressed data, and the others as they are.
+TRANSFER_MAGIC = b"RFX1"
+SALT_SIZE = 8
+RECORD_HEADER = ">BL"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+RECORD_NAME = 1
+RECORD_DATA = 2
+RECORD_END = 3
+RECORD_PLAN = 4  # Session, file size and chunk size of a chunked transfer
+RECORD_JOIN = 5  # First record of a connection that sends chunks
+RECORD_CHUNK = 6  # Offset of the chunk the following data records belong to
+RECORD_MANIFEST = 7  # SHA-256 digests of chunks, in order
+RECORD_DELTA = 8  # Block size of the signatures the client asks for
+RECORD_SIGNATURES = 9  # Signatures of blocks of the server's copy, in order
+RECORD_COPY = 10  # Offset and length of data to take from the server's copy
+RECORD_COMPRESS = 11  # Compression codecs the client can use, best first
+RECORD_PACKED = 12  # Codec and compressed data of a data record
+PLAN_FORMAT = ">16sQL"
+COPY_FORMAT = ">QL"
+DIGEST_SIZE = 32
+TAG_SIZE = 16
+RECORD_SIZE = 1 << 20  # Longest record accepted
+MIN_CHUNK_SIZE = 64 << 10  # Smallest chunk of a chunked transfer accepted
+MAX_CHUNKS = 1 << 20  # Most chunks per file, bounding the manifest
+TRANSFER_OK = b"\x01"
+MIN_BLOCK_SIZE = 4 << 10  # Smallest block of a delta transfer accepted
+SIGNATURE_BATCH = 4 << 20  # Bytes of the file hashed per signature record
+STRONG_SIZE = 16
+# Weak checksum (a: sum of the bytes, b: sum weighted by the distance to the
+# end of the block, both modulo 2^32) and truncated SHA-256 of a block
+SIGNATURE = np.dtype([("a", ">u4"), ("b", ">u4"), ("strong", "u1", STRONG_SIZE)])
+COMPRESSION_IDS = {"zlib": 1, "lz4": 2, "zstd": 3}
+O_BINARY = getattr(os, "O_BINARY", 0)  # Keeps Windows from translating newlines
+
+
+def record_nonce(iv, salt, counter):
+    """
+    Builds the 12-byte AES-GCM nonce of a record.
+
+    Parameters:
+    - iv: The initialization vector shared with the client (at least 12 bytes).
+    - salt: The random salt of the transfer.
+    - counter: The number of the record within the transfer.
+
+    Returns:
+    - The first 12 bytes of the IV XOR the salt and the counter.
+    """
+    mixed = salt + struct.pack(">L", counter)
+    return bytes(a ^ b for a, b in zip(iv[:12], mixed))
+
+
+def recv_exactly(conn, view):
+    """
+    Fills a buffer with bytes from the connection.
+
+    Parameters:
+    - conn: The connection gateway from the client.
+    - view: A writable memoryview to fill.
+
+    Returns:
+    - False if the client closed the connection before sending anything,
+      True once the buffer is full.
+    """
+    received = 0
+    while received < len(view):
+        count = conn.recv_into(view[received:])
+        if not count:
+            if received == 0:
+                return False
+            raise ConnectionError("The client closed the connection mid-record")
+        received += count
+    return True
+
+
+class RecordReader:
+    """
+    Receives and verifies the records of one transfer into reused buffers.
+    Records are numbered in the order they arrive, so a record that was
+    replayed, reordered or altered fails verification.
+    """
+
+    def __init__(self, conn, key, iv, salt):
+        self.conn = conn
+        self.key = key
+        self.iv = iv
+        self.salt = salt
+        self.counter = 0
+        self._header = bytearray(RECORD_HEADER_SIZE)
+        self._data = bytearray(RECORD_SIZE)
+        self._tag = bytearray(TAG_SIZE)
+        self._plain = memoryview(bytearray(RECORD_SIZE))
+
+    def receive(self):
+        """
+        Receives, decrypts and authenticates the next record.
+
+        Returns:
+        - The record type and its plaintext, a view of a buffer that the next
+          record overwrites.
+
+        Raises ValueError if the record was not encrypted with the shared key
+        and IV for this position in the transfer.
+        """
+        if not recv_exactly(self.conn, memoryview(self._header)):
+            raise ConnectionError("The client closed the connection mid-transfer")
+        record_type, length = struct.unpack(RECORD_HEADER, self._header)
+        if length > RECORD_SIZE:
+            raise ValueError("Record too long")
+        data = memoryview(self._data)[:length]
+        recv_exactly(self.conn, data)
+        recv_exactly(self.conn, memoryview(self._tag))
+
+        cipher = AES.new(
+            self.key, AES.MODE_GCM, nonce=record_nonce(self.iv, self.salt, self.counter)
+        )
+        self.counter += 1
+        cipher.update(self._header)
+        plaintext = self._plain[:length]
+        cipher.decrypt_and_verify(data, self._tag, output=plaintext)
+        return record_type, plaintext
+
+
+def write_at(fd, data, offset):
+    """
+    Writes a buffer to a file descriptor at the given offset.
+
+    Parameters:
+    - fd: The file descriptor of the output file.
+    - data: The bytes-like object to write.
+    - offset: The position in the file where data starts.
+    """
+    data = memoryview(data)
+    while data:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, data, offset)
+        else:  # No positional writes on this platform
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, data)
+        data = data[written:]
+        offset += written
+
+
+def read_at(fd, size, offset):
+    """
+    Reads size bytes from a file descriptor at the given offset.
+
+    Parameters:
+    - fd: The file descriptor of the input file.
+    - size: The number of bytes to read.
+    - offset: The position in the file where reading starts.
+
+    Returns:
+    - The bytes read; fewer than size only at the end of the file.
+    """
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)  # No positional reads on this platform
+    return os.read(fd, size)
+
+
+def send_buffers(conn, buffers):
+    """
+    Sends several buffers with as few vectored writes as possible.
+
+    Parameters:
+    - conn: The connection gateway to the client.
+    - buffers: The bytes-like objects to send, in order.
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    if not hasattr(conn, "sendmsg"):
+        for view in views:  # No vectored sends on this platform
+            conn.sendall(view)
+        return
+    while views:
+        sent = conn.sendmsg(views)
+        # Drop the buffers that went out and trim the one sent partially
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+
+
+class RecordWriter:
+    """
+    Encrypts and sends records to the client with AES in GCM mode, the way
+    the client sends them to the server.
+    """
+
+    def __init__(self, conn, key, iv, salt):
+        self.conn = conn
+        self.key = key
+        self.iv = iv
+        self.salt = salt
+        self.counter = 0
+        self._output = memoryview(bytearray(RECORD_SIZE))
+
+    def send(self, record_type, data):
+        """
+        Encrypts, authenticates and sends the next record.
+
+        Parameters:
+        - record_type: The type of the record.
+        - data: The plaintext of the record, at most RECORD_SIZE bytes.
+        """
+        header = struct.pack(RECORD_HEADER, record_type, len(data))
+        cipher = AES.new(
+            self.key, AES.MODE_GCM, nonce=record_nonce(self.iv, self.salt, self.counter)
+        )
+        self.counter += 1
+        cipher.update(header)
+        ciphertext = self._output[: len(data)]
+        tag = cipher.encrypt_and_digest(data, output=ciphertext)[1]
+        send_buffers(self.conn, [header, ciphertext, tag])
+
+
+def block_signatures(data, block_size):
+    """
+    Computes the signature of every whole block of data.
+
+    Parameters:
+    - data: A bytes-like object, usually a batch of blocks of a file.
+    - block_size: The number of bytes per block.
+
+    Returns:
+    - A SIGNATURE array with one entry per block.
+    """
+    values = np.frombuffer(data, np.uint8)
+    blocks = values[: len(values) // block_size * block_size].reshape(-1, block_size)
+    signatures = np.empty(len(blocks), SIGNATURE)
+    signatures["a"] = blocks.sum(axis=1, dtype=np.uint32)
+    # Integer products wrap around, which keeps b modulo 2^32 as well
+    signatures["b"] = blocks @ np.arange(block_size, 0, -1, dtype=np.uint32)
+    strong = b"".join(hashlib.sha256(block).digest()[:STRONG_SIZE] for block in blocks)
+    signatures["strong"] = np.frombuffer(strong, np.uint8).reshape(-1, STRONG_SIZE)
+    return signatures
+
+
+def send_signatures(conn, key, iv, path, block_size):
+    """
+    Sends the signatures of every whole block of the server's copy of a file,
+    so that the client only sends the bytes the server does not have.
+
+    Parameters:
+    - conn: The connection gateway to the client.
+    - key: The secret key used for encryption.
+    - iv: The initialization vector for encryption.
+    - path: The server's copy of the file, or None if there is none.
+    - block_size: The number of bytes per block.
+    """
+    salt = os.urandom(SALT_SIZE)  # The server's own nonces
+    conn.sendall(TRANSFER_OK + salt)
+    writer = RecordWriter(conn, key, iv, salt)
+    count = 0
+    if path is not None:
+        buffer = bytearray(max(1, SIGNATURE_BATCH // block_size) * block_size)
+        with open(path, "rb") as file:
+            while length := file.readinto(buffer):
+                signatures = block_signatures(memoryview(buffer)[:length], block_size)
+                if len(signatures):
+                    writer.send(RECORD_SIGNATURES, signatures.tobytes())
+                    count += len(signatures)
+    writer.send(RECORD_END, struct.pack(">Q", count))
+
+
+def decompress_zlib(data):
+    """
+    Inflates a zlib stream of at most RECORD_SIZE bytes.
+    """
+    decompressor = zlib.decompressobj()
+    plaintext = decompressor.decompress(data, RECORD_SIZE)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Compressed record too long or incomplete")
+    return plaintext
+
+
+def decompress_lz4(data):
+    """
+    Decompresses an LZ4 block of at most RECORD_SIZE bytes.
+    """
+    return lz4.block.decompress(data, uncompressed_size=RECORD_SIZE)
+
+
+def decompress_zstd(data):
+    """
+    Decompresses a Zstandard frame of at most RECORD_SIZE bytes.
+    """
+    # The size in the frame header takes precedence over max_output_size
+    if zstandard.frame_content_size(data) > RECORD_SIZE:
+        raise ValueError("Compressed record too long")
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=RECORD_SIZE)
+
+
+# Decompressors of the codecs installed here, and the errors of corrupt data
+DECOMPRESSORS = {COMPRESSION_IDS["zlib"]: decompress_zlib}
+DECOMPRESSION_ERRORS = (zlib.error,)
+if lz4 is not None:
+    DECOMPRESSORS[COMPRESSION_IDS["lz4"]] = decompress_lz4
+    DECOMPRESSION_ERRORS += (lz4.block.LZ4BlockError,)
+if zstandard is not None:
+    DECOMPRESSORS[COMPRESSION_IDS["zstd"]] = decompress_zstd
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+def unpack_record(data):
+    """
+    Decompresses the plaintext of a packed record.
+
+    Returns:
+    - The data of the file it holds, at most RECORD_SIZE bytes.
+    """
+    decompress = DECOMPRESSORS.get(data[0]) if len(data) else None
+    if decompress is None:
+        raise ValueError("Unsupported compression codec")
+    try:
+        return decompress(data[1:])
+    except DECOMPRESSION_ERRORS as e:
+        raise ValueError(f"Invalid compressed record: {e}") from e
 
 
-def decrypt_data(key, iv, encrypted_data):
+def open_transfer(conn, key, iv):
     """
-    Decrypts data using AES encryption in CBC mode.
+    Reads the preamble a connection starts every transfer with.
 
     Parameters:
+    - conn: The connection gateway from the client.
     - key: The secret key used for decryption.
     - iv: The initialization vector for decryption.
-    - encrypted_data: The data to be decrypted.
 
     Returns:
-    - The decrypted data.
+    - A RecordReader for the records of the transfer, or None if the client
+      closed the connection instead.
+    """
+    preamble = bytearray(len(TRANSFER_MAGIC) + SALT_SIZE)
+    if not recv_exactly(conn, memoryview(preamble)):
+        return None
+    if preamble[: len(TRANSFER_MAGIC)] != TRANSFER_MAGIC:
+        raise ValueError("The client does not speak the file transfer protocol")
+    return RecordReader(conn, key, iv, bytes(preamble[len(TRANSFER_MAGIC) :]))
+
+
+class TransferSession:
+    """
+    A file that arrives in chunks, possibly over several connections at once.
+    Every chunk is written to its offset in the preallocated file as it
+    arrives, so chunks may come in any order. Chunks that match the manifest
+    are listed in a state file next to the ".part" file, so a transfer that
+    broke off resumes with the chunks still missing. In a delta transfer,
+    chunks also copy data from the server's old copy of the file (source).
+    """
+
+    def __init__(self, path, size, chunk_size, digests, source=None):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.digests = digests  # SHA-256 of every chunk, from the manifest
+        self.state_path = path + ".state"
+        self.chunks = self._load_state(path)  # Indices of the verified chunks
+        self._lock = threading.Lock()
+
+        flags = os.O_RDWR | os.O_CREAT | O_BINARY
+        self.fd = os.open(path, flags if self.chunks else flags | os.O_TRUNC, 0o644)
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.fd, 0, size)
+        else:
+            os.ftruncate(self.fd, size)
+
+        self.source_fd = None
+        if source is not None:
+            self.source_fd = os.open(source, os.O_RDONLY | O_BINARY)
+            self.source_size = os.fstat(self.source_fd).st_size
+
+        # Rewrite the state, dropping chunks of an older version of the file
+        self._state = open(self.state_path, "w")
+        self._state.write(json.dumps({"size": size, "chunk_size": chunk_size}) + "\n")
+        for index in sorted(self.chunks):
+            self._state.write(f"{index} {digests[index].hex()}\n")
+        self._state.flush()
+
+    def _load_state(self, path):
+        """
+        Reads the state file a broken-off transfer of the same file left.
+
+        Returns:
+        - The indices of the chunks already in the ".part" file that match
+          the manifest of this transfer.
+        """
+        if not (os.path.exists(path) and os.path.exists(self.state_path)):
+            return set()
+        with open(self.state_path) as state:
+            lines = state.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return set()
+        if header != {"size": self.size, "chunk_size": self.chunk_size}:
+            return set()
+        chunks = set()
+        for line in lines[1:]:
+            index, _, digest = line.partition(" ")
+            if (
+                index.isdigit()
+                and int(index) < len(self.digests)
+                and digest == self.digests[int(index)].hex()
+            ):
+                chunks.add(int(index))
+        return chunks
+
+    def bitmap(self):
+        """
+        Returns:
+        - One bit per chunk, set for the chunks the server already has.
+        """
+        bits = bytearray(-(-len(self.digests) // 8))
+        for index in self.chunks:
+            bits[index >> 3] |= 1 << (index & 7)
+        return bytes(bits)
+
+    def chunk_length(self, offset):
+        """
+        Checks the offset of a chunk about to arrive.
+
+        Returns:
+        - The number of bytes the chunk must have.
+        """
+        if offset % self.chunk_size or offset >= self.size:
+            raise ValueError("Invalid chunk offset")
+        if offset // self.chunk_size in self.chunks:
+            raise ValueError("Chunk received twice")
+        return min(self.chunk_size, self.size - offset)
+
+    def write(self, data, offset):
+        """
+        Writes data to its offset in the file, unless the transfer is over.
+        """
+        with self._lock:
+            if self.fd is None:
+                raise ValueError("The transfer is over")
+            write_at(self.fd, data, offset)
+
+    def copy(self, source, size, offset, digest):
+        """
+        Copies data from the server's old copy of the file to the file.
+
+        Parameters:
+        - source: The offset of the data in the old copy.
+        - size: The number of bytes to copy.
+        - offset: The offset in the file to copy the data to.
+        - digest: The SHA-256 of the chunk, updated with the data.
+        """
+        if self.source_fd is None or source + size > self.source_size:
+            raise ValueError("Invalid copy")
+        with self._lock:
+            if self.fd is None:
+                raise ValueError("The transfer is over")
+            for start in range(0, size, RECORD_SIZE):
+                data = read_at(
+                    self.source_fd, min(RECORD_SIZE, size - start), source + start
+                )
+                digest.update(data)
+                write_at(self.fd, data, offset + start)
+
+    def add_chunk(self, offset, digest):
+        """
+        Marks the chunk at offset as received completely once its SHA-256
+        matches the manifest, and records it in the state file.
+        """
+        index = offset // self.chunk_size
+        if digest != self.digests[index]:
+            raise ValueError("Chunk does not match the manifest")
+        with self._lock:
+            if index in self.chunks:
+                raise ValueError("Chunk received twice")
+            if self.fd is None:
+                raise ValueError("The transfer is over")
+            self.chunks.add(index)
+            self._state.write(f"{index} {digest.hex()}\n")
+            self._state.flush()
+
+    def close(self):
+        """
+        Closes the file and the state file; chunks that still arrive are
+        rejected.
+
+        Returns:
+        - True if every chunk of the file was received.
+        """
+        with self._lock:
+            os.close(self.fd)
+            self.fd = None
+            if self.source_fd is not None:
+                os.close(self.source_fd)
+            self._state.close()
+            return len(self.chunks) == len(self.digests)
+
+
+def receive_chunk_data(reader, session):
+    """
+    Receives chunk records and the data records of every chunk, up to the end
+    record, and writes the chunks to the file of the session.
+
+    Parameters:
+    - reader: The RecordReader of the connection.
+    - session: The TransferSession the chunks belong to.
+
+    Returns:
+    - The plaintext of the end record and the number of bytes received.
+    """
+    received = 0
+    offset = None
+    while True:
+        record_type, data = reader.receive()
+        if record_type in (RECORD_CHUNK, RECORD_END) and offset is not None:
+            if position != length:
+                raise ValueError("Incomplete chunk")
+            session.add_chunk(offset, digest.digest())
+            offset = None
+        if record_type == RECORD_END:
+            return bytes(data), received
+        if record_type == RECORD_CHUNK:
+            offset = struct.unpack(">Q", data)[0]
+            length = session.chunk_length(offset)
+            position = 0
+            digest = hashlib.sha256()
+        elif record_type in (RECORD_DATA, RECORD_PACKED) and offset is not None:
+            if record_type == RECORD_PACKED:
+                data = unpack_record(data)  # Checked against the manifest as usual
+            if position + len(data) > length:
+                raise ValueError("Chunk too long")
+            digest.update(data)
+            session.write(data, offset + position)
+            position += len(data)
+            received += len(data)
+        elif record_type == RECORD_COPY and offset is not None:
+            source, size = struct.unpack(COPY_FORMAT, data)
+            if position + size > length:
+                raise ValueError("Chunk too long")
+            session.copy(source, size, offset + position, digest)
+            position += size
+            received += size
+        else:
+            raise ValueError("Unexpected record in the chunk data")
+
+
+def receive_chunks(conn, key, iv, sessions):
+    """
+    Receives chunks of a transfer over one of its additional connections.
+
+    Parameters:
+    - conn: The connection gateway from the client.
+    - key: The secret key used for decryption.
+    - iv: The initialization vector for decryption.
+    - sessions: The TransferSession of every chunked transfer in progress,
+      by session identifier.
+    """
+    reader = open_transfer(conn, key, iv)
+    if reader is None:
+        return
+    record_type, data = reader.receive()
+    if record_type != RECORD_JOIN:
+        raise ValueError("The connection does not join a transfer")
+    receive_joined_chunks(reader, data, sessions)
+
+
+def receive_joined_chunks(reader, session_id, sessions):
+    """
+    Receives the chunks an additional connection sends after its join
+    record, and confirms them.
+
+    Parameters:
+    - reader: The RecordReader of the connection.
+    - session_id: The plaintext of the join record.
+    - sessions: The chunked transfers in progress, by session identifier.
+    """
+    session = sessions.get(bytes(session_id))
+    if session is None:
+        raise ValueError("The connection does not join a known transfer")
+
+    end, received = receive_chunk_data(reader, session)
+    if struct.unpack(">Q", end)[0] != received:
+        raise ValueError("The chunk sizes do not match the data received")
+    reader.conn.sendall(TRANSFER_OK)
+
+
+def receive_manifest(reader, count):
+    """
+    Receives the manifest of a chunked transfer.
+
+    Parameters:
+    - reader: The RecordReader of the connection.
+    - count: The number of chunks of the file.
+
+    Returns:
+    - The SHA-256 of every chunk.
     """
-    cipher = AES.new(key, AES.MODE_CBC, iv)
-    return unpad(cipher.decrypt(encrypted_data), AES.block_size)
+    manifest = bytearray()
+    while len(manifest) < count * DIGEST_SIZE:
+        record_type, data = reader.receive()
+        if record_type != RECORD_MANIFEST:
+            raise ValueError("Incomplete manifest")
+        manifest += data
+    if len(manifest) != count * DIGEST_SIZE:
+        raise ValueError("Manifest too long")
+    return [
+        bytes(manifest[start : start + DIGEST_SIZE])
+        for start in range(0, len(manifest), DIGEST_SIZE)
+    ]
 
 
-def receive_file(conn, filename, key, iv, save_path):
+def receive_stream(reader, part_path, record_type, data):
     """
-    Receives a file from the client, decrypts it, and saves it to the specified path.
+    Receives the data records of a file sent in one piece and writes them
+    to part_path. The partial file is removed if the transfer fails.
+
+    Parameters:
+    - reader: The RecordReader of the connection.
+    - part_path: The temporary file to write.
+    - record_type, data: The first record after the filename.
+    """
+    size = 0
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY, 0o644)
+    try:
+        try:
+            while record_type != RECORD_END:
+                if record_type != RECORD_DATA:
+                    raise ValueError("Unexpected record in the file data")
+                write_at(fd, data, size)  # Write the decrypted data to the file
+                size += len(data)
+                record_type, data = reader.receive()
+        finally:
+            os.close(fd)
+        if struct.unpack(">Q", data)[0] != size:
+            raise ValueError("The file size does not match the data received")
+    except BaseException:
+        os.remove(part_path)  # Never leave a partial or unverified file behind
+        raise
+
+
+def receive_file(conn, key, iv, save_path, sessions=None):
+    """
+    Receives a file from the client, decrypts and verifies it, and saves it to
+    the specified path. The data goes to a temporary ".part" file that only
+    replaces the file once the whole transfer was verified. A chunked
+    transfer that fails keeps the ".part" file and its state file, so that
+    sending the file again only sends the missing chunks.
 
     Parameters:
     - conn: The connection gateway from the client.
-    - filename: The name of the file.
     - key: The secret key used for decryption.
     - iv: The initialization vector for decryption.
     - save_path: The path where the decrypted file will be saved.
+    - sessions: Where to register chunked transfers for receive_chunks, or
+      None to only accept files sent in one piece.
+
+    Returns:
+    - The name of the saved file, or None if the client closed the
+      connection instead of starting another transfer.
     """
-    full_path = os.path.join(
-        save_path, filename
-    )  # Construct the full path for the file
-    with open(full_path, "wb") as file:
-        while True:
-            data = conn.recv(1024)  # Receive data from the client
-            if not data:
-                break  # Stop if no more data is received
-            decrypted_data = decrypt_data(key, iv, data)  # Decrypt the received data
-            file.write(decrypted_data)  # Write the decrypted data to the file
+    reader = open_transfer(conn, key, iv)
+    if reader is None:
+        return None
+
+    record_type, name = reader.receive()
+    if record_type != RECORD_NAME:
+        raise ValueError("The transfer does not start with a filename")
+    return receive_named_file(reader, name, save_path, sessions)
+
+
+def receive_named_file(reader, name, save_path, sessions=None):
+    """
+    Receives the records of a file that follow its name record (see
+    receive_file).
+
+    Parameters:
+    - reader: The RecordReader of the connection.
+    - name: The plaintext of the name record.
+    - save_path: The path where the decrypted file will be saved.
+    - sessions: Where to register chunked transfers, or None.
+
+    Returns:
+    - The name of the saved file.
+    """
+    conn, key, iv = reader.conn, reader.key, reader.iv
+    filename = os.path.basename(str(name, "utf-8"))
+    if not filename:
+        raise ValueError("Empty filename")
+    print("Received from user: " + filename)
+
+    full_path = os.path.join(save_path, filename)  # Construct the full path
+    part_path = full_path + ".part"
+    record_type, data = reader.receive()
+    source = None
+    if record_type == RECORD_DELTA and sessions is not None:
+        block_size = struct.unpack(">L", data)[0]
+        if not MIN_BLOCK_SIZE <= block_size <= RECORD_SIZE:
+            raise ValueError("Invalid block size")
+        if os.path.isfile(full_path):
+            source = full_path  # Only what changed in it needs to be sent
+        send_signatures(conn, key, iv, source, block_size)
+        record_type, data = reader.receive()
+    codec = b""
+    if record_type == RECORD_COMPRESS and sessions is not None:
+        # The first codec offered that is installed here, 0 if there is none
+        codec = bytes([next((c for c in data if c in DECOMPRESSORS), 0)])
+        record_type, data = reader.receive()
+    if record_type != RECORD_PLAN or sessions is None:
+        receive_stream(reader, part_path, record_type, data)
+        os.replace(part_path, full_path)
+        return filename
+
+    session_id, size, chunk_size = struct.unpack(PLAN_FORMAT, data)
+    if chunk_size < MIN_CHUNK_SIZE or size > MAX_CHUNKS * chunk_size:
+        raise ValueError("Invalid chunk size")
+    digests = receive_manifest(reader, -(-size // chunk_size))
+    state_path = part_path + ".state"
+    if any(other.state_path == state_path for other in list(sessions.values())):
+        raise ValueError("The file is already being received")
+    session = TransferSession(part_path, size, chunk_size, digests, source)
+    if session.chunks:
+        print(f"Resuming with {len(session.chunks)} of {len(digests)} chunks")
+    sessions[session_id] = session
+    try:
+        # Tell the client which chunks to send and how; others may join now
+        conn.sendall(TRANSFER_OK + session.bitmap() + codec)
+        end = receive_chunk_data(reader, session)[0]
+    finally:
+        del sessions[session_id]
+        complete = session.close()
+    if not complete or struct.unpack(">Q", end)[0] != size:
+        raise ValueError("The file size does not match the data received")
+    os.replace(part_path, full_path)
+    os.remove(session.state_path)
+    return filename
+
+
+def serve_connection(conn, address, key, iv, save_path, sessions):
+    """
+    Serves a connection until the client closes it. The first record tells
+    the connections apart: the main connection of a client sends files one
+    after another, an additional one joins the chunked transfer of a file.
+    Failures end the connection but not the server, so a client that broke
+    off may connect again and resume.
+
+    Parameters:
+    - conn: The connection gateway from the client.
+    - address: The address of the client.
+    - key: The secret key used for decryption.
+    - iv: The initialization vector for decryption.
+    - save_path: The path where the decrypted files will be saved.
+    - sessions: The chunked transfers in progress, by session identifier.
+    """
+    files = 0  # Files received over the connection so far
+    try:
+        while (reader := open_transfer(conn, key, iv)) is not None:
+            record_type, data = reader.receive()
+            if record_type == RECORD_JOIN:
+                receive_joined_chunks(reader, data, sessions)
+                return
+            if record_type != RECORD_NAME:
+                raise ValueError("The transfer does not start with a filename")
+            if not files:
+                print("Connection from: " + str(address))
+            receive_named_file(reader, data, save_path, sessions)
+            conn.sendall(TRANSFER_OK)
+            files += 1
+            print("File has been received and decrypted successfully.")
+    except (ValueError, OSError, struct.error) as e:
+        print(f"File transfer from {address} failed: {e}")
+    finally:
+        conn.close()
 
 
 def server_program():
@@ -69,28 +834,26 @@ def server_program():
     except ValueError:
         print("Invalid hexadecimal key or IV format.")
         sys.exit(1)
+    if len(iv) < 12:
+        print("The IV must be at least 12 bytes long.")
+        sys.exit(1)
 
     # Create a socket and bind it to the provided IP address and port
     server_socket = socket.socket()
     server_socket.bind((ip_address, port))
-    server_socket.listen(2)
+    server_socket.listen(64)  # Room for the connections of chunked transfers
     print(f"Server listening on {ip_address}:{port}")
 
-    # Accept a connection
-    conn, address = server_socket.accept()
-    print("Connection from: " + str(address))
-
-    # Receive and process files from the client
+    # Serve every connection on its own thread: clients, the connections
+    # that send chunks for them, and clients that reconnect to resume
+    sessions = {}
     while True:
-        data = conn.recv(1024).decode()
-        if not data:
-            break  # Exit loop if no more data is received
-        print("Received from user: " + str(data))
-        filename = os.path.basename(data)
-        receive_file(conn, filename, key, iv, save_path)  # Save the received file
-        print("File has been received and decrypted successfully.")
-
-    conn.close()  # Close the connection
+        conn, address = server_socket.accept()
+        threading.Thread(
+            target=serve_connection,
+            args=(conn, address, key, iv, save_path, sessions),
+            daemon=True,
+        ).start()
 
 
 if __name__ == "__main__":
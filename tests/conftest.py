@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The server and client are scripts, not packages: import them by directory
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "Server"))
+sys.path.insert(0, os.path.join(root, "Client"))
@@ -0,0 +1,35 @@
+import socket
+import threading
+
+import numpy as np
+
+
+class StaticCapture:
+    """
+    Capture engine that shows the same picture in every frame, in place of
+    ScreenCapture on machines without a display.
+    """
+
+    def __init__(self, screen_number, width=320, height=192):
+        self.screen_number = screen_number
+        self.lock = threading.Lock()
+        self._frame = np.full((height, width, 3), 40 * screen_number, np.uint8)
+        self._frame[20:60, 20:120] = (30, 200, 90)
+
+    def grab(self, out=None):
+        if out is None or out.shape != self._frame.shape:
+            out = np.empty_like(self._frame)
+        out[:] = self._frame
+        return out
+
+    def close(self):
+        pass
+
+
+def free_port():
+    """
+    A loopback port nobody listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
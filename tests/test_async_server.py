@@ -0,0 +1,33 @@
+import asyncio
+import os
+import signal
+
+import client
+import server
+from fakes import StaticCapture, free_port
+
+
+def test_sigterm_with_connected_viewers_stops_cleanly(caplog):
+    port = free_port()
+
+    async def run():
+        serving = asyncio.create_task(
+            server.serve_screen_async(
+                "127.0.0.1", port, 0, screens=(1,), make_capture=StaticCapture
+            )
+        )
+        await asyncio.sleep(0.2)
+        connections = []
+        for multiplexed in (False, True):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(client.pack_hello([0, 0], 0, multiplexed))
+            await reader.read(1)  # Served until the first bytes arrive
+            connections.append(writer)
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(serving, 10)
+        for writer in connections:
+            writer.close()
+
+    asyncio.run(run())
+    assert "Exception in callback" not in caplog.text
+    assert "CancelledError" not in caplog.text
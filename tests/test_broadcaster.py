@@ -0,0 +1,69 @@
+import threading
+import time
+
+import server
+from fakes import StaticCapture
+
+
+class ChangingCapture(StaticCapture):
+    """
+    Capture engine where a small square moves a little in every frame.
+    """
+
+    def __init__(self, screen_number, width=1280, height=720):
+        super().__init__(screen_number, width, height)
+        self._count = 0
+
+    def grab(self, out=None):
+        out = super().grab(out)
+        self._count += 1
+        x = 100 + self._count % 200
+        out[100:140, x : x + 40] = (250, 250, 250)
+        return out
+
+
+def watch(viewer, received, stop, delay):
+    """
+    Takes the frames of a viewer every delay seconds until stop is set.
+    """
+    while not stop.is_set():
+        frame = viewer.frames.get()
+        if frame is None:
+            return
+        received.append(frame)
+        time.sleep(delay)
+
+
+def test_slow_viewer_does_not_force_keyframes_on_fast_viewer():
+    broadcaster = server.ScreenBroadcaster(
+        ChangingCapture(0), server.TileEncoder(), pacer=server.FramePacer(30)
+    )
+    fast, slow = broadcaster.add_viewer(), broadcaster.add_viewer()
+    stop = threading.Event()
+    fast_frames, slow_frames = [], []
+    threads = [
+        threading.Thread(target=watch, args=(fast, fast_frames, stop, 0)),
+        threading.Thread(target=watch, args=(slow, slow_frames, stop, 0.3)),
+    ]
+    broadcaster.start()
+    for thread in threads:
+        thread.start()
+    time.sleep(3)
+    stop.set()
+    broadcaster.stop()
+    fast.close()
+    slow.close()
+    for thread in threads:
+        thread.join()
+
+    assert len(fast_frames) > 40
+    # Only the first frame of the fast viewer is a keyframe, give or take a
+    # frame it lost itself on a busy machine
+    assert sum(frame.keyframe for frame in fast_frames) <= 3
+    # The slow viewer lost frames and resumed at keyframes of its own
+    assert sum(frame.keyframe for frame in slow_frames) > 1
+    for frames in (fast_frames, slow_frames):
+        # A delta frame always follows the frame it applies to
+        assert frames[0].keyframe
+        for previous, frame in zip(frames, frames[1:]):
+            assert frame.keyframe or frame.seq == previous.seq + 1
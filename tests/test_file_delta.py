@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import client_files
+import server_files
+
+BLOCK_SIZE = 4 << 10
+
+
+def rebuild(old, new, block_size):
+    """
+    Rebuilds new from the server's old copy the way a delta transfer does:
+    the server computes the signatures of its copy, the client finds the
+    blocks in its file, and the copies and the sent bytes make up the file.
+    """
+    signatures = server_files.block_signatures(old, block_size)
+    # The signatures travel as bytes between the two sides
+    signatures = np.frombuffer(signatures.tobytes(), client_files.SIGNATURE)
+    delta = client_files.find_copies(memoryview(new), signatures, block_size)
+    parts = []
+    for offset, length, source in delta.parts(0, len(new)):
+        if source is None:
+            parts.append(new[offset : offset + length])
+        else:
+            parts.append(old[source : source + length])
+    return b"".join(parts), delta.copied()
+
+
+@pytest.mark.parametrize("block_size", [BLOCK_SIZE, 64 << 10])
+def test_rolling_checksums_match_the_server_signatures(block_size):
+    # Bytes near 255 make the weighted sum of a 64 KiB block wrap around 2^32
+    data = np.random.default_rng(1).integers(200, 256, 8 * block_size, np.uint8)
+    data = data.tobytes()
+    signatures = server_files.block_signatures(data, block_size)
+    a, b = client_files.rolling_checksums(data, block_size)
+    assert np.array_equal(a[::block_size], signatures["a"])
+    assert np.array_equal(b[::block_size], signatures["b"])
+
+
+def test_delta_rebuilds_a_file_with_inserted_and_deleted_bytes():
+    rng = np.random.default_rng(2)
+    old = rng.bytes(3 << 20)
+    # Edits near the 1 MiB batches of offsets the client checks at a time
+    new = (
+        old[:1000]
+        + rng.bytes(777)  # Inserted
+        + old[1000 : (1 << 20) - 5000]
+        + old[(1 << 20) + 3000 : 2 << 20]  # 8000 bytes deleted
+        + rng.bytes(BLOCK_SIZE * 3 + 1)  # Inserted
+        + old[(2 << 20) + 10 :]  # 10 bytes deleted
+    )
+    rebuilt, copied = rebuild(old, new, BLOCK_SIZE)
+    assert rebuilt == new
+    assert copied > len(new) - 12 * BLOCK_SIZE
+
+
+def test_delta_of_a_file_shorter_than_one_block():
+    old = np.random.default_rng(3).bytes(BLOCK_SIZE - 1)
+    rebuilt, copied = rebuild(old, old, BLOCK_SIZE)
+    assert rebuilt == old
+    assert copied == 0  # No whole block to copy, everything is sent
+
+    new = old[:100] + b"changed" + old[100:]
+    rebuilt, copied = rebuild(old, new, BLOCK_SIZE)
+    assert rebuilt == new
+    assert copied == 0
+
+
+def test_delta_of_a_file_that_is_a_multiple_of_the_block_size():
+    old = np.random.default_rng(4).bytes(16 * BLOCK_SIZE)
+    rebuilt, copied = rebuild(old, old, BLOCK_SIZE)
+    assert rebuilt == old
+    assert copied == len(old)
+
+    # The last block of the new file is the server's last block
+    new = old[BLOCK_SIZE:] + old[:BLOCK_SIZE]
+    rebuilt, copied = rebuild(old, new, BLOCK_SIZE)
+    assert rebuilt == new
+    assert copied == len(new)
+
+    # A partial block at the end is sent
+    new = old + b"tail"
+    rebuilt, copied = rebuild(old, new, BLOCK_SIZE)
+    assert rebuilt == new
+    assert copied == len(old)
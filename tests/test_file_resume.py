@@ -0,0 +1,84 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import client_files
+import server_files
+from fakes import free_port
+
+CHUNK_SIZE = 256 << 10
+
+
+def send(port, key, iv, path):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            client_files.__file__,
+            "127.0.0.1",
+            str(port),
+            key,
+            iv,
+            path,
+            "--chunk-size",
+            str(CHUNK_SIZE),
+            "--connections",
+            "2",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def test_resume_against_the_same_server(tmp_path):
+    source = tmp_path / "source.bin"
+    data = np.random.default_rng(0).bytes(96 << 20)
+    source.write_bytes(data)
+    received = tmp_path / "received"
+    received.mkdir()
+    key, iv = os.urandom(16).hex(), os.urandom(16).hex()
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            server_files.__file__,
+            "127.0.0.1",
+            str(port),
+            key,
+            iv,
+            str(received),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        for line in server.stdout:
+            if "listening" in line:
+                break
+
+        # Kill the client once the server verified a few chunks
+        state = received / "source.bin.part.state"
+        client = send(port, key, iv, str(source))
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and client.poll() is None:
+            if state.exists() and len(state.read_text().splitlines()) > 4:
+                break
+            time.sleep(0.002)
+        assert client.poll() is None, "The transfer finished before the kill"
+        client.send_signal(signal.SIGKILL)
+        client.wait()
+
+        client = send(port, key, iv, str(source))
+        output = client.communicate(timeout=60)[0]
+        assert client.returncode == 0
+        assert "Resuming" in output
+        assert server.poll() is None  # Still serving after the failure
+        assert (received / "source.bin").read_bytes() == data
+        assert not state.exists()
+    finally:
+        server.terminate()
+        server.communicate()
@@ -0,0 +1,80 @@
+import struct
+
+import numpy as np
+
+import client
+import server
+
+WIDTH, HEIGHT = 640, 384
+
+
+def page(height, width):
+    """
+    Seeded content that differs at every pixel.
+    """
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3), np.uint8)
+
+
+def encode_pair(previous, frame):
+    """
+    Encodes previous as a keyframe and frame as the delta that follows it,
+    and decodes both on a viewer.
+
+    Returns:
+    - The delta frame's payload and the picture the viewer shows after it.
+    """
+    encoder = server.TileEncoder(server.CODECS["zlib"], tile_size=32)
+    decoder = client.StreamDecoder()
+    payload, keyframe = encoder.encode(previous)
+    assert keyframe
+    decoder.decode(b"".join(payload))
+    payload, keyframe = encoder.encode(frame)
+    assert not keyframe
+    payload = b"".join(payload)
+    return payload, decoder.decode(payload).copy()
+
+
+def copy_count(payload):
+    """
+    The number of copies a move frame starts with.
+    """
+    return struct.unpack_from(">BHHHH", payload, len(server.MOVE_MAGIC))[3]
+
+
+def direct(frame):
+    """
+    The picture a viewer shows for frame sent as a keyframe.
+    """
+    payload, _ = server.TileEncoder(server.CODECS["zlib"]).encode(frame)
+    return client.StreamDecoder().decode(b"".join(payload))
+
+
+def test_scrolled_frame_decodes_like_a_keyframe():
+    content = page(2 * HEIGHT, WIDTH)
+    previous, frame = content[:HEIGHT], content[40 : 40 + HEIGHT]
+    payload, picture = encode_pair(previous, frame)
+    assert payload.startswith(server.MOVE_MAGIC) and copy_count(payload) > 0
+    assert np.array_equal(picture, direct(frame))
+    assert np.array_equal(picture, frame)
+
+
+def test_horizontally_moved_frame_decodes_like_a_keyframe():
+    content = page(HEIGHT, 2 * WIDTH)
+    previous, frame = content[:, 100 : 100 + WIDTH], content[:, 70 : 70 + WIDTH]
+    payload, picture = encode_pair(previous, frame)
+    assert payload.startswith(server.MOVE_MAGIC) and copy_count(payload) > 0
+    assert np.array_equal(picture, direct(frame))
+
+
+def test_frame_without_anchors_is_sent_as_tiles():
+    previous = np.full((HEIGHT, WIDTH, 3), 128, np.uint8)
+    frame = previous.copy()
+    # Flat blocks change many tiles but have no segments to find a motion with
+    frame[64:192, 64:192] = (20, 40, 60)
+    encoder = server.TileEncoder(server.CODECS["zlib"], tile_size=32)
+    encoder.encode(previous)
+    assert encoder.find_motion(frame, encoder.dirty_tiles(frame)) is None
+
+    payload, picture = encode_pair(previous, frame)
+    assert payload.startswith(server.TILE_MAGIC)
+    assert np.array_equal(picture, direct(frame))
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import time
+import types
+
+import cv2
+import numpy as np
+
+import replay
+import server
+
+REPLAY = os.path.join(os.path.dirname(replay.__file__), "replay.py")
+START = 1_700_000_000_000_000  # Capture timestamp of the first frame, in us
+
+
+def screen(number, width=320, height=192):
+    """
+    A frame with a gradient background and a box that moves with number.
+    """
+    frame = np.zeros((height, width, 3), np.uint8)
+    frame[:] = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+    x = 16 + 8 * number
+    frame[40:104, x : x + 64] = (30, 200, 90)
+    return frame
+
+
+def record(path, encoder, count):
+    """
+    Encodes count frames with a real encoder and records them.
+
+    Returns:
+    - The frames that were encoded.
+    """
+    recorder = server.SessionRecorder(path, flush_interval=0.05)
+    frames = []
+    for number in range(count):
+        frame = screen(number)
+        payload, keyframe = encoder.encode(frame)
+        encoded = server.EncodedFrame(
+            payload, number, START + number * 100_000, keyframe, encoder.codec.codec_id
+        )
+        assert recorder.record(0, encoded)
+        frames.append(frame)
+    recorder.close()
+    return frames
+
+
+def run_replay(*args):
+    return subprocess.run(
+        [sys.executable, REPLAY, *args], capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_jpeg_recording_replays(tmp_path):
+    path = str(tmp_path / "session.rrec")
+    frames = record(path, server.FullFrameEncoder(server.CODECS["jpeg"]), 5)
+
+    assert "screen 0 jpeg: 5 frames, 5 keyframes" in run_replay(path, "--info")
+    snapshot = str(tmp_path / "snapshot.png")
+    run_replay(path, "--start", "0.25", "--snapshot", snapshot)
+    image = cv2.imread(snapshot)
+    assert image.shape == frames[2].shape
+    assert np.abs(image.astype(int) - frames[2]).mean() < 4
+
+
+def test_recorder_survives_a_frame_it_cannot_write(tmp_path):
+    path = str(tmp_path / "session.rrec")
+    recorder = server.SessionRecorder(path, flush_interval=0.05)
+    codec_id = server.CODECS["jpeg"].codec_id
+    unwritable = types.SimpleNamespace(
+        payload=[object()],
+        size=1,
+        seq=0,
+        timestamp=START,
+        keyframe=True,
+        codec_id=codec_id,
+    )
+    assert recorder.record(0, unwritable)
+    deadline = time.monotonic() + 5
+    while not recorder._failed and time.monotonic() < deadline:
+        time.sleep(0.01)  # Until the writer reached the frame
+
+    payload = server.FullFrameEncoder().encode(screen(0))[0]
+    delta = server.EncodedFrame(payload, 1, START + 1, False, codec_id)
+    keyframe = server.EncodedFrame(payload, 2, START + 2, True, codec_id)
+    assert not recorder.record(0, delta)  # Asks for a keyframe to resume from
+    assert recorder.record(0, keyframe)
+    recorder.close()
+
+    recording = replay.Recording(path)
+    assert recording.index["timestamp"].tolist() == [START + 2]
+    recording.close()
+
+
+def test_seek_decodes_delta_frames_from_the_nearest_keyframe(tmp_path):
+    path = str(tmp_path / "session.rrec")
+    encoder = server.TileEncoder(
+        server.CODECS["zlib"], tile_size=32, keyframe_interval=4
+    )
+    frames = record(path, encoder, 12)
+
+    recording = replay.Recording(path)
+    entries = recording.frames(0, "zlib")
+    keyframes = entries["flags"] & server.FLAG_KEYFRAME
+    assert len(entries) == 12 and 1 < keyframes.sum() < 12
+    # Every frame, and times between frames, decode to the lossless picture
+    for number, frame in enumerate(frames):
+        timestamp = START + number * 100_000
+        assert np.array_equal(recording.frame_at(entries, timestamp), frame)
+        assert np.array_equal(recording.frame_at(entries, timestamp + 50_000), frame)
+    position, keyframe = replay.Recording.seek(entries, START + 650_000)
+    assert position == 6 and keyframe == max(np.flatnonzero(keyframes[:7]))
+    recording.close()
+
+
+def test_tile_recording_replays_with_jpeg(tmp_path):
+    path = str(tmp_path / "session.rrec")
+    frames = record(path, server.TileEncoder(server.CODECS["jpeg"], tile_size=32), 8)
+
+    info = run_replay(path, "--info")
+    assert "screen 0 jpeg: 8 frames, 1 keyframes" in info
+    snapshot = str(tmp_path / "snapshot.png")
+    run_replay(path, "--start", "0.7", "--snapshot", snapshot)
+    image = cv2.imread(snapshot)
+    assert np.abs(image.astype(int) - frames[7]).mean() < 4
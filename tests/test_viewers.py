@@ -0,0 +1,87 @@
+import socket
+import struct
+import threading
+
+import client
+import server
+from fakes import StaticCapture
+
+
+def test_viewer_of_a_static_screen_is_removed_when_it_disconnects():
+    pools = server.make_pools({0}, StaticCapture, server.TileEncoder, None, 30, "jpeg")
+    listener = socket.create_server(("127.0.0.1", 0))
+    viewer_socket = socket.create_connection(listener.getsockname())
+    conn, addr = listener.accept()
+    serving = threading.Thread(
+        target=server.client_thread, args=(conn, addr, 0, pools), daemon=True
+    )
+    serving.start()
+    try:
+        viewer_socket.sendall(client.pack_hello([0, 0], 0))
+        assert client.FrameReceiver(viewer_socket).receive() is not None
+        broadcaster = pools[0].get()
+        assert len(broadcaster._viewers) == 1
+
+        # Nothing changes on screen, so no frame wakes the sender up
+        viewer_socket.close()
+        serving.join(5)
+        assert not serving.is_alive()
+        assert broadcaster._viewers == []
+    finally:
+        viewer_socket.close()
+        listener.close()
+        server.stop_pools(pools)
+
+
+def test_viewer_that_resets_during_the_hello_is_closed():
+    pools = server.make_pools({0}, StaticCapture, server.TileEncoder, None, 30, "jpeg")
+    listener = socket.create_server(("127.0.0.1", 0))
+    viewer_socket = socket.create_connection(listener.getsockname())
+    conn, addr = listener.accept()
+    errors = []
+    previous_hook = threading.excepthook
+    threading.excepthook = errors.append
+    serving = threading.Thread(
+        target=server.client_thread, args=(conn, addr, 0, pools), daemon=True
+    )
+    serving.start()
+    try:
+        # Close with SO_LINGER 0 so the server sees a reset instead of an EOF
+        viewer_socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+        )
+        viewer_socket.sendall(client.pack_hello([0, 0], 0)[:3])
+        viewer_socket.close()
+        serving.join(5)
+        assert not serving.is_alive()
+        assert errors == []
+        assert conn.fileno() == -1
+    finally:
+        threading.excepthook = previous_hook
+        listener.close()
+        server.stop_pools(pools)
+
+
+def test_viewer_without_hello_of_a_static_screen_is_removed_when_it_disconnects():
+    pools = server.make_pools({0}, StaticCapture, server.TileEncoder, None, 30, "jpeg")
+    listener = socket.create_server(("127.0.0.1", 0))
+    viewer_socket = socket.create_connection(listener.getsockname())
+    conn, addr = listener.accept()
+    serving = threading.Thread(
+        target=server.client_thread, args=(conn, addr, 0, pools), daemon=True
+    )
+    serving.start()
+    try:
+        # An old client only listens, so the server gives up on the hello
+        assert client.FrameReceiver(viewer_socket).receive() is not None
+        broadcaster = pools[0].get()
+        assert len(broadcaster._viewers) == 1
+
+        viewer_socket.close()
+        serving.join(5)
+        assert not serving.is_alive()
+        assert broadcaster._viewers == []
+    finally:
+        viewer_socket.close()
+        listener.close()
+        server.stop_pools(pools)